@@ -0,0 +1,3 @@
+# bench/__init__.py
+# Benchmarks del proyecto SCEE. Se ejecutan como módulos desde trabajo-final/:
+# python -m bench.<nombre>
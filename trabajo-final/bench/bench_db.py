@@ -0,0 +1,169 @@
+# bench/bench_db.py
+"""
+Backends de base de datos (SQLite y PostgreSQL) lado a lado.
+
+1. Conformidad: la misma secuencia de operaciones de db_manager corre contra
+   cada backend y se comparan los resultados entre sí (mismas filas, mismos
+   tipos, mismo formato de timestamp).
+2. Escritura: P procesos (como los workers) guardan lotes de mensajes con
+   save_messages durante unos segundos; se informan mensajes/s por backend.
+
+PostgreSQL necesita una BD descartable: con --reset se borran sus tablas.
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_db [--backends sqlite postgresql] [--dsn postgresql://...] \\
+        [--reset] [--procs 1 4] [--batch 200] [--seconds 5]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from src import db_manager
+from src.config import DB_DSN
+
+RESET_TABLES = "DROP TABLE IF EXISTS archivos, blobs, mensajes, salas, usuarios CASCADE"
+
+
+def _load(name: str, args):
+    """Módulo del backend, apuntado a la BD del benchmark."""
+    backend = db_manager.load_backend(name)
+    if name == "sqlite":
+        backend.DB_NAME = args.sqlite_path
+    else:
+        backend.DB_DSN = args.dsn
+    return backend
+
+
+async def _reset(backend, name: str, args):
+    if name == "sqlite":
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite_path + suffix):
+                os.remove(args.sqlite_path + suffix)
+    elif args.reset:
+        conn = await backend._connect()
+        try:
+            await conn.execute(RESET_TABLES)
+        finally:
+            await conn.close()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def conformance(backend) -> dict:
+    """Secuencia fija de operaciones; devuelve lo observado en cada paso."""
+    seen = {}
+    await backend.init_db()
+    await backend.open_pool(size=2, search_size=1)
+    try:
+        seen["login_ok"] = await backend.verify_user("profe", "123")
+        seen["login_bad"] = await backend.verify_user("profe", "mal")
+        seen["login_unknown"] = await backend.verify_user("nadie", "x")
+        seen["rooms"] = await backend.get_rooms()
+        room_id = await backend.create_room("Bench")
+        seen["create_room"] = room_id is not None
+        seen["create_duplicate"] = await backend.create_room("Bench")
+
+        await backend.save_message(1, room_id, "mensaje suelto")
+        await backend.save_message(1, room_id, "ÁRBOL en São Paulo")
+        ts = _now()
+        ids = await backend.save_messages([(2, room_id, f"lote {i} sobre Física", ts) for i in range(10)])
+        seen["batch_ids_ascending"] = ids == sorted(ids) and len(set(ids)) == 10
+        history = await backend.get_chat_history(room_id, limit=5)
+        seen["history"] = [(m["contenido"], m["username"], m["timestamp"] == ts) for m in history]
+        page = await backend.get_history_page(room_id, before=ids[5], limit=3)
+        seen["page_before"] = [m["contenido"] for m in page]
+        page = await backend.get_history_page(room_id, after=ids[5], limit=3)
+        seen["page_after"] = [m["contenido"] for m in page]
+        seen["page_keys"] = sorted(page[0])
+
+        found = await backend.search_messages("fisica", room_id=room_id, limit=3)
+        seen["search_count"] = len(found)
+        seen["search_keys"] = sorted(found[0]) if found else []
+        seen["search_user"] = len(await backend.search_messages("lote", username="profe"))
+        seen["search_prefix"] = len(await backend.search_messages("sue*"))
+        seen["search_accents"] = [len(await backend.search_messages(word, room_id=room_id))
+                                  for word in ("arbol", "Árbol", "sao", "SÃO")]
+
+        digest = "ab" * 32
+        record = await backend.add_file_ref(room_id, 1, "a.txt", digest, 10, "blobs/ab/x", create=True)
+        seen["file_ref"] = {k: v for k, v in record.items() if k != "id"}
+        seen["file_by_hash"] = (await backend.get_room_file_by_hash(room_id, digest))["nombre"]
+        seen["blob"] = await backend.find_blob(digest)
+        seen["room_files"] = [f["nombre"] for f in await backend.get_room_files(room_id, 10)]
+        seen["file"] = sorted(await backend.get_file(record["id"]))
+        seen["released"] = await backend.release_room_files(room_id)
+        seen["blob_after"] = await backend.find_blob(digest)
+        seen["delete_room"] = await backend.delete_room(room_id)
+        seen["delete_again"] = await backend.delete_room(room_id)
+    finally:
+        await backend.close_pool()
+    return seen
+
+
+def _writer_process(name: str, args, seconds: float, batch: int) -> int:
+    async def run():
+        backend = _load(name, args)
+        await backend.open_pool(size=1)
+        rooms = [room["id"] for room in await backend.get_rooms()]
+        written = 0
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                ts = _now()
+                await backend.save_messages(
+                    [(1, rooms[i % len(rooms)], f"mensaje de carga {i}", ts) for i in range(batch)]
+                )
+                written += batch
+        finally:
+            await backend.close_pool()
+        return written
+    return asyncio.run(run())
+
+
+def bench_writes(name: str, args, procs: int) -> float:
+    with multiprocessing.get_context("spawn").Pool(procs) as pool:
+        counts = pool.starmap(_writer_process, [(name, args, args.seconds, args.batch)] * procs)
+    return sum(counts) / args.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=["sqlite", "postgresql"])
+    parser.add_argument('--dsn', default=DB_DSN)
+    parser.add_argument('--reset', action='store_true', help="borrar las tablas de PostgreSQL antes de empezar")
+    parser.add_argument('--sqlite-path', default=os.path.join(tempfile.gettempdir(), "bench_db.sqlite"))
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.backends:
+        backend = _load(name, args)
+        asyncio.run(_reset(backend, name, args))
+        results[name] = asyncio.run(conformance(backend))
+
+    print("--- Conformidad ---")
+    reference, *others = args.backends
+    for key, expected in results[reference].items():
+        status = "ok" if all(results[other][key] == expected for other in others) else "DISTINTO"
+        print(f"{key:<22} {status}")
+        if status != "ok":
+            for name in args.backends:
+                print(f"    {name:<11} {results[name][key]!r}")
+
+    print("--- Escritura (save_messages) ---")
+    for name in args.backends:
+        for procs in args.procs:
+            rate = bench_writes(name, args, procs)
+            print(f"{name:<11} {procs:>2} proc, lotes de {args.batch}: {rate:12,.0f} mensajes/s")
+
+
+if __name__ == '__main__':
+    main()
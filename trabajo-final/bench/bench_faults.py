@@ -0,0 +1,185 @@
+# bench/bench_faults.py
+"""
+Inyección de fallas en la persistencia: una fila inválida o un error de la
+BD no deben llevarse puesto al resto.
+
+1. Write-behind: un lote de mensajes válidos con uno a una sala inexistente
+   (falla la FK). Los válidos deben quedar en la BD con su id y on_flushed
+   sólo debe recibirlos a ellos.
+2. Pool: después de la falla, otra escritura por el mismo pool funciona (la
+   transacción fallida se deshizo antes de devolver la conexión).
+3. Almacenamiento: una subida a una sala inexistente falla en add_file_ref
+   dentro del proceso de almacenamiento. El proceso sigue vivo (mismo pid)
+   y la subida siguiente funciona sobre su única conexión.
+4. Almacenamiento: se mata el proceso con una subida abierta; StorageClient
+   lo relanza, el id de esa subida no se reusa ni se acepta, y las subidas
+   nuevas funcionan.
+
+Cada backend corre en su propio proceso, con SCEE_DB_TYPE/SCEE_DB_DSN en el
+entorno: así db_manager (y el proceso de almacenamiento, también al
+relanzarse) usan ese backend. Los archivos van a un directorio descartable;
+PostgreSQL necesita una BD descartable: con --reset se borran sus tablas.
+Los errores que se ven en el log son los provocados. Sale con código 1 si
+algún chequeo falla.
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_faults [--backends sqlite postgresql] [--dsn postgresql://...] \\
+        [--reset] [--batch 50] [--dir /tmp/scee-faults]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from src import db_manager
+from src.config import DB_DSN
+from src.storage_process import StorageClient, StorageError
+from src.write_behind import MessageWriter
+from bench.bench_db import RESET_TABLES
+
+MISSING_ROOM = 999999
+ROOM = 1
+USER = 1
+
+
+async def _upload(storage: StorageClient, room_id: int, data: bytes) -> dict:
+    upload_id, _ = await storage.begin(room_id, USER, "falla.txt", len(data))
+    await storage.write_chunk(upload_id, data)
+    return await storage.finish(upload_id)
+
+
+async def write_behind_checks(batch: int) -> dict:
+    notified = []
+    # Un único lote: se junta todo antes de que venza el intervalo
+    writer = MessageWriter(flush_interval_ms=5000, max_batch=batch + 1,
+                           on_flushed=lambda room_id, record: notified.append(record))
+    writer.start()
+    valid = []
+    for i in range(batch):
+        valid.append(await writer.put(USER, "profe", ROOM, f"válido {i}"))
+        if i == batch // 2:
+            bad = await writer.put(USER, "profe", MISSING_ROOM, "a una sala inexistente")
+    await writer.sync()
+    await writer.stop()
+
+    stored = {m["contenido"] for m in await db_manager.get_chat_history(ROOM, batch)}
+    return {
+        "lote: válidos con id": all(record["id"] is not None for record in valid),
+        "lote: válidos en la BD": stored == {record["contenido"] for record in valid},
+        "lote: inválido descartado": bad["id"] is None and writer.failed == 1,
+        "lote: on_flushed sólo válidos": notified == valid,
+        "pool: escritura tras la falla": await db_manager.create_room(f"Tras la falla {os.getpid()}") is not None,
+    }
+
+
+async def storage_checks(storage: StorageClient) -> dict:
+    seen = {}
+    await storage.attach()
+    pid = storage.proc.pid
+    try:
+        await _upload(storage, MISSING_ROOM, b"sin sala")
+        seen["almacenamiento: error informado"] = False
+    except StorageError:
+        seen["almacenamiento: error informado"] = True
+    seen["almacenamiento: mismo proceso"] = (
+        storage.proc.pid == pid and storage.proc.is_alive() and storage.restarts == 0
+    )
+    record = await _upload(storage, ROOM, b"con sala")
+    seen["almacenamiento: subida siguiente"] = record["nombre"] == "falla.txt"
+
+    # Subida abierta al morir el proceso: su id no debe volver a usarse
+    stale_id, _ = await storage.begin(ROOM, USER, "a medias.txt", 10)
+    os.kill(pid, signal.SIGKILL)
+    for _ in range(100):
+        if storage.restarts and storage._writer is not None and not storage._writer.is_closing():
+            break
+        await asyncio.sleep(0.1)
+    seen["almacenamiento: relanzado"] = storage.restarts == 1 and storage.proc.pid != pid
+    # Tantas subidas nuevas como para alcanzar el id viejo si se reusara
+    new_ids = [(await storage.begin(ROOM, USER, "nueva.txt", 10))[0] for _ in range(stale_id)]
+    try:
+        await storage.write_chunk(stale_id, b"0123456789")
+        seen["almacenamiento: subida vieja rechazada"] = False
+    except StorageError:
+        seen["almacenamiento: subida vieja rechazada"] = stale_id not in new_ids
+    for upload_id in new_ids:
+        await storage.abort(upload_id)
+    record = await _upload(storage, ROOM, b"tras relanzar")
+    seen["almacenamiento: subida tras relanzar"] = record["nombre"] == "falla.txt"
+    return seen
+
+
+async def run(storage: StorageClient, batch: int) -> dict:
+    await db_manager.open_pool(size=2)
+    try:
+        results = await write_behind_checks(batch)
+        results.update(await storage_checks(storage))
+    finally:
+        await storage.close()
+        await db_manager.close_pool()
+    return results
+
+
+async def _reset(name: str, reset: bool):
+    if name == "postgresql" and reset:
+        conn = await db_manager.backend._connect()
+        try:
+            await conn.execute(RESET_TABLES)
+        finally:
+            await conn.close()
+    await db_manager.init_db()
+
+
+def _backend_process(name: str, args, results):
+    """Corre los chequeos con el backend `name` (ya elegido por el entorno)."""
+    # La BD SQLite y los archivos van al directorio descartable (también para
+    # el proceso de almacenamiento relanzado, que vuelve a importar la config)
+    os.chdir(args.dir)
+    asyncio.run(_reset(name, args.reset))
+    # Como en el servidor: el proceso de almacenamiento se lanza antes del loop
+    storage = StorageClient(root=os.path.join(args.dir, "uploads"))
+    try:
+        results.put(asyncio.run(run(storage, args.batch)))
+    finally:
+        storage.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=["sqlite", "postgresql"])
+    parser.add_argument('--dsn', default=DB_DSN)
+    parser.add_argument('--reset', action='store_true', help="borrar las tablas de PostgreSQL antes de empezar")
+    parser.add_argument('--batch', type=int, default=50, help="mensajes válidos en el lote con la fila inválida")
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), "scee-faults"))
+    args = parser.parse_args()
+    args.dir = os.path.abspath(args.dir)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in args.backends:
+        shutil.rmtree(args.dir, ignore_errors=True)
+        os.makedirs(args.dir)
+        os.environ["SCEE_DB_TYPE"] = name
+        os.environ["SCEE_DB_DSN"] = args.dsn
+        queue = context.SimpleQueue()
+        proc = context.Process(target=_backend_process, args=(name, args, queue))
+        proc.start()
+        proc.join()
+        results[name] = queue.get() if not queue.empty() else {"ejecución": False}
+
+    print("--- Fallas inyectadas ---")
+    print(f"{'':<38} " + " ".join(f"{name:<11}" for name in args.backends).rstrip())
+    keys = dict.fromkeys(key for seen in results.values() for key in seen)
+    for key in keys:
+        row = ("ok" if results[name].get(key) else "FALLA" for name in args.backends)
+        print(f"{key:<38} " + " ".join(f"{status:<11}" for status in row).rstrip())
+    if not all(all(seen.values()) for seen in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# bench/bench_login.py
+"""
+Benchmark de autenticación: logins por segundo con scrypt (por núcleo y con
+un pool de procesos) frente a la reanudación con token de sesión.
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_login [--seconds 3] [--procs 1 2 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from src import security
+
+
+def _kdf_loop(seconds: float) -> int:
+    stored = security.hash_password('clave-de-prueba')
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        security.verify_password('clave-de-prueba', stored)
+        count += 1
+    return count
+
+
+def bench_kdf(procs: int, seconds: float) -> float:
+    with multiprocessing.Pool(procs) as pool:
+        counts = pool.map(_kdf_loop, [seconds] * procs)
+    return sum(counts) / seconds
+
+
+def bench_token(seconds: float) -> float:
+    token = security.issue_session_token({"id": 1, "username": "profe", "rol": "profesor"})
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        security.verify_session_token(token)
+        count += 1
+    return count / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    print(f"scrypt N={security.SCRYPT_N} r={security.SCRYPT_R} p={security.SCRYPT_P}")
+    for procs in args.procs:
+        rate = bench_kdf(procs, args.seconds)
+        print(f"KDF   {procs:>2} proc: {rate:10.1f} logins/s  ({rate / procs:8.1f} por núcleo)")
+    print(f"Token  1 proc: {bench_token(args.seconds):10.1f} reanudaciones/s")
+
+
+if __name__ == '__main__':
+    main()
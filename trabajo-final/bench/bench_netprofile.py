@@ -0,0 +1,103 @@
+# bench/bench_netprofile.py
+"""
+Benchmark de red: latencia ida y vuelta (p50/p99) y throughput de tramas del
+protocolo contra un servidor eco, para cada perfil de red y event loop
+(asyncio estándar vs uvloop).
+
+Cada combinación corre en un proceso nuevo para que la política del loop
+no se mezcle entre mediciones.
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_netprofile [--messages 5000] [--clients 20]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from src import protocol, netprofile
+from src.config import NET_PROFILES
+
+MESSAGE = {"action": "message", "content": "¿Alguien tiene el apunte de la clase 4?"}
+
+
+async def _echo(reader, writer, framing, profile):
+    netprofile.tune_socket(writer.get_extra_info('socket'), profile)
+    try:
+        while True:
+            message = await framing.read(reader)
+            if message is None:
+                break
+            writer.write(framing.encode(message))
+            await writer.drain()
+    except asyncio.IncompleteReadError:
+        pass  # El cliente cerró al terminar su tanda
+    finally:
+        writer.close()
+
+
+async def _client(port, framing, profile, messages, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    netprofile.tune_socket(writer.get_extra_info('socket'), profile)
+    frame = framing.encode(MESSAGE)
+    for _ in range(messages):
+        start = time.perf_counter()
+        writer.write(frame)
+        await framing.read(reader)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _bench(profile_name, messages, clients):
+    profile = NET_PROFILES[profile_name]
+    framing = protocol.negotiate("binary", protocol.best_codec())
+    sock = netprofile.listen_socket('127.0.0.1', 0, profile)
+    server = await asyncio.start_server(
+        lambda r, w: _echo(r, w, framing, profile), sock=sock, backlog=profile["backlog"]
+    )
+    port = sock.getsockname()[1]
+    latencies = []
+    async with server:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _client(port, framing, profile, messages // clients, latencies) for _ in range(clients)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2] * 1e6,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1e6,
+        "rate": len(latencies) / elapsed,
+    }
+
+
+def _run_one(args):
+    use_uvloop, profile_name, messages, clients = args
+    loop_name = netprofile.install_event_loop(use_uvloop)
+    if use_uvloop and loop_name != "uvloop":
+        return None
+    return asyncio.run(_bench(profile_name, messages, clients))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'loop':<8} {'perfil':<12} {'p50 µs':>9} {'p99 µs':>9} {'msg/s':>10}")
+    ctx = multiprocessing.get_context('spawn')
+    for use_uvloop in (False, True):
+        for profile_name in NET_PROFILES:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(_run_one, ((use_uvloop, profile_name, args.messages, args.clients),))
+            loop_name = "uvloop" if use_uvloop else "asyncio"
+            if result is None:
+                print(f"{loop_name:<8} (no está instalado)")
+                break
+            print(f"{loop_name:<8} {profile_name:<12} {result['p50']:>9.1f} {result['p99']:>9.1f} {result['rate']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
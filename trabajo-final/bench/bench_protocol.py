@@ -0,0 +1,70 @@
+# bench/bench_protocol.py
+"""
+Micro-benchmark del protocolo: costo de codificar/decodificar y bytes en el
+cable para cada enmarcado (líneas JSON vs binario con prefijo de longitud).
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_protocol [--iterations 20000]
+"""
+
+import argparse
+import time
+from src import protocol
+
+SAMPLES = {
+    "broadcast": {"action": "broadcast", "sender": "alumno", "content": "¿Alguien tiene el apunte de la clase 4?"},
+    "history": {
+        "action": "join_success", "room_id": 1, "room_name": "General",
+        "history": [
+            {"id": i, "contenido": f"Mensaje número {i} de la sala", "timestamp": "2026-10-18 12:00:00",
+             "username": "profe" if i % 2 else "alumno"}
+            for i in range(50)
+        ],
+    },
+}
+
+
+def _framings():
+    yield "line/json", protocol.LINE_FRAMING
+    for name in protocol.CODECS:
+        yield f"binary/{name}", protocol.negotiate("binary", name)
+
+
+def _decode(framing, frame: bytes):
+    # Misma separación que hace Framing.read() sobre el stream
+    if framing.binary:
+        return framing.parse_message(frame[protocol.FRAME_HEADER_SIZE:])
+    return framing.parse_message(frame)
+
+
+def run(iterations: int):
+    print(f"{'mensaje':<10} {'enmarcado':<16} {'bytes':>7} {'encode µs':>10} {'decode µs':>10}")
+    for sample_name, message in SAMPLES.items():
+        for name, framing in _framings():
+            frame = framing.encode(message)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                framing.encode(message)
+            encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                _decode(framing, frame)
+            decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+            assert _decode(framing, frame) == message
+            print(f"{sample_name:<10} {name:<16} {len(frame):>7} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+    if 'msgpack' not in protocol.CODECS:
+        print("(msgpack no está instalado: sólo se compara JSON)")
+    run(args.iterations)
+
+
+if __name__ == '__main__':
+    main()
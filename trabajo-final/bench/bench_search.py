@@ -0,0 +1,202 @@
+# bench/bench_search.py
+"""
+Benchmark de la búsqueda de texto completo (FTS5, backend SQLite) sobre un
+corpus sintético.
+
+Genera una BD aparte con N mensajes (por defecto un millón) de palabras con
+distribución Zipf, repartidos entre varias salas y usuarios, usando el mismo
+camino de escritura que el servidor (save_messages, con los triggers del
+índice). Después mide:
+- inserción con el índice activo (mensajes/s),
+- latencia p50/p99 de `search_messages` por tipo de consulta,
+- la misma búsqueda con un LIKE '%palabra%' (recorrido lineal) como referencia,
+- el retraso del event loop mientras corren búsquedas concurrentes.
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_search [--messages 1000000] [--db bench_search.db] [--reuse]
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+import aiosqlite
+from src import db_manager, db_sqlite
+from src.config import SEARCH_CONNECTIONS
+from .loadgen import percentiles
+
+SYLLABLES = ["ma", "te", "ri", "so", "lu", "ca", "pe", "do", "ni", "ra", "ve", "to", "la", "mi", "se", "fo"]
+COMMON = ["la", "de", "que", "el", "en", "clase", "examen", "profe", "tarea", "hoy"]
+
+
+def vocabulary(size: int, rng: random.Random) -> list[str]:
+    words = list(COMMON)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+async def build_corpus(args) -> dict:
+    rng = random.Random(args.seed)
+    words = vocabulary(args.vocabulary, rng)
+    # Zipf: el peso de la palabra de rango k es 1/k (acumulados una sola vez)
+    cum_weights = list(itertools.accumulate(1 / (k + 1) for k in range(len(words))))
+
+    await db_manager.init_db()
+    async with aiosqlite.connect(db_sqlite.DB_NAME) as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO usuarios (username, password, rol) VALUES (?, 'x', 'alumno')",
+            [(f"bench{i}",) for i in range(args.users)]
+        )
+        await db.executemany(
+            "INSERT OR IGNORE INTO salas (nombre) VALUES (?)", [(f"bench-{i}",) for i in range(args.rooms)]
+        )
+        await db.commit()
+        user_ids = [row[0] for row in await db.execute_fetchall("SELECT id FROM usuarios")]
+        room_ids = [row[0] for row in await db.execute_fetchall("SELECT id FROM salas")]
+
+    await db_manager.open_pool(size=1)
+    elapsed = 0.0
+    inserted = 0
+    try:
+        while inserted < args.messages:
+            batch = []
+            for _ in range(min(args.batch, args.messages - inserted)):
+                content = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 20)))
+                batch.append((rng.choice(user_ids), rng.choice(room_ids), content, "2026-01-01 00:00:00"))
+            # Sólo se mide la escritura, no la generación del texto
+            start = time.perf_counter()
+            await db_manager.save_messages(batch)
+            elapsed += time.perf_counter() - start
+            inserted += len(batch)
+            if inserted % (args.batch * 20) == 0:
+                print(f"  {inserted} mensajes...", flush=True)
+    finally:
+        await db_manager.close_pool()
+    print(f"Inserción con índice FTS: {inserted} mensajes en {elapsed:.1f}s "
+          f"({inserted / elapsed:,.0f} mensajes/s)")
+    return {"words": words, "rooms": room_ids}
+
+
+async def corpus_info() -> dict:
+    async with aiosqlite.connect(db_sqlite.DB_NAME) as db:
+        room_ids = [row[0] for row in await db.execute_fetchall("SELECT id FROM salas")]
+        (count,) = (await db.execute_fetchall("SELECT count(*) FROM mensajes"))[0]
+    print(f"Reutilizando {db_sqlite.DB_NAME}: {count} mensajes")
+    return {"words": None, "rooms": room_ids}
+
+
+async def timed_queries(label: str, iterations: int, fn) -> dict:
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await fn(i)
+        samples.append((time.perf_counter() - start) * 1e3)
+    stats = percentiles(samples)
+    print(f"{label:<34} p50 {stats['p50']:>9.3f} ms   p99 {stats['p99']:>9.3f} ms")
+    return stats
+
+
+async def bench_queries(args, corpus: dict):
+    rng = random.Random(args.seed + 1)
+    words = corpus["words"] or vocabulary(args.vocabulary, random.Random(args.seed))
+    rare = words[len(words) // 2:]
+    mid = words[20:200]
+    rooms = corpus["rooms"]
+    page = args.page
+
+    await db_manager.open_pool(size=1, search_size=SEARCH_CONNECTIONS)
+    try:
+        cases = [
+            ("palabra rara", lambda i: db_manager.search_messages(rng.choice(rare), limit=page)),
+            ("palabra frecuente", lambda i: db_manager.search_messages(rng.choice(COMMON), limit=page)),
+            ("dos palabras", lambda i: db_manager.search_messages(
+                f"{rng.choice(mid)} {rng.choice(mid)}", limit=page)),
+            ("prefijo", lambda i: db_manager.search_messages(rng.choice(mid)[:3] + "*", limit=page)),
+            ("frecuente + sala", lambda i: db_manager.search_messages(
+                rng.choice(COMMON), room_id=rng.choice(rooms), limit=page)),
+            ("media + sala + usuario", lambda i: db_manager.search_messages(
+                rng.choice(mid), room_id=rng.choice(rooms), username=f"bench{rng.randrange(args.users)}",
+                limit=page)),
+            ("media, página 10", lambda i: db_manager.search_messages(
+                rng.choice(mid), limit=page, offset=page * 9)),
+        ]
+        for label, fn in cases:
+            await timed_queries(label, args.iterations, fn)
+
+        # Referencia: recorrido lineal con LIKE (pocas iteraciones, es lento)
+        async with aiosqlite.connect(db_sqlite.DB_NAME) as db:
+            async def like(i):
+                await db.execute_fetchall(
+                    "SELECT id FROM mensajes WHERE contenido LIKE ? ORDER BY id DESC LIMIT ?",
+                    (f"%{rng.choice(rare)}%", page)
+                )
+            await timed_queries("LIKE '%rara%' (referencia)", args.like_iterations, like)
+
+        # Búsquedas concurrentes: el loop sigue atendiendo (corren en los hilos de aiosqlite)
+        lag = []
+
+        async def ticker(stop: asyncio.Event):
+            loop = asyncio.get_running_loop()
+            while not stop.is_set():
+                start = loop.time()
+                await asyncio.sleep(0.001)
+                lag.append((loop.time() - start - 0.001) * 1e3)
+
+        stop = asyncio.Event()
+        tick = asyncio.create_task(ticker(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            db_manager.search_messages(rng.choice(COMMON), limit=page) for _ in range(args.concurrent)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await tick
+        stats = percentiles(lag)
+        print(f"{args.concurrent} búsquedas concurrentes en {elapsed:.2f}s; "
+              f"retraso del loop p99 {stats['p99']:.3f} ms, máx {stats['max']:.3f} ms")
+    finally:
+        await db_manager.close_pool()
+
+
+async def run(args):
+    if db_manager.backend is not db_sqlite:
+        raise SystemExit("bench_search usa el backend SQLite (DB_TYPE = 'sqlite')")
+    db_sqlite.DB_NAME = args.db
+    if args.reuse and os.path.exists(args.db):
+        corpus = await corpus_info()
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        corpus = await build_corpus(args)
+    print(f"Tamaño de la BD: {os.path.getsize(args.db) / 2**20:.1f} MiB")
+    await bench_queries(args, corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--db', default='bench_search.db')
+    parser.add_argument('--reuse', action='store_true', help="usar el corpus ya generado en --db")
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--page', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--like-iterations', type=int, default=5)
+    parser.add_argument('--concurrent', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# bench/bench_sessions.py
+"""
+Memoria por conexión del servidor con muchas conexiones ociosas.
+
+Levanta un servidor propio (BD temporal, sin límites de conexión ni de tasa)
+y abre N conexiones repartidas entre varios procesos cliente. Mide el RSS y el tiempo
+de CPU del proceso servidor en cada etapa:
+- conectadas (estado 'connecting'),
+- reanudadas con un token de sesión (lobby; todas del mismo usuario),
+- dentro de salas de --room-size miembros.
+Los clientes sólo leen lo que llega y contestan los 'ping' del latido.
+
+Cada conexión ocupa un descriptor en el servidor: N no puede superar su
+`ulimit -n` (hay que subirlo para 50 000).
+
+Uso (desde trabajo-final/):
+    python -m bench.bench_sessions [--connections 50000] [--procs 4] [--room-size 50]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import tempfile
+import time
+from src import protocol
+from src.config import HOST
+
+FRAMING = protocol.LINE_FRAMING
+PHASES = ("connect", "resume", "join")
+
+
+def _raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def _serve(port: int, workdir: str):
+    """Proceso servidor: config sin límites de conexión ni de tasa, y BD en `workdir`."""
+    os.chdir(workdir)
+    _raise_fd_limit()
+    logging.basicConfig(level=logging.ERROR)
+    from src import config
+    config.MAX_CONNECTIONS = config.MAX_CONNECTIONS_PER_IP = 10 ** 7
+    # Todas las conexiones son del mismo usuario: compartirían sus buckets
+    config.RATE_LIMIT_ENABLED = False
+    from src import netprofile
+    netprofile.install_event_loop()
+    from src.server import Server
+    server = Server(HOST, port, auth_workers=1)
+    try:
+        asyncio.run(server.start())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+def _proc_usage(pid: int) -> tuple[int, float]:
+    """(RSS en bytes, segundos de CPU) de un proceso, desde /proc."""
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return rss, cpu
+
+
+async def _request(reader, writer, data: bytes, expect: str) -> dict:
+    writer.write(data)
+    while True:
+        message = await FRAMING.read(reader)
+        if message and message.get("action") == expect:
+            return message
+
+
+async def _setup(port: int, rooms: int) -> tuple[str, list[int]]:
+    """Login real (una vez) para obtener el token, y creación de las salas."""
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    else:
+        raise SystemExit("El servidor no arrancó")
+    resp = await _request(reader, writer, FRAMING.create_message("login", user="profe", password="123"),
+                          "login_success")
+    token = resp["token"]
+    room_ids = []
+    for i in range(rooms):
+        resp = await _request(reader, writer, FRAMING.create_message("create_room", name=f"bench-{i}"),
+                              "room_created")
+        room_ids.append(resp["room_id"])
+    writer.close()
+    return token, room_ids
+
+
+class _Client:
+    """Una conexión ociosa: lee todo lo que llega y contesta el latido."""
+
+    def __init__(self, counters: dict):
+        self.counters = counters
+        self.reader = None
+        self.writer = None
+        self.task = None
+
+    async def open(self, port: int):
+        self.reader, self.writer = await asyncio.open_connection(HOST, port)
+        self.task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                message = await FRAMING.read(self.reader)
+                action = message and message.get("action")
+                if action == "ping":
+                    self.writer.write(FRAMING.create_message("pong"))
+                elif action in self.counters:
+                    self.counters[action] += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+async def _client_main(pipe, port: int, count: int, offset: int, token: str, rooms: list[int], room_size: int):
+    _raise_fd_limit()
+    loop = asyncio.get_running_loop()
+    counters = {"login_success": 0, "join_success": 0}
+    clients = [_Client(counters) for _ in range(count)]
+    opening = asyncio.Semaphore(256)
+
+    async def open_one(client):
+        async with opening:
+            await client.open(port)
+
+    async def wait_for(action):
+        while counters[action] < count:
+            await asyncio.sleep(0.05)
+
+    while True:
+        phase = await loop.run_in_executor(None, pipe.recv)
+        if phase == "connect":
+            await asyncio.gather(*(open_one(c) for c in clients))
+        elif phase == "resume":
+            frame = FRAMING.create_message("resume", token=token)
+            for client in clients:
+                client.writer.write(frame)
+            await wait_for("login_success")
+        elif phase == "join":
+            for i, client in enumerate(clients):
+                room_id = rooms[(offset + i) // room_size % len(rooms)]
+                client.writer.write(FRAMING.create_message("join", room_id=room_id))
+            await wait_for("join_success")
+        else:
+            for client in clients:
+                client.writer.close()
+            return
+        pipe.send(phase)
+
+
+def _client_proc(*args):
+    asyncio.run(_client_main(*args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=50000)
+    parser.add_argument('--procs', type=int, default=4, help="procesos cliente")
+    parser.add_argument('--room-size', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--settle', type=float, default=1.0, help="segundos de espera antes de medir")
+    args = parser.parse_args()
+
+    limit = _raise_fd_limit()
+    if args.connections + 100 > limit:
+        print(f"Aviso: ulimit -n es {limit}; el servidor no podrá aceptar {args.connections} conexiones.")
+
+    ctx = multiprocessing.get_context("spawn")
+    workdir = tempfile.mkdtemp(prefix="bench_sessions-")
+    server = ctx.Process(target=_serve, args=(args.port, workdir))
+    server.start()
+    try:
+        rooms = -(-args.connections // args.room_size)
+        token, room_ids = asyncio.run(_setup(args.port, rooms))
+        time.sleep(args.settle)
+
+        share = -(-args.connections // args.procs)
+        pipes, procs = [], []
+        for p in range(args.procs):
+            count = min(share, args.connections - p * share)
+            parent_end, child_end = ctx.Pipe()
+            proc = ctx.Process(target=_client_proc,
+                               args=(child_end, args.port, count, p * share, token, room_ids, args.room_size))
+            proc.start()
+            pipes.append(parent_end)
+            procs.append(proc)
+
+        base_rss, last_cpu = _proc_usage(server.pid)
+        print(f"Servidor sin clientes ({rooms} salas): RSS {base_rss / 2**20:.1f} MiB")
+        print(f"{'etapa':<10} {'RSS MiB':>9} {'bytes/conexión':>15} {'CPU s':>7} {'duración s':>11}")
+        for phase in PHASES:
+            start = time.perf_counter()
+            for pipe in pipes:
+                pipe.send(phase)
+            for pipe in pipes:
+                pipe.recv()
+            elapsed = time.perf_counter() - start
+            time.sleep(args.settle)
+            rss, cpu = _proc_usage(server.pid)
+            print(f"{phase:<10} {rss / 2**20:>9.1f} {(rss - base_rss) / args.connections:>15,.0f} "
+                  f"{cpu - last_cpu:>7.2f} {elapsed:>11.2f}")
+            last_cpu = cpu
+
+        for pipe in pipes:
+            pipe.send("close")
+        for proc in procs:
+            proc.join()
+    finally:
+        os.kill(server.pid, signal.SIGINT)
+        server.join(10)
+
+
+if __name__ == '__main__':
+    main()
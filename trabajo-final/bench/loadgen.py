@@ -0,0 +1,313 @@
+# bench/loadgen.py
+"""
+Generador de carga headless para el servidor SCEE.
+
+Simula N usuarios con el módulo `protocol` real: cada uno se conecta,
+negocia el enmarcado, inicia sesión, pide `get_rooms`, entra a una sala y
+envía mensajes a una tasa fija. Cada mensaje lleva el instante de envío, así
+que los receptores miden la latencia de entrega extremo a extremo.
+
+Sólo el primer usuario de cada credencial pasa por scrypt; el resto reanuda
+con el token de sesión (usar --full-login para forzar el KDF en todos).
+
+Todas las conexiones salen de la misma IP: el servidor tiene que correr con
+SCEE_MAX_CONNECTIONS_PER_IP por encima de --users. Los usuarios simulados
+comparten unas pocas credenciales (y con ellas los límites de tasa del
+usuario): para medir el servidor sin límites, SCEE_RATE_LIMIT=0.
+
+Uso (desde trabajo-final/, con el servidor corriendo):
+    python -m bench.loadgen [--users 1000] [--rate 1] [--duration 30] \\
+        [--output resultado.json] [--compare base.json]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+from src import protocol, netprofile
+from src.config import HOST, PORT
+
+# Prefijo de los mensajes de carga: "lg <usuario> <secuencia> <t_envío_ns>"
+TAG = "lg "
+
+# Métricas que --compare contrasta contra una corrida anterior
+COMPARED = [
+    ("latency_ms", "p50"), ("latency_ms", "p99"), ("latency_ms", "p999"),
+    ("setup_ms", "p50"), ("setup_ms", "p99"),
+    ("throughput", "sent_per_s"), ("throughput", "delivered_per_s"),
+]
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    last = len(samples) - 1
+
+    def pick(q):
+        return round(samples[min(last, int(q * len(samples)))], 3)
+
+    return {
+        "count": len(samples),
+        "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "p999": pick(0.999),
+        "max": round(samples[-1], 3),
+    }
+
+
+class Stats:
+    """Acumulado de la corrida, compartido por todos los usuarios simulados."""
+
+    def __init__(self):
+        self.setup_ms = []
+        self.latency_ms = []
+        self.sent = 0
+        self.delivered = 0
+        self.setup_failures = 0
+        self.errors = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimUser:
+    def __init__(self, index: int, credentials: tuple[str, str], args, stats: Stats):
+        self.index = index
+        self.user, self.password = credentials
+        self.args = args
+        self.stats = stats
+        self.framing = protocol.LINE_FRAMING
+        self.reader = None
+        self.writer = None
+        self.room_id = None
+
+    async def _request(self, data: bytes, expect: set[str]) -> dict:
+        """Envía y espera la primera respuesta con alguna de las acciones esperadas."""
+        self.writer.write(data)
+        await self.writer.drain()
+        while True:
+            message = await self.framing.read(self.reader)
+            if message and message.get("action") in expect:
+                return message
+
+    async def _negotiate(self):
+        # Cada conexión nueva arranca en líneas JSON
+        self.framing = protocol.LINE_FRAMING
+        if self.args.framing != "binary":
+            return
+        resp = await self._request(
+            protocol.create_message("hello", framing="binary", codec=protocol.best_codec()), {"hello_ok"}
+        )
+        self.framing = protocol.negotiate(resp.get("framing"), resp.get("codec"))
+
+    async def setup(self, token: str | None):
+        """Conexión, login (o reanudación con token), lista de salas y join."""
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        netprofile.tune_socket(self.writer.get_extra_info('socket'), netprofile.get_profile())
+        await self._negotiate()
+
+        if token:
+            request = self.framing.create_message("resume", token=token)
+        else:
+            request = self.framing.create_message("login", user=self.user, password=self.password)
+        resp = await self._request(request, {"login_success", "login_fail"})
+        if resp["action"] != "login_success":
+            raise RuntimeError(f"login_fail: {resp.get('message')}")
+
+        resp = await self._request(self.framing.create_message("get_rooms"), {"room_list"})
+        rooms = [room["id"] for room in resp.get("rooms", [])][:self.args.rooms or None]
+        if not rooms:
+            raise RuntimeError("el servidor no devolvió salas")
+        self.room_id = rooms[self.index % len(rooms)]
+        await self._request(self.framing.create_message("join", room_id=self.room_id), {"join_success"})
+
+        self.stats.setup_ms.append((time.perf_counter() - start) * 1e3)
+
+    async def listen(self):
+        """Cuenta entregas y mide la latencia de los mensajes de carga."""
+        stats = self.stats
+        try:
+            while True:
+                message = await self.framing.read(self.reader)
+                if not message:
+                    continue
+                if message.get("action") == "ping":
+                    # Con --rate bajo puede pasar HEARTBEAT_INTERVAL sin que enviemos nada
+                    self.writer.write(self.framing.create_message("pong"))
+                    continue
+                if message.get("action") != "broadcast":
+                    continue
+                content = message.get("content") or ""
+                if content.startswith(TAG):
+                    sent_ns = int(content.rsplit(" ", 1)[1])
+                    stats.latency_ms.append((time.perf_counter_ns() - sent_ns) / 1e6)
+                    stats.delivered += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except protocol.ProtocolError:
+            stats.error("protocol")
+
+    async def send_loop(self, go: asyncio.Event, deadline: list[float]):
+        """Envía a tasa fija; el desfase inicial aleatorio evita ráfagas sincronizadas."""
+        await go.wait()
+        interval = 1 / self.args.rate
+        await asyncio.sleep(random.uniform(0, interval))
+        seq = 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < deadline[0]:
+            content = f"{TAG}{self.index} {seq} {time.perf_counter_ns()}"
+            try:
+                self.writer.write(self.framing.create_message("message", content=content))
+                await self.writer.drain()
+            except ConnectionError:
+                self.stats.error("send")
+                return
+            self.stats.sent += 1
+            seq += 1
+            next_at += interval
+            await asyncio.sleep(max(0, next_at - time.perf_counter()))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def _login_once(user: SimUser) -> str:
+    """Login completo (scrypt) de un usuario; devuelve su token de sesión."""
+    user.reader, user.writer = await asyncio.open_connection(user.args.host, user.args.port)
+    await user._negotiate()
+    resp = await user._request(
+        user.framing.create_message("login", user=user.user, password=user.password),
+        {"login_success", "login_fail"},
+    )
+    if resp["action"] != "login_success":
+        raise RuntimeError(f"login_fail para {user.user}: {resp.get('message')}")
+    return resp["token"]
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    credentials = [tuple(c.split(":", 1)) for c in args.credentials]
+    users = [SimUser(i, credentials[i % len(credentials)], args, stats) for i in range(args.users)]
+
+    # Primer usuario de cada credencial: login real; de ahí sale el token para el resto
+    tokens = {}
+    if not args.full_login:
+        for user in users[:len(credentials)]:
+            if user.user not in tokens:
+                tokens[user.user] = await _login_once(user)
+                user.close()
+
+    # Conexión de todos, con un tope de handshakes simultáneos
+    setup_gate = asyncio.Semaphore(args.concurrency)
+
+    async def setup(user):
+        async with setup_gate:
+            try:
+                await user.setup(tokens.get(user.user))
+                return True
+            except (OSError, RuntimeError, asyncio.IncompleteReadError) as e:
+                stats.setup_failures += 1
+                stats.error(type(e).__name__)
+                user.close()
+                return False
+
+    setup_start = time.perf_counter()
+    ready = [u for u, ok in zip(users, await asyncio.gather(*(setup(u) for u in users))) if ok]
+    setup_total = time.perf_counter() - setup_start
+    print(f"{len(ready)}/{len(users)} usuarios conectados en {setup_total:.2f}s")
+
+    # Fase de mensajes: todos arrancan juntos
+    go = asyncio.Event()
+    deadline = [0.0]
+    listeners = [asyncio.create_task(u.listen()) for u in ready]
+    senders = [asyncio.create_task(u.send_loop(go, deadline)) for u in ready]
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    deadline[0] = start + args.duration
+    go.set()
+    await asyncio.gather(*senders)
+    send_elapsed = time.perf_counter() - start
+
+    # Margen para que lleguen los mensajes en vuelo
+    await asyncio.sleep(args.grace)
+    elapsed = time.perf_counter() - start
+    for user in ready:
+        user.close()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    return {
+        "config": {
+            "host": args.host, "port": args.port, "users": args.users, "rate": args.rate,
+            "duration": args.duration, "rooms": args.rooms, "framing": args.framing,
+            "full_login": args.full_login, "loop": args.loop,
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "connected": len(ready),
+        "setup_failures": stats.setup_failures,
+        "setup_total_s": round(setup_total, 3),
+        "setup_ms": percentiles(stats.setup_ms),
+        "latency_ms": percentiles(stats.latency_ms),
+        "throughput": {
+            "sent": stats.sent,
+            "delivered": stats.delivered,
+            "sent_per_s": round(stats.sent / send_elapsed, 1) if send_elapsed else 0,
+            "delivered_per_s": round(stats.delivered / elapsed, 1) if elapsed else 0,
+        },
+        "errors": stats.errors,
+    }
+
+
+def compare(result: dict, baseline: dict):
+    print(f"{'métrica':<28} {'base':>12} {'actual':>12} {'Δ %':>8}")
+    for section, key in COMPARED:
+        old = baseline.get(section, {}).get(key)
+        new = result.get(section, {}).get(key)
+        if old is None or new is None:
+            continue
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"{section + '.' + key:<28} {old:>12} {new:>12} {delta:>+8.1f}")
+
+
+def _raise_fd_limit():
+    """Miles de conexiones necesitan más descriptores que el límite blando usual."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=1.0, help="mensajes por segundo por usuario")
+    parser.add_argument('--duration', type=float, default=30.0, help="segundos de envío")
+    parser.add_argument('--grace', type=float, default=2.0, help="espera final por mensajes en vuelo")
+    parser.add_argument('--rooms', type=int, default=0, help="usar sólo las primeras N salas (0 = todas)")
+    parser.add_argument('--concurrency', type=int, default=200, help="handshakes simultáneos")
+    parser.add_argument('--framing', choices=["line", "binary"], default="binary")
+    parser.add_argument('--credentials', nargs='+', default=["profe:123", "alumno:456"],
+                        help="usuario:clave a repartir entre los usuarios simulados")
+    parser.add_argument('--full-login', action='store_true', help="login con scrypt para cada usuario")
+    parser.add_argument('--output', help="archivo JSON con los resultados")
+    parser.add_argument('--compare', help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    _raise_fd_limit()
+    args.loop = netprofile.install_event_loop()
+    result = asyncio.run(run(args))
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
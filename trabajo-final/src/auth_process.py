@@ -3,59 +3,194 @@
 Proceso de autenticación (IPC).
 Recibe pedidos de autenticación desde el servidor principal vía Pipe
 y los verifica contra la base de datos usando db_manager.
+
+El servidor levanta un pool de N workers (AuthPool). Cada pedido lleva un id
+que se devuelve en la respuesta, así varios logins pueden estar en vuelo a la
+vez sin mezclar las respuestas.
 """
 
 import logging
 import asyncio
+import itertools
+import multiprocessing
+import signal
+import time
 from multiprocessing.connection import Connection
+from .config import AUTH_WORKERS, AUTH_MAX_INFLIGHT, AUTH_TIMEOUT
 from . import db_manager
+from . import metrics
+from .logsetup import setup_logging, shutdown_logging
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+AUTH_IPC_SECONDS = metrics.histogram(
+    "scee_auth_ipc_seconds", "Ida y vuelta de un pedido al pool de autenticación"
+)
+
+
+def _watch_pipe(loop, pipe_conn: Connection, on_message, on_eof):
+    """
+    Registra el pipe en el loop: cada mensaje completo se entrega a `on_message`.
+    Connection.recv() lee exactamente un mensaje, y add_reader es por nivel,
+    así que si quedan más en el pipe el callback se vuelve a disparar.
+    """
+    fd = pipe_conn.fileno()
+
+    def _on_readable():
+        try:
+            message = pipe_conn.recv()
+        except (EOFError, OSError):
+            loop.remove_reader(fd)
+            on_eof()
+            return
+        on_message(message)
+
+    loop.add_reader(fd, _on_readable)
+    return fd
+
+
 def auth_process_worker(pipe_conn: Connection):
     """
     Función que se ejecuta en un proceso separado para manejar la autenticación.
     Escucha pedidos (usuario, clave) desde el pipe y responde.
     """
+    # El apagado lo ordena el servidor con 'shutdown'; Ctrl+C no debe cortar el worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging("AUTH")
     log.info("Proceso de autenticación iniciado.")
-    # Creamos un loop de asyncio para este proceso
-    # loop = asyncio.get_event_loop()
 
+    try:
+        # Un único loop y una única conexión a la BD durante toda la vida del worker
+        asyncio.run(_serve(pipe_conn))
+    except Exception as e:
+        log.error("Error inesperado en auth_process_worker: %s", e)
+    finally:
+        log.info("Proceso de autenticación terminado.")
+        pipe_conn.close()
+        # Los hijos de multiprocessing salen sin correr atexit: vaciar la cola a mano
+        shutdown_logging()
+
+
+async def _serve(pipe_conn: Connection):
+    loop = asyncio.get_running_loop()
+    requests: asyncio.Queue = asyncio.Queue()
+
+    def _on_eof():
+        log.info("Proceso de autenticación: Pipe cerrado (normal al apagar).")
+        requests.put_nowait(None)
+
+    await db_manager.open_pool(size=1)
+    fd = _watch_pipe(loop, pipe_conn, requests.put_nowait, _on_eof)
     try:
         while True:
-            # Bloquea hasta recibir un mensaje del servidor principal
-            request = pipe_conn.recv()
+            request = await requests.get()
+            if request is None:
+                break
             if request.get("command") == "shutdown":
                 log.info("Comando 'shutdown' recibido.")
                 break
-                
+
             if request.get("command") == "auth":
-                user = request.get("user")
-                pwd = request.get("password")
-                
-                log.info(f"Auth_Process: Verificando {user}...")
-                
-                try:
-                    # Ejecutamos la corrutina de verificación de BD
-                    # en un nuevo loop de asyncio para este proceso.
-                    user_data = asyncio.run(db_manager.verify_user(user, pwd))
-                    
-                    if user_data:
-                        response = {"status": "ok", "user_data": user_data}
-                    else:
-                        response = {"status": "error", "message": "Credenciales inválidas"}
-                
-                except Exception as e:
-                    log.error(f"Error en el worker de autenticación durante verify_user: {e}")
-                    response = {"status": "error", "message": "Error interno del servidor"}
-                
+                response = await _handle_auth(request)
+                response["id"] = request.get("id")
                 pipe_conn.send(response)
+    finally:
+        loop.remove_reader(fd)
+        await db_manager.close_pool()
 
-    except EOFError:
-        log.info("Proceso de autenticación: Pipe cerrado (normal al apagar).")
+
+async def _handle_auth(request: dict) -> dict:
+    user = request.get("user")
+    pwd = request.get("password")
+
+    log.info("Auth_Process: Verificando %s...", user, extra={"event": "auth"})
+
+    try:
+        user_data = await db_manager.verify_user(user, pwd)
     except Exception as e:
-        log.error(f"Error inesperado en auth_process_worker: {e}")
-    finally:
-        log.info("Proceso de autenticación terminado.")
-        pipe_conn.close()
\ No newline at end of file
+        log.error("Error en el worker de autenticación durante verify_user: %s", e)
+        return {"status": "error", "message": "Error interno del servidor"}
+
+    if user_data:
+        return {"status": "ok", "user_data": user_data}
+    return {"status": "error", "message": "Credenciales inválidas"}
+
+
+class AuthPool:
+    """
+    Lado del servidor: N procesos de autenticación con multiplexado de pedidos.
+    Los procesos se lanzan al construir el pool; `attach()` registra los pipes
+    en el loop de asyncio (lectura nativa, sin hilos del executor).
+    """
+
+    def __init__(self, workers: int = AUTH_WORKERS, max_inflight: int = AUTH_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self._ids = itertools.count(1)
+        self._workers = []
+        for _ in range(max(1, workers)):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=auth_process_worker, args=(child_conn,), daemon=True)
+            proc.start()
+            child_conn.close()
+            # pending[id] = Future con la respuesta
+            self._workers.append({"proc": proc, "conn": parent_conn, "pending": {}, "alive": True})
+        self._slots: asyncio.Semaphore | None = None
+
+    def attach(self):
+        """Registra los pipes en el loop en ejecución."""
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(len(self._workers) * self.max_inflight)
+        for worker in self._workers:
+            _watch_pipe(
+                loop, worker["conn"],
+                lambda response, w=worker: self._on_response(w, response),
+                lambda w=worker: self._on_worker_lost(w),
+            )
+
+    def _on_response(self, worker, response: dict):
+        future = worker["pending"].pop(response.get("id"), None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def _on_worker_lost(self, worker):
+        worker["alive"] = False
+        log.error("Worker de autenticación %s perdido.", worker['proc'].pid)
+        for future in worker["pending"].values():
+            if not future.done():
+                future.set_exception(ConnectionError("Worker de autenticación perdido"))
+        worker["pending"].clear()
+
+    async def request(self, payload: dict) -> dict:
+        """Envía un pedido al worker menos cargado y espera su respuesta."""
+        async with self._slots:
+            alive = [w for w in self._workers if w["alive"]]
+            if not alive:
+                raise ConnectionError("No hay workers de autenticación disponibles")
+            worker = min(alive, key=lambda w: len(w["pending"]))
+
+            request_id = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            worker["pending"][request_id] = future
+            start = time.perf_counter()
+            try:
+                worker["conn"].send({**payload, "id": request_id})
+                return await asyncio.wait_for(future, AUTH_TIMEOUT)
+            finally:
+                AUTH_IPC_SECONDS.observe(time.perf_counter() - start)
+                worker["pending"].pop(request_id, None)
+
+    async def authenticate(self, user, password) -> dict:
+        return await self.request({"command": "auth", "user": user, "password": password})
+
+    def stop(self):
+        """Pide a cada worker que termine y espera a que salgan."""
+        for worker in self._workers:
+            try:
+                worker["conn"].send({"command": "shutdown"})
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            worker["proc"].join(timeout=5)
+            if worker["proc"].is_alive():
+                worker["proc"].terminate()
+            worker["conn"].close()
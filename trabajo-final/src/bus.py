@@ -0,0 +1,121 @@
+# src/bus.py
+"""
+Bus local de pub/sub entre procesos worker del servidor (socket Unix).
+El supervisor ejecuta BusBroker; cada worker se conecta con BusClient,
+publica los eventos de sus salas y recibe los de los demás workers.
+
+Las tramas usan el enmarcado binario del protocolo (prefijo de longitud).
+El broker no las decodifica: reenvía los bytes tal cual a los demás peers.
+"""
+
+import asyncio
+import logging
+import os
+from .config import BUS_SOCKET_PATH, BUS_QUEUE_MAX
+from . import protocol
+from .outbound import OutboundQueue, DROP_OLDEST
+
+log = logging.getLogger(__name__)
+
+# Mismo códec en todos los procesos de la máquina
+BUS_FRAMING = protocol.negotiate("binary", protocol.best_codec())
+
+
+async def _read_raw_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(protocol.FRAME_HEADER_SIZE)
+    size = int.from_bytes(header, 'big')
+    return header + await reader.readexactly(size)
+
+
+class BusBroker:
+    """Reenvía cada trama recibida de un worker a todos los demás."""
+
+    def __init__(self, path: str = BUS_SOCKET_PATH):
+        self.path = path
+        self._peers: dict[asyncio.StreamWriter, OutboundQueue] = {}
+        self._server: asyncio.AbstractServer | None = None
+        self.frames = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, self.path)
+        log.info("Bus local escuchando en %s", self.path)
+
+    async def _handle_peer(self, reader, writer):
+        # El bus no debe cortar a un worker lento: se descartan los eventos más viejos
+        outbox = OutboundQueue(writer, max_size=BUS_QUEUE_MAX, policy=DROP_OLDEST)
+        self._peers[writer] = outbox
+        try:
+            while True:
+                frame = await _read_raw_frame(reader)
+                self.frames += 1
+                for peer, peer_outbox in self._peers.items():
+                    if peer is not writer:
+                        peer_outbox.put(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._peers[writer]
+            await outbox.close()
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for outbox in list(self._peers.values()):
+            outbox.abort()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BusClient:
+    """Conexión de un worker al bus: publish() no bloquea; los eventos
+    recibidos se entregan a `on_event` (callback síncrono)."""
+
+    def __init__(self, on_event, path: str = BUS_SOCKET_PATH):
+        self.path = path
+        self.on_event = on_event
+        self._writer: asyncio.StreamWriter | None = None
+        self._outbox: OutboundQueue | None = None
+        self._task: asyncio.Task | None = None
+        self.published = 0
+        self.received = 0
+
+    async def connect(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._outbox = OutboundQueue(self._writer, max_size=BUS_QUEUE_MAX, policy=DROP_OLDEST)
+        self._task = asyncio.create_task(self._listen(reader))
+
+    def publish(self, event: dict):
+        if self._outbox is not None:
+            self._outbox.put(BUS_FRAMING.encode(event))
+            self.published += 1
+
+    async def _listen(self, reader):
+        try:
+            while True:
+                event = await BUS_FRAMING.read(reader)
+                if event is None:
+                    continue
+                self.received += 1
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    log.error("Error procesando evento del bus: %s", e)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.warning("Conexión con el bus cerrada.")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._outbox is not None:
+            await self._outbox.close()
+        if self._writer is not None:
+            self._writer.close()
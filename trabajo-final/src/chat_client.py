@@ -0,0 +1,308 @@
+# src/chat_client.py
+"""
+Biblioteca cliente asíncrona de SCEE, sin entrada/salida de consola.
+
+Una conexión con una tarea lectora propia que:
+- correlaciona cada respuesta con su pedido por el campo "req" (un id por
+  conexión que el servidor repite): se pueden tener varios pedidos en vuelo
+  y un 'broadcast' intercalado nunca se toma por la respuesta esperada;
+- contesta sola el latido del servidor ('ping');
+- entrega los avisos del servidor (tramas sin "req": 'broadcast',
+  'room_closed', 'idle_timeout', ...) al callback registrado con on().
+
+Es la base del CLI (src/client.py) y sirve para bots y pruebas de carga:
+
+    async with ChatClient() as client:
+        await client.login("profe", "123")
+        client.on("broadcast", lambda msg: print(msg["sender"], msg["content"]))
+        rooms, joined = await asyncio.gather(client.list_rooms(), client.join(1))
+        client.send_message("hola")
+"""
+
+import asyncio
+import base64
+import hashlib
+import inspect
+import itertools
+import logging
+import os
+from .config import HOST, PORT, CLIENT_FRAMING, CLIENT_DOWNLOAD_DIR, CLIENT_REQUEST_TIMEOUT, MAX_FRAME_SIZE
+from . import protocol
+from . import netprofile
+
+log = logging.getLogger(__name__)
+
+# Respuestas que hacen fallar el pedido (RequestError)
+ERROR_ACTIONS = frozenset({"error", "login_fail", "upload_failed"})
+
+
+class RequestError(Exception):
+    """El servidor rechazó un pedido; `reply` es su respuesta completa."""
+
+    def __init__(self, reply: dict):
+        super().__init__(reply.get("message") or reply.get("action"))
+        self.reply = reply
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChatClient:
+    def __init__(self, host=HOST, port=PORT, framing=CLIENT_FRAMING, timeout=CLIENT_REQUEST_TIMEOUT,
+                 download_dir=CLIENT_DOWNLOAD_DIR):
+        self.host = host
+        self.port = port
+        self.prefer_binary = framing == "binary"
+        self.timeout = timeout
+        self.download_dir = download_dir
+        self.framing = protocol.LINE_FRAMING
+        self.reader = None
+        self.writer = None
+        # Datos de la sesión en el servidor
+        self.user: dict | None = None
+        self.token: str | None = None
+        self.room_id: int | None = None
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._handlers: dict[str, object] = {}
+        self._reader_task: asyncio.Task | None = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # --- Conexión ---
+
+    async def connect(self):
+        # En líneas JSON una respuesta grande (historial, búsqueda) es una sola
+        # línea: el lector acepta hasta el mismo máximo que una trama binaria
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=MAX_FRAME_SIZE)
+        netprofile.tune_socket(self.writer.get_extra_info('socket'), netprofile.get_profile())
+        if self.prefer_binary:
+            self.framing = await self._negotiate()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _negotiate(self) -> protocol.Framing:
+        """
+        Pide el enmarcado binario con el códec más compacto disponible, antes
+        de arrancar la tarea lectora. El servidor responde en líneas JSON con
+        lo que efectivamente eligió.
+        """
+        self.writer.write(protocol.create_message("hello", framing="binary", codec=protocol.best_codec()))
+        try:
+            # Un servidor sin soporte ignora 'hello': seguimos en líneas JSON
+            resp = await asyncio.wait_for(protocol.LINE_FRAMING.read(self.reader), timeout=2)
+        except asyncio.TimeoutError:
+            return protocol.LINE_FRAMING
+        if not resp or resp.get("action") != "hello_ok":
+            return protocol.LINE_FRAMING
+        return protocol.negotiate(resp.get("framing"), resp.get("codec"))
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    @property
+    def connected(self) -> bool:
+        return self._reader_task is not None and not self._reader_task.done()
+
+    # --- Pedidos y avisos ---
+
+    def on(self, action: str, callback):
+        """
+        Registra el callback de un aviso del servidor (callback(msg); si
+        devuelve un awaitable se agenda como tarea). Uno por acción: None lo
+        quita. Al cortarse la conexión se entrega {"action": "disconnected"}.
+        Los callbacks corren en la tarea lectora: no deben bloquear.
+        """
+        if callback is None:
+            self._handlers.pop(action, None)
+        else:
+            self._handlers[action] = callback
+
+    def send(self, action: str, **fields):
+        """Envía una trama sin esperar respuesta (p. ej. 'message')."""
+        self.writer.write(self.framing.create_message(action, **fields))
+
+    async def request(self, action: str, **fields) -> dict:
+        """
+        Envía un pedido con un "req" nuevo y espera su respuesta. No espera a
+        los pedidos anteriores: varias llamadas concurrentes viajan juntas y
+        cada una recibe lo suyo. Lanza RequestError si el servidor lo rechaza
+        y TimeoutError si no contesta en `timeout` segundos.
+        """
+        if not self.connected:
+            raise ConnectionError("No hay conexión con el servidor")
+        req = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req] = future
+        try:
+            self.writer.write(self.framing.create_message(action, req=req, **fields))
+            reply = await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(req, None)
+        if reply.get("action") in ERROR_ACTIONS:
+            raise RequestError(reply)
+        return reply
+
+    async def _read_loop(self):
+        try:
+            while True:
+                msg = await self.framing.read(self.reader)
+                if not msg: continue
+                action = msg.get("action")
+                if action == "ping":
+                    self.send("pong")
+                    continue
+                if action == "download_begin":
+                    # Los bytes del archivo siguen a la trama: hay que leerlos ya
+                    msg["path"] = await self._receive_file(msg)
+                future = self._pending.get(msg.get("req"))
+                if future is not None:
+                    if not future.done():
+                        future.set_result(msg)
+                else:
+                    self._dispatch(msg)
+        except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError) as e:
+            log.debug("Conexión terminada: %s", e)
+        except Exception:
+            # P. ej. no se pudo guardar una descarga: la conexión quedó a mitad de trama
+            log.exception("Error leyendo del servidor")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Desconectado del servidor"))
+            self._dispatch({"action": "disconnected"})
+
+    def _dispatch(self, msg: dict):
+        action = msg.get("action")
+        if action in ("leave_success", "room_closed", "disconnected"):
+            # Fuera de la sala sin haberlo pedido (inactividad o sala borrada)
+            self.room_id = None
+        callback = self._handlers.get(action)
+        if callback is None:
+            log.debug("Aviso sin callback: %s", action)
+            return
+        try:
+            result = callback(msg)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+        except Exception:
+            log.exception("Error en el callback de '%s'", action)
+
+    async def _receive_file(self, msg: dict) -> str:
+        """Lee los `size` bytes crudos que siguen a 'download_begin' y los guarda."""
+        os.makedirs(self.download_dir, exist_ok=True)
+        name = os.path.basename(msg.get("name") or f"archivo-{msg.get('file_id')}")
+        path = os.path.join(self.download_dir, name)
+        remaining = msg.get("size", 0)
+        with open(path, "wb") as f:
+            while remaining > 0:
+                block = await self.reader.read(min(remaining, 64 * 1024))
+                if not block:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                f.write(block)
+                remaining -= len(block)
+        return path
+
+    # --- Acciones del protocolo ---
+
+    async def login(self, user: str, password: str) -> dict:
+        reply = await self.request("login", user=user, password=password)
+        self.user, self.token = reply["user"], reply.get("token")
+        return self.user
+
+    async def resume(self, token: str | None = None) -> dict:
+        """Reanuda la sesión con un token (sin pasar por el KDF del servidor)."""
+        reply = await self.request("resume", token=token or self.token)
+        self.user, self.token = reply["user"], reply.get("token")
+        return self.user
+
+    async def list_rooms(self) -> list[dict]:
+        return (await self.request("get_rooms"))["rooms"]
+
+    async def join(self, room_id) -> dict:
+        """Entra a una sala; devuelve 'join_success' (room_id, room_name, history)."""
+        reply = await self.request("join", room_id=room_id)
+        self.room_id = reply["room_id"]
+        return reply
+
+    async def leave(self):
+        if self.room_id is not None:
+            await self.request("leave_room")
+            self.room_id = None
+
+    async def create_room(self, name: str) -> dict:
+        return await self.request("create_room", name=name)
+
+    async def delete_room(self, room_id) -> dict:
+        return await self.request("delete_room", room_id=room_id)
+
+    def send_message(self, content: str):
+        """Mensaje a la sala actual; vuelve (como a todos) en un aviso 'broadcast'."""
+        self.send("message", content=content)
+
+    async def history(self, before: int | None = None, after: int | None = None,
+                      limit: int | None = None) -> dict:
+        """Página del historial de la sala actual ('history_page', ver protocol.create_history_request)."""
+        fields = {k: v for k, v in (("before", before), ("after", after), ("limit", limit)) if v is not None}
+        return await self.request("get_history", **fields)
+
+    async def search(self, query: str, room_id: int | None = None, all_rooms: bool = False,
+                     user: str | None = None, offset: int | None = None, limit: int | None = None) -> dict:
+        """Búsqueda de texto ('search_results'); por defecto en la sala actual."""
+        fields = {k: v for k, v in (("user", user), ("offset", offset), ("limit", limit)) if v is not None}
+        if all_rooms:
+            fields["room_id"] = None
+        elif room_id is not None:
+            fields["room_id"] = room_id
+        return await self.request("search", query=query, **fields)
+
+    async def list_files(self) -> list[dict]:
+        return (await self.request("list_files"))["files"]
+
+    async def download(self, file_id) -> str:
+        """Descarga un archivo de la sala en `download_dir`; devuelve la ruta."""
+        return (await self.request("download", file_id=file_id))["path"]
+
+    async def upload(self, path: str) -> dict:
+        """
+        upload_begin, trozos con upload_chunk y upload_end; devuelve 'upload_done'.
+        Se anuncia el SHA-256: si el servidor ya tiene ese contenido responde
+        'upload_done' enseguida y no se envía ningún trozo.
+        """
+        size = os.path.getsize(path)
+        # En un hilo: hashear un archivo grande no debe frenar la tarea lectora
+        sha256 = await asyncio.to_thread(file_sha256, path)
+        ready = await self.request("upload_begin", name=os.path.basename(path), size=size, sha256=sha256)
+        if ready["action"] == "upload_done":
+            return ready
+
+        framing = self.framing
+        upload_id = ready["upload_id"]
+        with open(path, "rb") as f:
+            while block := f.read(ready["chunk_size"]):
+                # El enmarcado binario lleva bytes crudos; las líneas JSON, base64
+                data = block if framing.binary else base64.b64encode(block).decode("ascii")
+                self.send("upload_chunk", upload_id=upload_id, data=data)
+                await self.writer.drain()
+        return await self.request("upload_end", upload_id=upload_id)
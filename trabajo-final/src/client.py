@@ -2,180 +2,254 @@
 """
 Cliente CLI SCEE.
 Etapa 3.5: Navegación completa (Login -> Menu Salas <-> Chat).
+
+Front-end de consola sobre ChatClient (src/chat_client.py): acá sólo se lee
+del teclado y se imprime. El protocolo, el latido y la correlación de cada
+respuesta con su pedido están en la biblioteca.
 """
 
 import asyncio
 import sys
 import logging
 import getpass
-from .config import HOST, PORT, MESSAGE_DELIMITER
-from . import protocol
+from .chat_client import ChatClient, RequestError
+from . import netprofile
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-async def chat_listener(reader):
-    """Escucha mensajes del servidor mientras se está en una sala."""
-    while True:
-        try:
-            data = await reader.readuntil(MESSAGE_DELIMITER)
-            msg = protocol.parse_message(data)
-            if not msg: continue
-            
-            action = msg.get("action")
-            
-            if action == "broadcast":
-                sender = msg.get("sender")
-                content = msg.get("content")
-                print(f"\r[{sender}]: {content}\nTu > ", end="")
-            elif action == "leave_success":
-                # Señal del servidor de que salimos correctamente
-                print("\n<<< Has salido de la sala.")
-                break
-            elif action == "error":
-                print(f"\r[ERROR]: {msg.get('message')}\nTu > ", end="")
-                
-        except asyncio.IncompleteReadError:
-            print("\n[!] Desconectado del servidor.")
-            break
-        except asyncio.CancelledError:
-            # Tarea cancelada (normal al salir)
-            break
+PROMPT = "Tu > "
+
+def _oldest_id(messages) -> int | None:
+    """Id del mensaje más viejo que ya tiene id asignado (cursor para paginar)."""
+    for m in messages:
+        if m.get("id") is not None:
+            return m["id"]
+    return None
+
+def show(text):
+    """Imprime algo que llegó mientras el usuario escribe y repone el prompt."""
+    print(f"\r{text}\n{PROMPT}", end="")
+
+async def ainput(text="") -> str:
+    """input() en un hilo: la tarea lectora del cliente sigue atendiendo el socket."""
+    return await asyncio.get_running_loop().run_in_executor(None, input, text)
+
+def print_history_page(page, state):
+    print("\r--- Mensajes anteriores ---")
+    for old_msg in page.get("messages", []):
+        print(f"[{old_msg['username']}]: {old_msg['contenido']}")
+    if page.get("has_more"):
+        state["oldest_id"] = page.get("before")
+        print("--- (/mas para seguir) ---")
+    else:
+        state["oldest_id"] = None
+        print("--- Inicio de la sala ---")
+    print(PROMPT, end="")
+
+def print_search_results(msg, state):
+    results = msg.get("results", [])
+    print(f"\r--- Resultados para '{msg.get('query')}' ---")
+    for r in results:
+        print(f"#{r['id']} sala {r['sala_id']} [{r['username']}] {r['fragmento']}")
+    if not results:
+        print("(sin resultados)")
+    state["search_next"] = msg.get("next_offset")
+    if state["search_next"] is not None:
+        print("--- (/siguiente para más resultados) ---")
+    print(PROMPT, end="")
+
+def print_file_list(files):
+    print("\r--- Archivos de la sala ---")
+    for f in files:
+        print(f"[{f['id']}] {f['nombre']} ({f['tamano']} bytes, {f['username']})")
+    print(PROMPT, end="")
+
+async def run_command(client, state, text) -> bool:
+    """Ejecuta una línea del modo chat. Devuelve False al salir de la sala ('quit')."""
+    command = text.lower()
+
+    if command == "quit":
+        await client.leave()
+        print("\n<<< Has salido de la sala.")
+        return False
+
+    if command == "/mas":
+        # Pedir la página anterior del historial
+        if state.get("oldest_id") is None:
+            show("No hay mensajes anteriores.")
+        else:
+            print_history_page(await client.history(before=state["oldest_id"]), state)
+
+    elif command.startswith("/buscar "):
+        # Búsqueda en la sala actual; la consulta queda para '/siguiente'
+        state["search_query"] = text[8:].strip()
+        print_search_results(await client.search(state["search_query"]), state)
+
+    elif command == "/siguiente":
+        if state.get("search_next") is None:
+            show("No hay más resultados.")
+        else:
+            print_search_results(await client.search(state["search_query"], offset=state["search_next"]), state)
+
+    elif command == "/archivos":
+        print_file_list(await client.list_files())
 
-async def chat_sender(writer):
-    """Envía mensajes y maneja el comando 'quit' local."""
+    elif command.startswith("/bajar "):
+        path = await client.download(text[7:].strip())
+        show(f"[Descargado en {path}]")
+
+    elif command.startswith("/subir "):
+        done = await client.upload(text[7:].strip())
+        file_info = done.get("file", {})
+        note = " (ya estaba en el servidor)" if done.get("skipped") else ""
+        show(f"[Archivo {file_info.get('id')} subido: {file_info.get('nombre')}{note}]")
+
+    elif text:
+        client.send_message(text)
+    return True
+
+async def chat_sender(client, state):
+    """Lee líneas de stdin y las manda como mensajes o comandos ('quit', '/mas', archivos, búsqueda)."""
     loop = asyncio.get_running_loop()
     while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            # EOF en stdin: igual que 'quit'
+            line = "quit"
         try:
-            msg = await loop.run_in_executor(None, sys.stdin.readline)
-            msg = msg.strip()
-            
-            if msg.lower() == "quit":
-                # Enviar señal de salir al servidor
-                writer.write(protocol.create_message("leave_room"))
-                await writer.drain()
-                break # Rompe el bucle de envío
-
-            if msg:
-                writer.write(protocol.create_message("message", content=msg))
-                await writer.drain()
-        except:
-            break
+            if not await run_command(client, state, line.strip()):
+                return
+        except RequestError as e:
+            show(f"[ERROR]: {e}")
+        except asyncio.TimeoutError:
+            show("[ERROR]: El servidor no respondió.")
+        except ConnectionError:
+            return
+        except OSError as e:
+            # Archivo local de '/subir' que no se puede leer
+            show(f"[ERROR]: {e}")
 
-async def start_chat_mode(reader, writer):
+async def start_chat_mode(client, state):
     """Maneja la sesión de chat activa."""
-    print("Escribe mensajes. Escribe 'quit' para volver al menú de salas.\nTu > ", end="")
-    
-    listener_task = asyncio.create_task(chat_listener(reader))
-    sender_task = asyncio.create_task(chat_sender(writer))
-    
-    # Esperamos a que cualquiera de las dos termine
-    done, pending = await asyncio.wait(
-        [sender_task, listener_task],
-        return_when=asyncio.FIRST_COMPLETED
-    )
-
-    # --- CORRECCIÓN DE CONCURRENCIA ---
-    if sender_task in done:
-        # Caso: El usuario escribió 'quit' y el sender terminó.
-        # IMPORTANTE: No cancelar el listener todavía. Debemos esperar a recibir
-        # el 'leave_success' del servidor para limpiar el buffer de red.
-        # El listener se cerrará solo cuando llegue ese mensaje.
-        await listener_task
-    else:
-        # Caso: El listener terminó primero (el servidor nos sacó o se cayó la conexión).
-        # Aquí sí debemos cancelar el sender porque está esperando input del usuario.
-        sender_task.cancel()
-        try:
-            await sender_task
-        except asyncio.CancelledError:
-            pass
+    print("Escribe mensajes. '/mas' carga mensajes anteriores, 'quit' vuelve al menú de salas.")
+    print(f"Archivos: '/subir <ruta>', '/archivos', '/bajar <id>'. Búsqueda: '/buscar <palabras>'.\n{PROMPT}", end="")
+
+    # Avisos del servidor (lo que no es respuesta a un pedido nuestro)
+    left = asyncio.get_running_loop().create_future()
+
+    def leave(text):
+        def handler(msg):
+            print(text)
+            if not left.done():
+                left.set_result(msg)
+        return handler
+
+    client.on("broadcast", lambda msg: show(f"[{msg.get('sender')}]: {msg.get('content')}"))
+    # Después de 'idle_timeout' llega 'leave_success' y volvemos al menú
+    client.on("idle_timeout", lambda msg: print(f"\n<<< {msg.get('message')} (Enter para volver al menú)", end=""))
+    client.on("leave_success", leave("\n<<< Has salido de la sala."))
+    # Un profesor borró la sala: el servidor ya nos devolvió al menú
+    client.on("room_closed", leave("\n<<< La sala fue cerrada. (Enter para volver al menú)"))
+    client.on("disconnected", leave("\n[!] Desconectado del servidor."))
+    client.on("upload_failed", lambda msg: show(f"[ERROR subida]: {msg.get('message')}"))
+    client.on("error", lambda msg: show(f"[ERROR]: {msg.get('message')}"))
+
+    sender_task = asyncio.create_task(chat_sender(client, state))
+    try:
+        # Termina con 'quit' (el sender ya recibió 'leave_success') o con un aviso de salida
+        await asyncio.wait([sender_task, left], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not sender_task.done():
+            # El sender sigue esperando una línea del usuario
+            sender_task.cancel()
+            try:
+                await sender_task
+            except asyncio.CancelledError:
+                pass
+        for action in ("broadcast", "idle_timeout", "leave_success", "room_closed", "upload_failed", "error"):
+            client.on(action, None)
+        client.on("disconnected", lambda msg: print("\n[!] Desconectado del servidor."))
 
-async def select_room(reader, writer):
+async def select_room(client, state):
     """Muestra lista y permite elegir sala. Retorna True si entra, False si sale del app."""
-    # 1. Pedir lista
-    writer.write(protocol.create_message("get_rooms"))
-    await writer.drain()
-    
-    # 2. Recibir lista
+    # 1. Pedir lista (la respuesta se reconoce por su "req", aunque se intercalen avisos)
     try:
-        data = await reader.readuntil(MESSAGE_DELIMITER)
-        msg = protocol.parse_message(data)
-    except:
+        rooms = await client.list_rooms()
+    except (RequestError, ConnectionError, asyncio.TimeoutError):
         return False
-    
+
     print("\n=== MENÚ DE SALAS ===")
-    for room in msg.get("rooms", []):
-        print(f"[{room['id']}] {room['nombre']}")
+    for room in rooms:
+        print(f"[{room['id']}] {room['nombre']} ({room.get('miembros', 0)} conectados)")
     print("---------------------")
     print("Escribe el ID para entrar, o 'quit' para cerrar el programa.")
-    
-    # 3. Elegir
-    loop = asyncio.get_running_loop()
+
+    # 2. Elegir
     while True:
-        choice = await loop.run_in_executor(None, input, "Opción > ")
-        choice = choice.strip()
-        
-        if choice.lower() == "quit":
+        choice = (await ainput("Opción > ")).strip()
+
+        if choice.lower() == "quit" or not client.connected:
             return False # Salir del programa
 
-        writer.write(protocol.create_message("join", room_id=choice))
-        await writer.drain()
-        
-        # 4. Confirmación
-        data = await reader.readuntil(MESSAGE_DELIMITER)
-        resp = protocol.parse_message(data)
-        
-        if resp.get("action") == "join_success":
-            print(f"\n>>> Unido a {resp.get('room_name')}. Cargando historial...")
-            for old_msg in resp.get("history", []):
-                print(f"[{old_msg['username']}]: {old_msg['contenido']}")
-            print("-" * 30)
-            return True # Entró a sala
-        else:
-            print(f"Error: {resp.get('message')}")
+        # 3. Confirmación
+        try:
+            resp = await client.join(choice)
+        except RequestError as e:
+            print(f"Error: {e}")
+            continue
+        except (ConnectionError, asyncio.TimeoutError):
+            return False
+
+        print(f"\n>>> Unido a {resp.get('room_name')}. Cargando historial...")
+        history = resp.get("history", [])
+        for old_msg in history:
+            print(f"[{old_msg['username']}]: {old_msg['contenido']}")
+        # Cursor para pedir lo anterior con '/mas'
+        state["oldest_id"] = _oldest_id(history)
+        print("-" * 30)
+        return True # Entró a sala
 
 async def main():
     print("--- SCEE Cliente v0.4 (Navegable) ---")
+    client = ChatClient()
     try:
-        reader, writer = await asyncio.open_connection(HOST, PORT)
-    except:
+        await client.connect()
+    except OSError:
         print("No se pudo conectar al servidor.")
         return
+    client.on("disconnected", lambda msg: print("\n[!] Desconectado del servidor."))
 
     # --- LOGIN ---
-    user = input("Usuario: ")
-    pwd = getpass.getpass("Contraseña: ")
-    writer.write(protocol.create_message("login", user=user, password=pwd))
-    await writer.drain()
-    
-    data = await reader.readuntil(MESSAGE_DELIMITER)
-    resp = protocol.parse_message(data)
-    
-    if resp.get("action") != "login_success":
+    user = await ainput("Usuario: ")
+    pwd = await asyncio.get_running_loop().run_in_executor(None, getpass.getpass, "Contraseña: ")
+    try:
+        info = await client.login(user, pwd)
+    except (RequestError, ConnectionError, asyncio.TimeoutError):
         print("Login fallido.")
-        writer.close()
+        client.on("disconnected", None)
+        await client.close()
         return
-    
-    print(f"Hola {resp['user']['username']}!")
+
+    print(f"Hola {info['username']}!")
+    # Estado de la interfaz (cursores del historial y de la búsqueda)
+    state = {}
 
     # --- BUCLE PRINCIPAL DE NAVEGACIÓN ---
     while True:
         # Intentar seleccionar sala
-        ingreso_a_sala = await select_room(reader, writer)
-        
-        if ingreso_a_sala:
-            # Si entró, iniciar modo chat
-            await start_chat_mode(reader, writer)
-            # Al volver de start_chat_mode, el bucle while se repite (vuelve al menú)
+        if await select_room(client, state):
+            # Si entró, iniciar modo chat; al volver, el bucle se repite (vuelve al menú)
+            await start_chat_mode(client, state)
         else:
             # Si select_room devolvió False (usuario puso 'quit' en el menú)
             print("Cerrando sesión...")
             break
 
-    writer.close()
-    await writer.wait_closed()
+    client.on("disconnected", None)
+    await client.close()
     print("Adiós.")
 
 if __name__ == "__main__":
+    netprofile.install_event_loop()
     try: asyncio.run(main())
-    except KeyboardInterrupt: pass
\ No newline at end of file
+    except KeyboardInterrupt: pass
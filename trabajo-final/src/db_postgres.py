@@ -0,0 +1,495 @@
+# src/db_postgres.py
+"""
+Backend PostgreSQL de db_manager (DB_TYPE = 'postgresql'), sobre asyncpg.
+
+- Pool de conexiones de asyncpg por proceso (open_pool/close_pool); sin pool
+  abierto se usa una conexión temporal, igual que en SQLite.
+- Sentencias preparadas: asyncpg prepara cada texto SQL la primera vez y lo
+  reutiliza desde la caché de la conexión (DB_STATEMENT_CACHE).
+- Los lotes del write-behind entran con COPY (copy_records_to_table): los ids
+  se reservan antes en la secuencia para devolverlos en el orden del lote.
+- La búsqueda usa una columna tsvector generada con índice GIN sobre
+  contenido_busqueda: el texto en minúsculas y sin acentos que se calcula en
+  Python al guardar (search_text), con la misma función que normaliza la
+  consulta, así "fisica" encuentra "Física" igual que en SQLite.
+
+Los resultados tienen la misma forma que los del backend SQLite (ver
+db_manager.py): los timestamps se devuelven como texto con to_char().
+"""
+
+import asyncio
+import logging
+import re
+import unicodedata
+from contextlib import asynccontextmanager
+from datetime import datetime
+from . import security
+from .config import DB_DSN, DB_POOL_SIZE, DB_STATEMENT_CACHE, HISTORY_LIMIT, SEARCH_CANDIDATES, SEARCH_TIMEOUT
+
+try:
+    import asyncpg
+except ImportError:  # Dependencia opcional: sólo hace falta con DB_TYPE = 'postgresql'
+    asyncpg = None
+
+log = logging.getLogger(__name__)
+
+# Mismo formato que los timestamps de SQLite y del write-behind (los DEFAULT
+# se truncan al segundo, como CURRENT_TIMESTAMP, para ordenar igual)
+TS = "to_char({col}, 'YYYY-MM-DD HH24:MI:SS')"
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Los init_db concurrentes (varios nodos arrancando) se serializan con este lock
+INIT_LOCK_ID = 0x5CEE
+
+# --- ESQUEMA ---
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        rol TEXT NOT NULL CHECK (rol IN ('profesor', 'alumno'))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS salas (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        nombre TEXT UNIQUE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mensajes (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        contenido TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT date_trunc('second', now() AT TIME ZONE 'utc'),
+        usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+        sala_id INTEGER NOT NULL REFERENCES salas (id),
+        contenido_busqueda TEXT NOT NULL,
+        busqueda TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', contenido_busqueda)) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_mensajes_sala_ts ON mensajes (sala_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS idx_mensajes_sala_id ON mensajes (sala_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_mensajes_busqueda ON mensajes USING GIN (busqueda)",
+    """
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        tamano BIGINT NOT NULL,
+        ruta TEXT NOT NULL,
+        refs INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS archivos (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        sala_id INTEGER NOT NULL REFERENCES salas (id),
+        usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+        nombre TEXT NOT NULL,
+        tamano BIGINT NOT NULL,
+        ruta TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT date_trunc('second', now() AT TIME ZONE 'utc'),
+        hash TEXT REFERENCES blobs (hash)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_archivos_sala ON archivos (sala_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_archivos_sala_hash ON archivos (sala_id, hash)",
+]
+
+# --- SENTENCIAS SQL ---
+
+SQL_VERIFY_USER = "SELECT id, username, rol, password FROM usuarios WHERE username = $1"
+SQL_GET_ROOMS = "SELECT id, nombre FROM salas ORDER BY id"
+SQL_CREATE_ROOM = "INSERT INTO salas (nombre) VALUES ($1) ON CONFLICT (nombre) DO NOTHING RETURNING id"
+SQL_DELETE_ROOM_MESSAGES = "DELETE FROM mensajes WHERE sala_id = $1"
+SQL_DELETE_ROOM_FILES = "DELETE FROM archivos WHERE sala_id = $1"
+SQL_DELETE_ROOM = "DELETE FROM salas WHERE id = $1 RETURNING id"
+SQL_SAVE_MESSAGE = "INSERT INTO mensajes (usuario_id, sala_id, contenido, contenido_busqueda) VALUES ($1, $2, $3, $4)"
+# Ids para un lote de COPY, en orden
+SQL_RESERVE_MESSAGE_IDS = "SELECT nextval(pg_get_serial_sequence('mensajes', 'id')) FROM generate_series(1, $1)"
+COPY_COLUMNS = ("id", "usuario_id", "sala_id", "contenido", "contenido_busqueda", "timestamp")
+# Tablas de antes de contenido_busqueda (el tsvector se generaba con translate())
+SQL_HAS_SEARCH_TEXT = """
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'mensajes' AND column_name = 'contenido_busqueda'
+"""
+
+_MESSAGE_COLUMNS = f"m.id, m.contenido, {TS.format(col='m.timestamp')} AS timestamp, u.username"
+SQL_CHAT_HISTORY = f"""
+    SELECT {_MESSAGE_COLUMNS}
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = $1
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT $2
+"""
+# Paginación por keyset sobre el id del mensaje (índice idx_mensajes_sala_id)
+SQL_HISTORY_BEFORE = f"""
+    SELECT {_MESSAGE_COLUMNS}
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = $1 AND m.id < $2
+    ORDER BY m.id DESC
+    LIMIT $3
+"""
+SQL_HISTORY_AFTER = f"""
+    SELECT {_MESSAGE_COLUMNS}
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = $1 AND m.id > $2
+    ORDER BY m.id ASC
+    LIMIT $3
+"""
+SQL_HISTORY_LATEST = f"""
+    SELECT {_MESSAGE_COLUMNS}
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = $1
+    ORDER BY m.id DESC
+    LIMIT $2
+"""
+# Como en SQLite: se rankean sólo las $4 coincidencias más recientes y el
+# fragmento resaltado se arma sólo para la página pedida (sobre el texto
+# original: una palabra con acentos coincide pero no se marca).
+SQL_SEARCH = f"""
+    WITH q AS (SELECT to_tsquery('simple', $1) AS query),
+    candidates AS (
+        SELECT m.id, m.sala_id, m.usuario_id, m.contenido, m.timestamp, m.busqueda
+        FROM mensajes m, q
+        WHERE m.busqueda @@ q.query
+          AND ($2::integer IS NULL OR m.sala_id = $2)
+          AND ($3::integer IS NULL OR m.usuario_id = $3)
+        ORDER BY m.id DESC
+        LIMIT $4
+    ),
+    top AS (
+        SELECT c.*, ts_rank(c.busqueda, q.query) AS rank
+        FROM candidates c, q
+        ORDER BY rank DESC, c.id DESC
+        LIMIT $5 OFFSET $6
+    )
+    SELECT top.id, top.sala_id, top.contenido, {TS.format(col='top.timestamp')} AS timestamp, u.username,
+           ts_headline('simple', top.contenido, q.query,
+                       'StartSel=[, StopSel=], MaxWords=16, MinWords=4, FragmentDelimiter=…') AS fragmento
+    FROM top
+    JOIN usuarios u ON top.usuario_id = u.id, q
+    ORDER BY top.rank DESC, top.id DESC
+"""
+SQL_USER_ID = "SELECT id FROM usuarios WHERE username = $1"
+
+# Recursos compartidos (ver storage_process.py y el esquema de db_sqlite.py)
+SQL_SAVE_FILE = """
+    INSERT INTO archivos (sala_id, usuario_id, nombre, tamano, ruta, hash)
+    VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+"""
+SQL_INSERT_BLOB = "INSERT INTO blobs (hash, tamano, ruta, refs) VALUES ($1, $2, $3, 0) ON CONFLICT DO NOTHING"
+SQL_BLOB_ADD_REF = "UPDATE blobs SET refs = refs + 1 WHERE hash = $1 RETURNING hash"
+SQL_BLOB_DROP_REFS = "UPDATE blobs SET refs = refs - $1 WHERE hash = $2"
+SQL_FIND_BLOB = "SELECT hash, tamano, ruta, refs FROM blobs WHERE hash = $1"
+SQL_DELETE_ORPHAN_BLOBS = "DELETE FROM blobs WHERE refs <= 0 RETURNING ruta"
+SQL_ROOM_FILE_REFS = "SELECT hash, ruta FROM archivos WHERE sala_id = $1"
+SQL_ROOM_FILE_BY_HASH = """
+    SELECT id, sala_id, nombre, tamano, ruta FROM archivos WHERE sala_id = $1 AND hash = $2 LIMIT 1
+"""
+SQL_GET_FILE = f"""
+    SELECT a.id, a.sala_id, a.nombre, a.tamano, a.ruta, {TS.format(col='a.timestamp')} AS timestamp, u.username
+    FROM archivos a
+    JOIN usuarios u ON a.usuario_id = u.id
+    WHERE a.id = $1
+"""
+SQL_ROOM_FILES = f"""
+    SELECT a.id, a.nombre, a.tamano, {TS.format(col='a.timestamp')} AS timestamp, u.username
+    FROM archivos a
+    JOIN usuarios u ON a.usuario_id = u.id
+    WHERE a.sala_id = $1
+    ORDER BY a.id DESC
+    LIMIT $2
+"""
+
+
+def _require_asyncpg():
+    if asyncpg is None:
+        raise RuntimeError("DB_TYPE = 'postgresql' necesita el paquete asyncpg (pip install asyncpg)")
+
+
+async def _connect(read_only: bool = False):
+    _require_asyncpg()
+    settings = {"default_transaction_read_only": "on"} if read_only else None
+    return await asyncpg.connect(DB_DSN, statement_cache_size=DB_STATEMENT_CACHE, server_settings=settings)
+
+
+_pool = None
+_search_pool = None
+
+
+async def open_pool(size: int = DB_POOL_SIZE, search_size: int = 0):
+    """
+    Abre el pool de conexiones del proceso actual (idempotente) y, si
+    search_size > 0, uno de sólo lectura para las búsquedas.
+    """
+    global _pool, _search_pool
+    if _pool is not None:
+        return
+    _require_asyncpg()
+    _pool = await asyncpg.create_pool(
+        DB_DSN, min_size=size, max_size=size, statement_cache_size=DB_STATEMENT_CACHE
+    )
+    log.info("Pool de PostgreSQL abierto (%s conexiones).", size)
+    if search_size > 0:
+        _search_pool = await asyncpg.create_pool(
+            DB_DSN, min_size=search_size, max_size=search_size, statement_cache_size=DB_STATEMENT_CACHE,
+            server_settings={"default_transaction_read_only": "on"}
+        )
+        log.info("Pool de búsqueda abierto (%s conexiones).", search_size)
+
+
+async def close_pool():
+    """Cierra los pools de conexiones si estaban abiertos."""
+    global _pool, _search_pool
+    for pool in (_search_pool, _pool):
+        if pool is not None:
+            await pool.close()
+    if _pool is not None:
+        log.info("Pool de PostgreSQL cerrado.")
+    _pool = _search_pool = None
+
+
+@asynccontextmanager
+async def _connection(pool=None, read_only: bool = False):
+    """Entrega una conexión del pool o, si no hay pool, una temporal."""
+    pool = pool or _pool
+    if pool is not None:
+        async with pool.acquire() as conn:
+            yield conn
+    else:
+        conn = await _connect(read_only)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+
+async def init_db():
+    """Crea las tablas, índices y datos semilla (idempotente)."""
+    log.info("Inicializando base de datos PostgreSQL...")
+    async with _connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", INIT_LOCK_ID)
+            for statement in SCHEMA:
+                await conn.execute(statement)
+            if await conn.fetchval(SQL_HAS_SEARCH_TEXT) is None:
+                await _migrate_search_text(conn)
+
+            # Datos semilla (las contraseñas se guardan hasheadas)
+            await conn.executemany(
+                "INSERT INTO usuarios (username, password, rol) VALUES ($1, $2, $3) "
+                "ON CONFLICT (username) DO NOTHING",
+                [('profe', security.hash_password('123'), 'profesor'),
+                 ('alumno', security.hash_password('456'), 'alumno')]
+            )
+            # Migración: claves en texto plano cargadas a mano
+            plain = [(security.hash_password(row["password"]), row["id"])
+                     for row in await conn.fetch("SELECT id, password FROM usuarios")
+                     if not security.is_hashed(row["password"])]
+            if plain:
+                await conn.executemany("UPDATE usuarios SET password = $1 WHERE id = $2", plain)
+                log.info("Migradas %s contraseñas en texto plano a scrypt.", len(plain))
+            await conn.executemany(
+                "INSERT INTO salas (nombre) VALUES ($1) ON CONFLICT (nombre) DO NOTHING",
+                [('General',), ('Física I',), ('Matemática II',)]
+            )
+    log.info("Base de datos lista.")
+
+
+async def _migrate_search_text(conn):
+    """Pasa una tabla mensajes vieja al tsvector sobre contenido_busqueda."""
+    await conn.execute("ALTER TABLE mensajes ADD COLUMN contenido_busqueda TEXT")
+    rows = await conn.fetch("SELECT id, contenido FROM mensajes")
+    await conn.executemany("UPDATE mensajes SET contenido_busqueda = $2 WHERE id = $1",
+                           [(row["id"], search_text(row["contenido"])) for row in rows])
+    await conn.execute("ALTER TABLE mensajes ALTER COLUMN contenido_busqueda SET NOT NULL")
+    # El índice GIN cae con la columna y se vuelve a crear sobre la nueva
+    await conn.execute("ALTER TABLE mensajes DROP COLUMN busqueda")
+    await conn.execute("ALTER TABLE mensajes ADD COLUMN busqueda TSVECTOR "
+                       "GENERATED ALWAYS AS (to_tsvector('simple', contenido_busqueda)) STORED")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_busqueda ON mensajes USING GIN (busqueda)")
+    log.info("Migrados %s mensajes al índice de búsqueda sin acentos.", len(rows))
+
+
+async def verify_user(username, password) -> dict | None:
+    """
+    Verifica credenciales contra el hash scrypt almacenado.
+    Sólo se llama desde los procesos de autenticación (auth_process).
+    """
+    async with _connection() as conn:
+        row = await conn.fetchrow(SQL_VERIFY_USER, username)
+    if row is None:
+        security.dummy_verify(password or '')
+        return None
+    if not security.verify_password(password or '', row["password"]):
+        return None
+    return {"id": row["id"], "username": row["username"], "rol": row["rol"]}
+
+
+async def get_rooms() -> list[dict]:
+    async with _connection() as conn:
+        return [dict(row) for row in await conn.fetch(SQL_GET_ROOMS)]
+
+
+async def create_room(name: str) -> int | None:
+    """Crea una sala y devuelve su id, o None si el nombre ya existe."""
+    async with _connection() as conn:
+        return await conn.fetchval(SQL_CREATE_ROOM, name)
+
+
+async def delete_room(room_id: int) -> bool:
+    """Ver db_sqlite.delete_room."""
+    async with _connection() as conn:
+        async with conn.transaction():
+            await conn.execute(SQL_DELETE_ROOM_MESSAGES, room_id)
+            await _drop_room_files(conn, room_id)
+            return await conn.fetchval(SQL_DELETE_ROOM, room_id) is not None
+
+
+async def find_blob(digest: str) -> dict | None:
+    async with _connection() as conn:
+        row = await conn.fetchrow(SQL_FIND_BLOB, digest)
+    return dict(row) if row else None
+
+
+async def get_room_file_by_hash(room_id: int, digest: str) -> dict | None:
+    async with _connection() as conn:
+        row = await conn.fetchrow(SQL_ROOM_FILE_BY_HASH, room_id, digest)
+    return dict(row) if row else None
+
+
+async def add_file_ref(room_id: int, user_id: int, name: str, digest: str, size: int, path: str,
+                       create: bool = False) -> dict | None:
+    """Ver db_sqlite.add_file_ref."""
+    async with _connection() as conn:
+        async with conn.transaction():
+            if create:
+                await conn.execute(SQL_INSERT_BLOB, digest, size, path)
+            if await conn.fetchval(SQL_BLOB_ADD_REF, digest) is None:
+                return None  # Sin blob no se escribió nada
+            file_id = await conn.fetchval(SQL_SAVE_FILE, room_id, user_id, name, size, path, digest)
+    return {"id": file_id, "sala_id": room_id, "nombre": name, "tamano": size, "ruta": path}
+
+
+async def _drop_room_files(conn, room_id: int) -> list[str]:
+    """Ver db_sqlite._drop_room_files."""
+    rows = await conn.fetch(SQL_ROOM_FILE_REFS, room_id)
+    refs = {}
+    for row in rows:
+        if row["hash"] is not None:
+            refs[row["hash"]] = refs.get(row["hash"], 0) + 1
+    await conn.executemany(SQL_BLOB_DROP_REFS, [(count, digest) for digest, count in refs.items()])
+    await conn.execute(SQL_DELETE_ROOM_FILES, room_id)
+    return [row["ruta"] for row in rows if row["hash"] is None]
+
+
+async def release_room_files(room_id: int) -> list[str]:
+    """Ver db_sqlite.release_room_files."""
+    async with _connection() as conn:
+        async with conn.transaction():
+            unused = await _drop_room_files(conn, room_id)
+            unused += [row["ruta"] for row in await conn.fetch(SQL_DELETE_ORPHAN_BLOBS)]
+    return unused
+
+
+async def get_file(file_id: int) -> dict | None:
+    async with _connection() as conn:
+        row = await conn.fetchrow(SQL_GET_FILE, file_id)
+    return dict(row) if row else None
+
+
+async def get_room_files(room_id: int, limit: int) -> list[dict]:
+    async with _connection() as conn:
+        return [dict(row) for row in await conn.fetch(SQL_ROOM_FILES, room_id, limit)]
+
+
+async def save_message(user_id: int, room_id: int, content: str):
+    async with _connection() as conn:
+        await conn.execute(SQL_SAVE_MESSAGE, user_id, room_id, content, search_text(content))
+
+
+async def save_messages(rows: list[tuple]) -> list[int]:
+    """
+    Guarda un lote (usuario_id, sala_id, contenido, timestamp) con COPY en
+    una sola transacción. Devuelve los ids asignados, en el orden de `rows`.
+    """
+    async with _connection() as conn:
+        async with conn.transaction():
+            ids = [row[0] for row in await conn.fetch(SQL_RESERVE_MESSAGE_IDS, len(rows))]
+            await conn.copy_records_to_table(
+                "mensajes", columns=COPY_COLUMNS,
+                records=[(message_id, user_id, room_id, content, search_text(content),
+                          datetime.strptime(timestamp, TS_FORMAT))
+                         for message_id, (user_id, room_id, content, timestamp) in zip(ids, rows)]
+            )
+    return ids
+
+
+async def get_history_page(room_id: int, before: int | None = None,
+                           after: int | None = None, limit=HISTORY_LIMIT) -> list[dict]:
+    """Ver db_sqlite.get_history_page."""
+    if after is not None:
+        query, params, newest_first = SQL_HISTORY_AFTER, (room_id, after, limit), False
+    elif before is not None:
+        query, params, newest_first = SQL_HISTORY_BEFORE, (room_id, before, limit), True
+    else:
+        query, params, newest_first = SQL_HISTORY_LATEST, (room_id, limit), True
+    async with _connection() as conn:
+        page = [dict(row) for row in await conn.fetch(query, *params)]
+    return page[::-1] if newest_first else page
+
+
+async def get_chat_history(room_id: int, limit=HISTORY_LIMIT) -> list[dict]:
+    async with _connection() as conn:
+        return [dict(row) for row in await conn.fetch(SQL_CHAT_HISTORY, room_id, limit)][::-1]
+
+
+def search_text(text: str) -> str:
+    """
+    Minúsculas y sin acentos (NFD sin marcas combinantes). Se aplica al
+    guardar cada mensaje y a cada palabra de la consulta. NFD y no NFKD: como
+    remove_diacritics de SQLite, no pliega ligaduras ni superíndices.
+    """
+    return "".join(c for c in unicodedata.normalize("NFD", text.lower()) if not unicodedata.combining(c))
+
+
+def ts_query(text: str) -> str | None:
+    """
+    Texto del usuario -> tsquery: todas las palabras (sin acentos, en
+    minúsculas) deben aparecer; una palabra terminada en '*' busca por prefijo.
+    Sólo pasan caracteres de palabra, así no se inyectan operadores.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        tokens = re.findall(r"\w+", search_text(word))
+        terms += [f"'{token}'" for token in tokens[:-1]]
+        if tokens:
+            terms.append(f"'{tokens[-1]}'" + (":*" if prefix else ""))
+    return " & ".join(terms) or None
+
+
+async def search_messages(text: str, room_id: int | None = None, username: str | None = None,
+                          limit: int = 20, offset: int = 0, timeout: float = SEARCH_TIMEOUT) -> list[dict]:
+    """Ver db_sqlite.search_messages. PostgreSQL cancela la consulta si vence `timeout`."""
+    query = ts_query(text)
+    if query is None:
+        return []
+    async with _connection(_search_pool, read_only=True) as conn:
+        user_id = None
+        if username is not None:
+            user_id = await conn.fetchval(SQL_USER_ID, username)
+            if user_id is None:
+                return []
+        try:
+            rows = await conn.fetch(
+                SQL_SEARCH, query, room_id, user_id, SEARCH_CANDIDATES, limit, offset, timeout=timeout
+            )
+        except asyncio.TimeoutError as e:
+            raise TimeoutError("La búsqueda tardó demasiado") from e
+    return [dict(row) for row in rows]
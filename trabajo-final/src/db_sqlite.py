@@ -0,0 +1,677 @@
+# src/db_sqlite.py
+"""
+Backend SQLite de db_manager (DB_TYPE = 'sqlite'), sobre aiosqlite.
+Incluye manejo de salas y mensajes persistentes.
+
+Las consultas usan un pool de conexiones de larga vida (ver ConnectionPool).
+Si el pool no fue abierto en este proceso (por ejemplo, en el proceso de
+autenticación) se usa una conexión temporal, como antes.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+import aiosqlite
+from . import security
+from .config import (
+    DB_NAME, DB_POOL_SIZE, DB_JOURNAL_MODE, DB_SYNCHRONOUS,
+    DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE, HISTORY_LIMIT, SEARCH_CANDIDATES, SEARCH_TIMEOUT
+)
+
+log = logging.getLogger(__name__)
+
+# --- SENTENCIAS SQL ---
+# Se definen una sola vez: sqlite3 reutiliza la sentencia preparada de su caché
+# cuando el texto SQL es idéntico y la conexión es la misma.
+
+SQL_VERIFY_USER = "SELECT id, username, rol, password FROM usuarios WHERE username = ?"
+SQL_GET_ROOMS = "SELECT id, nombre FROM salas ORDER BY id"
+SQL_CREATE_ROOM = "INSERT INTO salas (nombre) VALUES (?)"
+SQL_DELETE_ROOM_MESSAGES = "DELETE FROM mensajes WHERE sala_id = ?"
+SQL_DELETE_ROOM_FILES = "DELETE FROM archivos WHERE sala_id = ?"
+SQL_DELETE_ROOM = "DELETE FROM salas WHERE id = ?"
+SQL_SAVE_MESSAGE = "INSERT INTO mensajes (usuario_id, sala_id, contenido) VALUES (?, ?, ?)"
+SQL_SAVE_MESSAGE_TS = (
+    "INSERT INTO mensajes (usuario_id, sala_id, contenido, timestamp) VALUES (?, ?, ?, ?)"
+)
+SQL_CHAT_HISTORY = """
+    SELECT m.id, m.contenido, m.timestamp, u.username 
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = ?
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT ?
+"""
+# Paginación por keyset sobre el id del mensaje (índice idx_mensajes_sala_id)
+SQL_HISTORY_BEFORE = """
+    SELECT m.id, m.contenido, m.timestamp, u.username
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = ? AND m.id < ?
+    ORDER BY m.id DESC
+    LIMIT ?
+"""
+SQL_HISTORY_AFTER = """
+    SELECT m.id, m.contenido, m.timestamp, u.username
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = ? AND m.id > ?
+    ORDER BY m.id ASC
+    LIMIT ?
+"""
+SQL_HISTORY_LATEST = """
+    SELECT m.id, m.contenido, m.timestamp, u.username
+    FROM mensajes m
+    JOIN usuarios u ON m.usuario_id = u.id
+    WHERE m.sala_id = ?
+    ORDER BY m.id DESC
+    LIMIT ?
+"""
+# Búsqueda de texto completo: índice FTS5 de contenido externo sobre mensajes.
+# sala_id y usuario_id también se indexan (como tokens) para que los filtros
+# se resuelvan dentro del índice; el ranking (bm25) sólo pondera el contenido.
+# Se rankean las :candidates coincidencias más recientes (rango de rowid que
+# FTS5 recorre sin puntuar) y recién la página elegida se cruza con mensajes.
+SQL_SEARCH = """
+    WITH top AS (
+        SELECT rowid AS id, rank, snippet(mensajes_fts, 0, '[', ']', '…', 16) AS fragmento
+        FROM mensajes_fts
+        WHERE mensajes_fts MATCH :match AND rowid >= (
+            SELECT min(rowid) FROM (
+                SELECT rowid FROM mensajes_fts WHERE mensajes_fts MATCH :match
+                ORDER BY rowid DESC LIMIT :candidates
+            )
+        )
+        ORDER BY rank, rowid DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT m.id, m.sala_id, m.contenido, m.timestamp, u.username, top.fragmento
+    FROM top
+    JOIN mensajes m ON m.id = top.id
+    JOIN usuarios u ON m.usuario_id = u.id
+    ORDER BY top.rank, top.id DESC
+"""
+SQL_USER_ID = "SELECT id FROM usuarios WHERE username = ?"
+# Instrucciones de la VM de SQLite entre chequeos del plazo de una búsqueda
+SEARCH_PROGRESS_STEPS = 10000
+
+# Recursos compartidos (ver storage_process.py)
+# El contenido se guarda una sola vez por hash SHA-256 (tabla blobs) y cada
+# archivo de una sala es una referencia; blobs.refs cuenta esas referencias.
+SQL_SAVE_FILE = """
+    INSERT INTO archivos (sala_id, usuario_id, nombre, tamano, ruta, hash) VALUES (?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_BLOB = "INSERT OR IGNORE INTO blobs (hash, tamano, ruta, refs) VALUES (?, ?, ?, 0)"
+SQL_BLOB_ADD_REF = "UPDATE blobs SET refs = refs + 1 WHERE hash = ?"
+SQL_BLOB_DROP_REFS = "UPDATE blobs SET refs = refs - ? WHERE hash = ?"
+SQL_FIND_BLOB = "SELECT hash, tamano, ruta, refs FROM blobs WHERE hash = ?"
+SQL_ORPHAN_BLOBS = "SELECT ruta FROM blobs WHERE refs <= 0"
+SQL_DELETE_ORPHAN_BLOBS = "DELETE FROM blobs WHERE refs <= 0"
+SQL_ROOM_FILE_REFS = "SELECT hash, ruta FROM archivos WHERE sala_id = ?"
+SQL_ROOM_FILE_BY_HASH = """
+    SELECT id, sala_id, nombre, tamano, ruta FROM archivos WHERE sala_id = ? AND hash = ? LIMIT 1
+"""
+SQL_GET_FILE = """
+    SELECT a.id, a.sala_id, a.nombre, a.tamano, a.ruta, a.timestamp, u.username
+    FROM archivos a
+    JOIN usuarios u ON a.usuario_id = u.id
+    WHERE a.id = ?
+"""
+SQL_ROOM_FILES = """
+    SELECT a.id, a.nombre, a.tamano, a.timestamp, u.username
+    FROM archivos a
+    JOIN usuarios u ON a.usuario_id = u.id
+    WHERE a.sala_id = ?
+    ORDER BY a.id DESC
+    LIMIT ?
+"""
+
+
+async def _configure(db: aiosqlite.Connection):
+    """Aplica los PRAGMAs de rendimiento a una conexión recién abierta."""
+    db.row_factory = aiosqlite.Row
+    await db.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE};")
+    await db.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS};")
+    await db.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)};")
+    await db.execute("PRAGMA foreign_keys = ON;")
+
+
+async def _connect() -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DB_NAME, cached_statements=DB_STATEMENT_CACHE)
+    await _configure(db)
+    return db
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones aiosqlite persistentes.
+    Cada conexión tiene su propio hilo de trabajo; se reparten con una cola
+    para no pagar connect/close (ni crear un hilo nuevo) en cada consulta.
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE, connect=None, name: str = "BD"):
+        self.size = size
+        self.connect = connect or _connect
+        self.name = name
+        self._conns: list[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        for _ in range(self.size):
+            db = await self.connect()
+            self._conns.append(db)
+            self._idle.put_nowait(db)
+        log.info("Pool de %s abierto (%s conexiones, journal=%s).", self.name, self.size, DB_JOURNAL_MODE)
+
+    async def close(self):
+        for db in self._conns:
+            try:
+                await db.close()
+            except Exception as e:
+                log.warning("Error al cerrar conexión del pool: %s", e)
+        self._conns.clear()
+        self._idle = asyncio.Queue()
+        log.info("Pool de %s cerrado.", self.name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            try:
+                # Una sentencia que falló a mitad de transacción deja tomado el
+                # lock de escritura: nadie más podría escribir en la BD
+                if db.in_transaction:
+                    await db.rollback()
+            except Exception as e:
+                log.warning("No se pudo deshacer la transacción de una conexión del pool: %s", e)
+            finally:
+                self._idle.put_nowait(db)
+
+
+async def _connect_search() -> aiosqlite.Connection:
+    """
+    Conexión de sólo lectura para búsquedas. Un progress handler corta la
+    consulta (OperationalError 'interrupted') cuando vence su plazo.
+    """
+    db = await _connect()
+    await db.execute("PRAGMA query_only = ON;")
+    db.search_deadline = float("inf")
+    await db.set_progress_handler(lambda: time.monotonic() > db.search_deadline, SEARCH_PROGRESS_STEPS)
+    return db
+
+
+_pool: ConnectionPool | None = None
+_search_pool: ConnectionPool | None = None
+
+
+async def open_pool(size: int = DB_POOL_SIZE, search_size: int = 0):
+    """
+    Abre el pool de conexiones del proceso actual (idempotente) y, si
+    search_size > 0, el de búsquedas.
+    """
+    global _pool, _search_pool
+    if _pool is not None:
+        return
+    pool = ConnectionPool(size)
+    await pool.open()
+    _pool = pool
+    if search_size > 0:
+        search_pool = ConnectionPool(search_size, connect=_connect_search, name="búsqueda")
+        await search_pool.open()
+        _search_pool = search_pool
+
+
+async def close_pool():
+    """Cierra los pools de conexiones si estaban abiertos."""
+    global _pool, _search_pool
+    if _search_pool is not None:
+        search_pool, _search_pool = _search_pool, None
+        await search_pool.close()
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    await pool.close()
+
+
+@asynccontextmanager
+async def _connection():
+    """Entrega una conexión del pool o, si no hay pool, una temporal."""
+    if _pool is not None:
+        async with _pool.acquire() as db:
+            yield db
+    else:
+        db = await _connect()
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+@asynccontextmanager
+async def _transaction():
+    """Conexión para escribir: si algo falla antes del commit, se deshace."""
+    async with _connection() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
+
+
+@asynccontextmanager
+async def _search_connection():
+    if _search_pool is not None:
+        async with _search_pool.acquire() as db:
+            yield db
+    else:
+        db = await _connect_search()
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+async def init_db():
+    """
+    Inicializa la base de datos, tablas y datos semilla.
+    """
+    log.info("Inicializando base de datos en '%s'...", DB_NAME)
+    async with aiosqlite.connect(DB_NAME) as db:
+        # El modo WAL es persistente: queda grabado en el archivo de la BD
+        await db.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE};")
+        await db.execute("PRAGMA foreign_keys = ON;")
+
+        # Tablas (Usuarios, Salas, Mensajes)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            rol TEXT NOT NULL CHECK(rol IN ('profesor', 'alumno'))
+        );
+        """)
+        
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS salas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT UNIQUE NOT NULL
+        );
+        """)
+
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS mensajes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contenido TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER NOT NULL,
+            sala_id INTEGER NOT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (sala_id) REFERENCES salas (id)
+        );
+        """)
+
+        # Metadatos de los archivos compartidos en cada sala; el contenido vive
+        # en el directorio del proceso de almacenamiento (ruta relativa)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS archivos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sala_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            nombre TEXT NOT NULL,
+            tamano INTEGER NOT NULL,
+            ruta TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (sala_id) REFERENCES salas (id)
+        );
+        """)
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archivos_sala ON archivos (sala_id, id);
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            tamano INTEGER NOT NULL,
+            ruta TEXT NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        # Migración: archivos subidos antes del almacenamiento por contenido
+        # no tienen hash y conservan su ruta por sala
+        cursor = await db.execute("PRAGMA table_info(archivos)")
+        if "hash" not in [row[1] for row in await cursor.fetchall()]:
+            await db.execute("ALTER TABLE archivos ADD COLUMN hash TEXT REFERENCES blobs (hash)")
+        await cursor.close()
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archivos_sala_hash ON archivos (sala_id, hash);
+        """)
+
+        # Índice compuesto para el historial por sala (WHERE sala_id ORDER BY timestamp).
+        # SQLite agrega el rowid (id) al final de cada entrada, así que también
+        # resuelve el desempate por id sin ordenar en memoria.
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mensajes_sala_ts ON mensajes (sala_id, timestamp);
+        """)
+        # Índice para la paginación por id dentro de una sala
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mensajes_sala_id ON mensajes (sala_id, id);
+        """)
+
+        # Índice de texto completo. Los triggers lo mantienen al día con
+        # cualquier escritura (incluidos los lotes del write-behind y el
+        # borrado de una sala); remove_diacritics hace que "fisica" encuentre "Física".
+        cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'mensajes_fts'")
+        fts_exists = await cursor.fetchone() is not None
+        await cursor.close()
+        await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS mensajes_fts USING fts5(
+            contenido, sala_id, usuario_id,
+            content='mensajes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """)
+        await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS mensajes_fts_ai AFTER INSERT ON mensajes BEGIN
+            INSERT INTO mensajes_fts (rowid, contenido, sala_id, usuario_id)
+            VALUES (new.id, new.contenido, new.sala_id, new.usuario_id);
+        END;
+        """)
+        await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS mensajes_fts_ad AFTER DELETE ON mensajes BEGIN
+            INSERT INTO mensajes_fts (mensajes_fts, rowid, contenido, sala_id, usuario_id)
+            VALUES ('delete', old.id, old.contenido, old.sala_id, old.usuario_id);
+        END;
+        """)
+        await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS mensajes_fts_au AFTER UPDATE ON mensajes BEGIN
+            INSERT INTO mensajes_fts (mensajes_fts, rowid, contenido, sala_id, usuario_id)
+            VALUES ('delete', old.id, old.contenido, old.sala_id, old.usuario_id);
+            INSERT INTO mensajes_fts (rowid, contenido, sala_id, usuario_id)
+            VALUES (new.id, new.contenido, new.sala_id, new.usuario_id);
+        END;
+        """)
+        if not fts_exists:
+            # Ranking por bm25 sólo sobre el contenido (pesos de sala y usuario en 0)
+            await db.execute("INSERT INTO mensajes_fts (mensajes_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0, 0.0)')")
+            # Migración: indexar los mensajes que ya existían
+            await db.execute("INSERT INTO mensajes_fts (mensajes_fts) VALUES ('rebuild')")
+            log.info("Índice de búsqueda creado.")
+
+        # Datos semilla (las contraseñas se guardan hasheadas)
+        try:
+            await db.executemany(
+                "INSERT INTO usuarios (username, password, rol) VALUES (?, ?, ?)",
+                [('profe', security.hash_password('123'), 'profesor'),
+                 ('alumno', security.hash_password('456'), 'alumno')]
+            )
+        except aiosqlite.IntegrityError:
+            pass
+
+        # Migración: bases creadas antes del hash guardan la clave en texto plano
+        cursor = await db.execute("SELECT id, password FROM usuarios")
+        plain = [(security.hash_password(pwd), user_id)
+                 for user_id, pwd in await cursor.fetchall() if not security.is_hashed(pwd)]
+        await cursor.close()
+        if plain:
+            await db.executemany("UPDATE usuarios SET password = ? WHERE id = ?", plain)
+            log.info("Migradas %s contraseñas en texto plano a scrypt.", len(plain))
+
+        try:
+            await db.executemany(
+                "INSERT INTO salas (nombre) VALUES (?)",
+                [('General',), ('Física I',), ('Matemática II',)]
+            )
+        except aiosqlite.IntegrityError:
+            pass
+
+        await db.commit()
+    log.info("Base de datos lista.")
+
+async def verify_user(username, password) -> dict | None:
+    """
+    Verifica credenciales contra el hash scrypt almacenado.
+    El KDF es CPU intensivo y bloquea el loop: sólo se llama desde los
+    procesos de autenticación (auth_process).
+    """
+    async with _connection() as db:
+        cursor = await db.execute(SQL_VERIFY_USER, (username,))
+        row = await cursor.fetchone()
+        await cursor.close()
+    if row is None:
+        security.dummy_verify(password or '')
+        return None
+    if not security.verify_password(password or '', row["password"]):
+        return None
+    return {"id": row["id"], "username": row["username"], "rol": row["rol"]}
+
+# --- NUEVAS FUNCIONES ETAPA 3 ---
+
+async def get_rooms() -> list[dict]:
+    """Obtiene la lista de todas las salas."""
+    async with _connection() as db:
+        cursor = await db.execute(SQL_GET_ROOMS)
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return [dict(row) for row in rows]
+
+async def create_room(name: str) -> int:
+    """Crea una sala y devuelve su id, o None si el nombre ya existe."""
+    async with _transaction() as db:
+        try:
+            cursor = await db.execute(SQL_CREATE_ROOM, (name,))
+        except aiosqlite.IntegrityError:
+            await db.rollback()
+            return None
+        room_id = cursor.lastrowid
+        await cursor.close()
+        await db.commit()
+        return room_id
+
+async def delete_room(room_id: int) -> bool:
+    """
+    Borra una sala, sus mensajes y sus archivos. False si no existía.
+    Los archivos que llegaron después de release_room_files descuentan acá
+    sus referencias; los blobs que quedan en cero los borra el próximo
+    release_room_files (storage_process.purge_room).
+    """
+    async with _transaction() as db:
+        await db.execute(SQL_DELETE_ROOM_MESSAGES, (room_id,))
+        await _drop_room_files(db, room_id)
+        cursor = await db.execute(SQL_DELETE_ROOM, (room_id,))
+        deleted = cursor.rowcount > 0
+        await cursor.close()
+        await db.commit()
+        return deleted
+
+async def find_blob(digest: str) -> dict | None:
+    async with _connection() as db:
+        cursor = await db.execute(SQL_FIND_BLOB, (digest,))
+        row = await cursor.fetchone()
+        await cursor.close()
+    return dict(row) if row else None
+
+async def get_room_file_by_hash(room_id: int, digest: str) -> dict | None:
+    """Archivo de la sala con ese contenido, si ya fue compartido ahí."""
+    async with _connection() as db:
+        cursor = await db.execute(SQL_ROOM_FILE_BY_HASH, (room_id, digest))
+        row = await cursor.fetchone()
+        await cursor.close()
+    return dict(row) if row else None
+
+async def add_file_ref(room_id: int, user_id: int, name: str, digest: str, size: int, path: str,
+                       create: bool = False) -> dict | None:
+    """
+    Registra un archivo de la sala como referencia al blob `digest`, en una
+    sola transacción. Con create=True da de alta el blob si no existía.
+    Devuelve None si el blob ya no existe (lo liberó otro proceso).
+    """
+    async with _transaction() as db:
+        if create:
+            await db.execute(SQL_INSERT_BLOB, (digest, size, path))
+        cursor = await db.execute(SQL_BLOB_ADD_REF, (digest,))
+        if cursor.rowcount == 0:
+            await cursor.close()
+            await db.rollback()
+            return None
+        await cursor.close()
+        cursor = await db.execute(SQL_SAVE_FILE, (room_id, user_id, name, size, path, digest))
+        file_id = cursor.lastrowid
+        await cursor.close()
+        await db.commit()
+    return {"id": file_id, "sala_id": room_id, "nombre": name, "tamano": size, "ruta": path}
+
+async def _drop_room_files(db, room_id: int) -> list[str]:
+    """
+    Borra los archivos de la sala descontando sus referencias, dentro de la
+    transacción en curso. Devuelve las rutas de los archivos sin hash.
+    """
+    cursor = await db.execute(SQL_ROOM_FILE_REFS, (room_id,))
+    rows = await cursor.fetchall()
+    await cursor.close()
+    refs = {}
+    for row in rows:
+        if row["hash"] is not None:
+            refs[row["hash"]] = refs.get(row["hash"], 0) + 1
+    await db.executemany(SQL_BLOB_DROP_REFS, [(count, digest) for digest, count in refs.items()])
+    await db.execute(SQL_DELETE_ROOM_FILES, (room_id,))
+    return [row["ruta"] for row in rows if row["hash"] is None]
+
+async def release_room_files(room_id: int) -> list[str]:
+    """
+    Quita los archivos de una sala y descuenta sus referencias. Devuelve las
+    rutas que ya nadie usa (blobs sin referencias y archivos sin hash).
+    """
+    async with _transaction() as db:
+        unused = await _drop_room_files(db, room_id)
+        cursor = await db.execute(SQL_ORPHAN_BLOBS)
+        unused += [row["ruta"] for row in await cursor.fetchall()]
+        await cursor.close()
+        await db.execute(SQL_DELETE_ORPHAN_BLOBS)
+        await db.commit()
+    return unused
+
+async def get_file(file_id: int) -> dict | None:
+    async with _connection() as db:
+        cursor = await db.execute(SQL_GET_FILE, (file_id,))
+        row = await cursor.fetchone()
+        await cursor.close()
+    return dict(row) if row else None
+
+async def get_room_files(room_id: int, limit: int) -> list[dict]:
+    """Archivos de una sala, del más nuevo al más viejo."""
+    async with _connection() as db:
+        cursor = await db.execute(SQL_ROOM_FILES, (room_id, limit))
+        rows = await cursor.fetchall()
+        await cursor.close()
+    return [dict(row) for row in rows]
+
+async def save_message(user_id: int, room_id: int, content: str):
+    """Guarda un mensaje en la base de datos."""
+    async with _transaction() as db:
+        await db.execute(SQL_SAVE_MESSAGE, (user_id, room_id, content))
+        await db.commit()
+
+async def save_messages(rows: list[tuple]) -> list[int]:
+    """
+    Guarda un lote de mensajes en una sola transacción (group commit).
+    Cada fila es (usuario_id, sala_id, contenido, timestamp).
+    Devuelve los ids asignados, en el mismo orden que `rows`.
+    """
+    async with _transaction() as db:
+        await db.executemany(SQL_SAVE_MESSAGE_TS, rows)
+        # Dentro de la transacción nadie más puede escribir, así que los ids
+        # del lote son consecutivos y terminan en last_insert_rowid().
+        cursor = await db.execute("SELECT last_insert_rowid()")
+        (last_id,) = await cursor.fetchone()
+        await cursor.close()
+        await db.commit()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+async def get_history_page(room_id: int, before: int | None = None,
+                           after: int | None = None, limit=HISTORY_LIMIT) -> list[dict]:
+    """
+    Página de historial por keyset sobre el id del mensaje.
+    - before: mensajes con id menor (hacia atrás).
+    - after: mensajes con id mayor (hacia adelante).
+    - ninguno: los más recientes.
+    Siempre devuelve la página ordenada del más viejo al más nuevo.
+    """
+    if after is not None:
+        query, params, newest_first = SQL_HISTORY_AFTER, (room_id, after, limit), False
+    elif before is not None:
+        query, params, newest_first = SQL_HISTORY_BEFORE, (room_id, before, limit), True
+    else:
+        query, params, newest_first = SQL_HISTORY_LATEST, (room_id, limit), True
+
+    async with _connection() as db:
+        cursor = await db.execute(query, params)
+        rows = await cursor.fetchall()
+        await cursor.close()
+    page = [dict(row) for row in rows]
+    return page[::-1] if newest_first else page
+
+async def get_chat_history(room_id: int, limit=HISTORY_LIMIT) -> list[dict]:
+    """Recupera los últimos mensajes de una sala."""
+    async with _connection() as db:
+        # Hacemos JOIN para traer el nombre del usuario
+        cursor = await db.execute(SQL_CHAT_HISTORY, (room_id, limit))
+        rows = await cursor.fetchall()
+        await cursor.close()
+        # Invertimos la lista para mostrar los más viejos arriba y nuevos abajo
+        return [dict(row) for row in rows][::-1]
+
+def fts_query(text: str) -> str | None:
+    """
+    Convierte el texto del usuario en una expresión MATCH segura: cada palabra
+    es una frase entre comillas (sin operadores de FTS5) y todas deben
+    aparecer. Una palabra terminada en '*' busca por prefijo.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+async def search_messages(text: str, room_id: int | None = None, username: str | None = None,
+                          limit: int = 20, offset: int = 0, timeout: float = SEARCH_TIMEOUT) -> list[dict]:
+    """
+    Mensajes que contienen todas las palabras de `text`, del más relevante al
+    menos (bm25; a igual relevancia, el más nuevo primero) entre las
+    SEARCH_CANDIDATES coincidencias más recientes. Se puede filtrar por sala y
+    por autor. Lanza TimeoutError si la consulta supera `timeout`.
+    """
+    match = fts_query(text)
+    if match is None:
+        return []
+    match = f"contenido : ({match})"
+    if room_id is not None:
+        match += f' AND sala_id : "{int(room_id)}"'
+
+    async with _search_connection() as db:
+        if username is not None:
+            cursor = await db.execute(SQL_USER_ID, (username,))
+            row = await cursor.fetchone()
+            await cursor.close()
+            if row is None:
+                return []
+            match += f' AND usuario_id : "{row["id"]}"'
+        db.search_deadline = time.monotonic() + timeout
+        try:
+            cursor = await db.execute(SQL_SEARCH, {
+                "match": match, "candidates": SEARCH_CANDIDATES, "limit": limit, "offset": offset
+            })
+            rows = await cursor.fetchall()
+            await cursor.close()
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise TimeoutError("La búsqueda tardó demasiado") from e
+            raise
+        finally:
+            db.search_deadline = float("inf")
+    return [dict(row) for row in rows]
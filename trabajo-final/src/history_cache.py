@@ -0,0 +1,120 @@
+# src/history_cache.py
+"""
+Caché en memoria del historial reciente de cada sala.
+Guarda los últimos N mensajes por sala en un buffer circular que se alimenta
+desde el camino de escritura, así join_room responde sin ir a la BD.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from .config import HISTORY_LIMIT, HISTORY_CACHE_ROOMS
+from . import db_manager
+
+log = logging.getLogger(__name__)
+
+
+def _key(entry: dict) -> tuple:
+    return (entry["timestamp"], entry["username"], entry["contenido"])
+
+
+class HistoryCache:
+    """
+    Buffers circulares por sala con expulsión LRU.
+
+    En el primer acceso a una sala se precarga desde la BD. `before_load`
+    (opcional) se espera antes de consultar, para que los mensajes que
+    todavía estén en la cola write-behind ya estén en disco.
+    """
+
+    def __init__(self, size=HISTORY_LIMIT, max_rooms=HISTORY_CACHE_ROOMS, before_load=None):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.before_load = before_load
+        self._rooms: OrderedDict[int, deque] = OrderedDict()
+        # Salas que se están cargando: mensajes que llegan mientras tanto
+        self._loading: dict[int, list] = {}
+        self._load_locks: dict[int, asyncio.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, room_id: int, entry: dict):
+        """
+        Registra un mensaje nuevo (sólo si la sala está residente o cargándose).
+        `entry` es el registro devuelto por MessageWriter.put: se comparte, así
+        que recibe su 'id' cuando el lote se persiste.
+        """
+        buf = self._rooms.get(room_id)
+        if buf is not None:
+            buf.append(entry)
+        elif room_id in self._loading:
+            self._loading[room_id].append(entry)
+
+    def insert(self, room_id: int, entry: dict):
+        """
+        Registra un mensaje ya persistido por otro worker o nodo. Llega después
+        del flush de su write-behind, así que se ubica por 'id' entre los que
+        ya están (y se descarta si ya lo tenemos o es más viejo que todo el buffer).
+        """
+        buf = self._rooms.get(room_id)
+        if buf is None:
+            if room_id in self._loading:
+                self._loading[room_id].append(entry)
+            return
+        message_id = entry["id"]
+        pos = len(buf)
+        # Los locales sin id todavía están en la cola write-behind: son más nuevos
+        while pos and (buf[pos - 1]["id"] is None or buf[pos - 1]["id"] >= message_id):
+            if buf[pos - 1]["id"] == message_id:
+                return
+            pos -= 1
+        if len(buf) == buf.maxlen:
+            if pos == 0:
+                return
+            buf.popleft()
+            pos -= 1
+        buf.insert(pos, entry)
+
+    async def get(self, room_id: int) -> list[dict]:
+        """Últimos mensajes de la sala, del más viejo al más nuevo."""
+        buf = self._rooms.get(room_id)
+        if buf is not None:
+            self.hits += 1
+            self._rooms.move_to_end(room_id)
+            return list(buf)
+
+        # Un solo load por sala aunque se unan varios usuarios a la vez
+        lock = self._load_locks.setdefault(room_id, asyncio.Lock())
+        async with lock:
+            buf = self._rooms.get(room_id)
+            if buf is None:
+                self.misses += 1
+                buf = await self._load(room_id)
+        self._load_locks.pop(room_id, None)
+        return list(buf)
+
+    async def _load(self, room_id: int) -> deque:
+        self._loading[room_id] = []
+        try:
+            if self.before_load is not None:
+                await self.before_load()
+            rows = await db_manager.get_chat_history(room_id, self.size)
+        finally:
+            pending = self._loading.pop(room_id)
+
+        buf = deque(rows, maxlen=self.size)
+        # Lo que llegó durante la consulta puede o no estar ya en `rows`
+        seen = {_key(entry) for entry in rows}
+        buf.extend(entry for entry in pending if _key(entry) not in seen)
+
+        self._rooms[room_id] = buf
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+        return buf
+
+    def invalidate(self, room_id: int):
+        self._rooms.pop(room_id, None)
+
+    def stats(self) -> dict:
+        return {"rooms": len(self._rooms), "hits": self.hits, "misses": self.misses}
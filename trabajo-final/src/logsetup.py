@@ -0,0 +1,139 @@
+# src/logsetup.py
+"""
+Logging no bloqueante.
+El código que loguea sólo encola el LogRecord (QueueHandler); un hilo de
+fondo (QueueListener) lo formatea y lo escribe en stderr. Así una escritura
+lenta a la terminal nunca frena el event loop.
+
+Cada proceso (servidor/worker, autenticación, almacenamiento) llama a
+setup_logging() al arrancar con su etiqueta y tiene su propio hilo escritor,
+con el mismo formato y las mismas reglas de muestreo.
+
+- Formato lazy: los mensajes usan '%s' y argumentos; el texto se arma en el
+  hilo escritor y sólo si el nivel lo deja pasar.
+- LOG_FORMAT = 'json' emite una línea JSON por registro.
+- Muestreo: los registros con extra={"event": nombre} se reducen a 1 de cada
+  LOG_SAMPLING[nombre]; el registro conservado informa cuántos representa.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from .config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING
+
+TEXT_FORMAT = '[%(tag)s] %(asctime)s - %(message)s'
+
+_listener: QueueListener | None = None
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que loguea.
+    El de la biblioteca arma el mensaje en prepare() para poder serializarlo
+    entre procesos; acá la cola es local al proceso y eso no hace falta.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _SamplingFilter(logging.Filter):
+    """Deja pasar 1 de cada N registros de cada evento de alta frecuencia."""
+
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self.seen = dict.fromkeys(rates, 0)
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        every = self.rates.get(event)
+        if not every or every <= 1:
+            return True
+        self.seen[event] += 1
+        if self.seen[event] % every != 1:
+            return False
+        record.sampled = every
+        return True
+
+
+class _TagFilter(logging.Filter):
+    """Agrega la etiqueta del proceso a cada registro."""
+
+    def __init__(self, tag: str):
+        super().__init__()
+        self.tag = tag
+
+    def filter(self, record):
+        record.tag = self.tag
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "proc": record.tag,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            entry["event"] = event
+        sampled = getattr(record, "sampled", None)
+        if sampled is not None:
+            entry["sampled"] = sampled
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(tag: str, level=LOG_LEVEL, fmt=LOG_FORMAT, sampling=LOG_SAMPLING):
+    """
+    Configura el logging del proceso actual. Se puede volver a llamar (por
+    ejemplo en un proceso hijo creado con fork, que hereda los handlers del
+    padre pero no su hilo escritor).
+    """
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except RuntimeError:
+            pass  # Heredado por fork: el hilo no existe en este proceso
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = _LazyQueueHandler(records)
+    handler.addFilter(_TagFilter(tag))
+    if sampling:
+        handler.addFilter(_SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Vacía la cola y detiene el hilo escritor."""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except RuntimeError:
+            pass
+        _listener = None
+
+
+atexit.register(shutdown_logging)
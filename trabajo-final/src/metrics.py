@@ -0,0 +1,252 @@
+# src/metrics.py
+"""
+Métricas del servidor en formato de texto de Prometheus.
+
+Contadores, histogramas y gauges (calculados al momento del scrape) que se
+exponen por HTTP en un puerto de administración local (GET /metrics).
+
+Con METRICS_ENABLED en False los constructores devuelven un objeto nulo cuyos
+métodos no hacen nada, y `timed` deja la función decorada intacta: el costo
+en el camino caliente queda en una llamada vacía.
+Cada proceso (worker, proceso de autenticación) tiene su propio registro;
+sólo los procesos que atienden clientes publican el endpoint.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from .config import METRICS_ENABLED
+
+log = logging.getLogger(__name__)
+
+ENABLED = METRICS_ENABLED
+
+# Segundos: de 100µs a 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Cantidades (destinatarios de un broadcast, profundidad de colas)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_registry = {}
+
+
+def _label_str(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Null:
+    """Instrumento deshabilitado."""
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL = _Null()
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} counter")
+        for values, child in self._children.items():
+            out.append(f"{self.name}{_label_str(self.labelnames, values)} {child.value}")
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), child.counts):
+                cumulative += count
+                labels = _label_str(self.labelnames + ("le",), values + (bound,))
+                out.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_str(self.labelnames, values)
+            out.append(f"{self.name}_sum{labels} {child.sum}")
+            out.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class Gauge:
+    """Valor calculado al momento del scrape por `fn` (número o dict etiqueta→valor)."""
+
+    def __init__(self, name: str, help: str, fn, labelname: str | None = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self, out: list):
+        try:
+            value = self.fn()
+        except Exception as e:
+            log.warning("Gauge %s falló: %s", self.name, e)
+            return
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} gauge")
+        if isinstance(value, dict):
+            for label, v in value.items():
+                out.append(f'{self.name}{{{self.labelname}="{label}"}} {v}')
+        else:
+            out.append(f"{self.name} {value}")
+
+
+def counter(name: str, help: str, labelnames=()):
+    if not ENABLED:
+        return NULL
+    return _registry.setdefault(name, Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, buckets=LATENCY_BUCKETS, labelnames=()):
+    if not ENABLED:
+        return NULL
+    return _registry.setdefault(name, Histogram(name, help, buckets, labelnames))
+
+
+def gauge(name: str, help: str, fn, labelname: str | None = None):
+    """Registra (o reemplaza) un gauge calculado."""
+    if ENABLED:
+        _registry[name] = Gauge(name, help, fn, labelname)
+
+
+def timed(metric, *labels):
+    """Decorador: observa la duración de una corrutina en `metric` (segundos)."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        child = metric.labels(*labels)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    out = []
+    for metric in _registry.values():
+        metric.render(out)
+    return "\n".join(out) + "\n"
+
+
+# --- Lag del event loop ---
+
+LOOP_LAG = histogram("scee_event_loop_lag_seconds",
+                     "Retraso del event loop respecto de lo programado")
+
+
+async def monitor_loop_lag(interval: float):
+    """Duerme `interval` y mide cuánto tarde despierta: eso es tiempo de loop bloqueado."""
+    last = {"lag": 0.0}
+    gauge("scee_event_loop_lag_last_seconds", "Último retraso medido del event loop",
+          lambda: last["lag"])
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        last["lag"] = lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.observe(lag)
+
+
+# --- Endpoint HTTP ---
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Se descartan los encabezados hasta la línea vacía
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.Server:
+    server = await asyncio.start_server(_handle_http, host, port)
+    log.info("Métricas en http://%s:%s/metrics", host, port)
+    return server
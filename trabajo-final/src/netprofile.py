@@ -0,0 +1,77 @@
+# src/netprofile.py
+"""
+Perfil de red y event loop.
+- install_event_loop(): usa uvloop si está instalado (y USE_UVLOOP lo permite).
+- listen_socket(): crea el socket de escucha con el perfil (buffers, backlog,
+  SO_REUSEPORT) antes de entregarlo a asyncio.start_server.
+- tune_socket(): aplica TCP_NODELAY, buffers y keepalive a un socket aceptado
+  o conectado.
+"""
+
+import asyncio
+import logging
+import socket
+from .config import NET_PROFILE, NET_PROFILES, USE_UVLOOP
+
+try:
+    import uvloop
+except ImportError:  # Dependencia opcional
+    uvloop = None
+
+log = logging.getLogger(__name__)
+
+
+def get_profile(name: str = NET_PROFILE) -> dict:
+    try:
+        return NET_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Perfil de red desconocido: {name}") from None
+
+
+def install_event_loop(enabled: bool = USE_UVLOOP) -> str:
+    """Instala la política de uvloop si corresponde. Devuelve el loop en uso."""
+    if enabled and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return "uvloop"
+    asyncio.set_event_loop_policy(None)
+    return "asyncio"
+
+
+def tune_socket(sock, profile: dict):
+    """Aplica las opciones del perfil a un socket TCP conectado."""
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(profile["nodelay"]))
+        if profile.get("sndbuf"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, profile["sndbuf"])
+        if profile.get("rcvbuf"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, profile["rcvbuf"])
+        if profile.get("keepalive"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Las opciones finas de keepalive no existen en todas las plataformas
+            for option, key in (("TCP_KEEPIDLE", "keepidle"), ("TCP_KEEPINTVL", "keepintvl"),
+                                ("TCP_KEEPCNT", "keepcnt")):
+                if hasattr(socket, option) and profile.get(key):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), profile[key])
+    except OSError as e:
+        log.warning("No se pudo aplicar el perfil de red al socket: %s", e)
+
+
+def listen_socket(host: str, port: int, profile: dict, reuse_port: bool = False) -> socket.socket:
+    """
+    Socket de escucha ya enlazado. Los buffers se fijan antes de listen()
+    para que los sockets aceptados los hereden (y la ventana TCP escale).
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if profile.get("sndbuf"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, profile["sndbuf"])
+    if profile.get("rcvbuf"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, profile["rcvbuf"])
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
@@ -0,0 +1,238 @@
+# src/outbound.py
+"""
+Cola de salida por conexión.
+Cada cliente tiene una cola acotada atendida por su propia tarea escritora,
+así un broadcast sólo encola bytes y nunca espera el drain() de nadie. La
+tarea existe sólo mientras hay algo pendiente: si la cola está vacía y el
+transporte no tiene bytes sin enviar, put() escribe directo (el socket los
+acepta enseguida) y una conexión ociosa no paga una tarea dormida.
+Las descargas (FileTransfer) viajan por la misma cola para no mezclarse con
+otras tramas, y se envían con sendfile cuando el loop lo soporta.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from .config import OUTBOUND_QUEUE_MAX, SLOW_CONSUMER_POLICY, UPLOAD_CHUNK_SIZE
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+DROPPED = metrics.counter(
+    "scee_outbound_dropped_total", "Mensajes descartados por consumidores lentos", labelnames=("policy",)
+)
+
+
+class FileTransfer:
+    """
+    Trama de cabecera seguida de `size` bytes crudos de un archivo.
+    Va como un único elemento de la cola: las políticas de descarte no la
+    tocan, porque el cliente quedaría desincronizado a mitad de archivo.
+
+    El archivo se abre antes de escribir la cabecera: si ya no está (o es más
+    corto que `size`) se envía `missing` en su lugar. Si falla después de la
+    cabecera, send() lanza OSError y la conexión se corta.
+    """
+
+    __slots__ = ("header", "path", "size", "missing")
+
+    def __init__(self, header: bytes, path: str, size: int, missing: bytes | None = None):
+        self.header = header
+        self.path = path
+        self.size = size
+        self.missing = missing
+
+    async def send(self, writer: asyncio.StreamWriter):
+        try:
+            f = open(self.path, 'rb')
+            if os.fstat(f.fileno()).st_size < self.size:
+                f.close()
+                raise OSError(f"Archivo truncado: {self.path}")
+        except OSError:
+            # Se borró (p. ej. purge_room) o se truncó mientras esperaba en la cola
+            if self.missing is None:
+                raise
+            writer.write(self.missing)
+            return
+        writer.write(self.header)
+        loop = asyncio.get_running_loop()
+        with f:
+            await writer.drain()
+            try:
+                # Copia cero: el kernel pasa del archivo al socket (asyncio estándar)
+                sent = await loop.sendfile(writer.transport, f, 0, self.size)
+                if sent < self.size:
+                    raise OSError(f"Archivo truncado: {self.path}")
+                return
+            except NotImplementedError:
+                pass  # uvloop no implementa sendfile: copia por bloques
+            f.seek(0)
+            remaining = self.size
+            while remaining > 0:
+                block = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not block:
+                    raise OSError(f"Archivo truncado: {self.path}")
+                writer.write(block)
+                remaining -= len(block)
+                await writer.drain()
+
+
+class OutboundQueue:
+    """
+    Buffer de salida de un cliente con política para consumidores lentos.
+    - drop_oldest: descarta el mensaje pendiente más viejo.
+    - drop_newest: descarta el mensaje que se intenta encolar.
+    - disconnect: corta la conexión al superar la marca de agua.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, max_size=OUTBOUND_QUEUE_MAX,
+                 policy=SLOW_CONSUMER_POLICY):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de consumidor lento desconocida: {policy}")
+        self.writer = writer
+        self.max_size = max_size
+        self.policy = policy
+        self.closed = False
+        self._buf = deque()
+        # Tarea escritora; se crea al encolar y termina cuando la cola se vacía
+        self._task: asyncio.Task | None = None
+
+        # Métricas por conexión
+        self.enqueued = 0
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, data: bytes) -> bool:
+        """Encola bytes ya serializados. Nunca bloquea. Devuelve False si se descartan."""
+        if self.closed or not data:
+            return False
+
+        if self._task is None:
+            transport = self.writer.transport
+            if transport is None or transport.is_closing():
+                return False
+            if not transport.get_write_buffer_size():
+                # Par al día: sin cola ni tarea
+                self.writer.write(data)
+                self.enqueued += 1
+                self.sent += 1
+                self.bytes_sent += len(data)
+                return True
+
+        if len(self._buf) >= self.max_size:
+            self.dropped += 1
+            DROPPED.labels(self.policy).inc()
+            if self.policy == DROP_NEWEST:
+                return False
+            if self.policy == DISCONNECT:
+                log.warning("Consumidor lento %s: desconectando.", self.writer.get_extra_info('peername'))
+                self.abort()
+                return False
+            if isinstance(self._buf[0], FileTransfer):
+                return False  # Una descarga en cola no se descarta
+            self._buf.popleft()
+
+        self._buf.append(data)
+        self.enqueued += 1
+        if len(self._buf) > self.max_depth:
+            self.max_depth = len(self._buf)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    def send_file(self, transfer: FileTransfer) -> bool:
+        """Encola una descarga; no cuenta para la marca de agua ni se descarta."""
+        if self.closed:
+            return False
+        self._buf.append(transfer)
+        self.enqueued += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self):
+        try:
+            while self._buf:
+                # Pasamos todo lo pendiente al transporte y esperamos un solo drain()
+                while self._buf:
+                    data = self._buf.popleft()
+                    if isinstance(data, FileTransfer):
+                        # Lo anterior sale primero; después el archivo, en orden
+                        await self.writer.drain()
+                        await data.send(self.writer)
+                        self.sent += 1
+                        self.bytes_sent += len(data.header) + data.size
+                        continue
+                    self.writer.write(data)
+                    self.sent += 1
+                    self.bytes_sent += len(data)
+                await self.writer.drain()
+            # Sin await entre la comprobación y esto: un put() posterior crea otra tarea
+            self._task = None
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Conexión rota o descarga cortada a mitad de archivo: el cliente ya
+            # no puede resincronizarse. Se corta y handle_client limpia al ver el EOF
+            log.debug("Escritor de salida terminado: %s", e)
+            self.abort()
+
+    def abort(self):
+        """Corta la conexión; el lector del cliente verá EOF y limpiará."""
+        self.closed = True
+        self._buf.clear()
+        transport = self.writer.transport
+        if transport is not None and not transport.is_closing():
+            transport.abort()
+
+    def finish(self, data: bytes | None = None):
+        """
+        Cierre decidido por el servidor: descarta lo pendiente, escribe `data`
+        (el motivo) y cierra el transporte. Si el transporte todavía tiene bytes
+        sin enviar se aborta: close() esperaría a vaciarlo, y un par que no lee
+        o que ya no existe nunca lo vacía.
+        """
+        self.closed = True
+        self._buf.clear()
+        transport = self.writer.transport
+        if transport is None or transport.is_closing():
+            return
+        if data is None or transport.get_write_buffer_size():
+            transport.abort()
+            return
+        transport.write(data)
+        transport.close()
+
+    async def close(self):
+        """Detiene la tarea escritora (los pendientes se descartan)."""
+        self.closed = True
+        self._buf.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def depth(self) -> int:
+        """Tramas (y descargas) todavía en la cola."""
+        return len(self._buf)
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._buf),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.dropped,
+        }
@@ -2,41 +2,246 @@
 """
 Define el protocolo de comunicación basado en JSON.
 Incluye funciones para serializar y deserializar mensajes.
+
+Hay dos formas de enmarcar los mensajes en el stream TCP:
+- Líneas JSON terminadas en MESSAGE_DELIMITER (por defecto, compatible con
+  todos los clientes).
+- Binario con prefijo de longitud: 4 bytes big-endian + cuerpo serializado con
+  un códec compacto (msgpack, si está instalado) o JSON. Se negocia al
+  conectar con la acción 'hello' y no requiere escanear cada byte buscando
+  el delimitador (el contenido puede incluir saltos de línea).
 """
 
 import json
 import logging
-from .config import MESSAGE_DELIMITER
+import asyncio
+import time
+from collections import OrderedDict
+from .config import MESSAGE_DELIMITER, MAX_FRAME_SIZE, ENCODE_CACHE_SIZE
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional
+    msgpack = None
+
+FRAME_HEADER_SIZE = 4
+
+
+class ProtocolError(Exception):
+    """Trama inválida: el stream ya no es confiable y hay que cerrar la conexión."""
+
+
+class Codec:
+    """Serializador del cuerpo de los mensajes (dict <-> bytes)."""
+
+    def __init__(self, name, dumps, loads, errors):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.errors = errors
+
+
+def _json_dumps(message: dict) -> bytes:
+    return json.dumps(message).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> dict:
+    return json.loads(data.decode('utf-8'))
+
+
+JSON_CODEC = Codec('json', _json_dumps, _json_loads, (json.JSONDecodeError, UnicodeDecodeError))
+
+CODECS = {'json': JSON_CODEC}
+if msgpack is not None:
+    CODECS['msgpack'] = Codec(
+        'msgpack', msgpack.packb, lambda data: msgpack.unpackb(data, raw=False),
+        (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError)
+    )
+
+
+class Framing:
+    """Combinación de enmarcado (líneas o binario) y códec."""
+
+    def __init__(self, codec: Codec, binary: bool):
+        self.codec = codec
+        self.binary = binary
+        self.name = f"{'binary' if binary else 'line'}/{codec.name}"
+
+    def encode(self, message: dict) -> bytes:
+        """Serializa un dict y lo enmarca, listo para enviar por el socket."""
+        try:
+            body = self.codec.dumps(message)
+        except (TypeError, ValueError) as e:
+            logging.error("Error al serializar el mensaje: %s - Data: %s", e, message)
+            return b''
+        if self.binary:
+            return len(body).to_bytes(FRAME_HEADER_SIZE, 'big') + body
+        # Añadimos el delimitador para que el servidor sepa dónde termina el mensaje
+        return body + MESSAGE_DELIMITER
+
+    def create_message(self, action: str, **kwargs) -> bytes:
+        message = {"action": action}
+        message.update(kwargs)
+        return self.encode(message)
+
+    def parse_message(self, data_bytes: bytes) -> dict | None:
+        """Deserializa el cuerpo de una trama (sin prefijo ni delimitador)."""
+        try:
+            if not self.binary:
+                data_bytes = data_bytes.strip()
+            if not data_bytes:
+                return None
+            message = self.codec.loads(data_bytes)
+        except self.codec.errors:
+            logging.warning("Mensaje mal formado recibido (%s): %r", self.name, data_bytes[:200])
+            return None
+        return message if isinstance(message, dict) else None
+
+    async def read(self, reader: asyncio.StreamReader) -> dict | None:
+        """
+        Lee una trama completa del stream.
+        Lanza IncompleteReadError al cerrarse la conexión y ProtocolError si
+        la trama anuncia un tamaño mayor a MAX_FRAME_SIZE (o, en líneas, si la
+        línea supera el límite del StreamReader).
+        """
+        if not self.binary:
+            try:
+                return self.parse_message(await reader.readuntil(MESSAGE_DELIMITER))
+            except asyncio.LimitOverrunError as e:
+                raise ProtocolError(f"Línea de más de {e.consumed} bytes sin delimitador") from None
+        header = await reader.readexactly(FRAME_HEADER_SIZE)
+        size = int.from_bytes(header, 'big')
+        if size > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Trama de {size} bytes supera el máximo ({MAX_FRAME_SIZE})")
+        return self.parse_message(await reader.readexactly(size))
+
+
+# Enmarcado por defecto: líneas JSON (lo que hablan los clientes viejos)
+LINE_FRAMING = Framing(JSON_CODEC, binary=False)
+
+
+class Encoded:
+    """
+    Un mensaje que va a muchos destinatarios: se serializa una sola vez por
+    enmarcado y todos comparten el mismo objeto bytes (inmutable).
+    """
+
+    __slots__ = ("message", "key", "_cache", "_by_framing", "encode_ns")
+
+    def __init__(self, message: dict, key, cache: "EncodeCache"):
+        self.message = message
+        self.key = key
+        self._cache = cache
+        self._by_framing = {}
+        self.encode_ns = 0
+
+    def for_framing(self, framing: Framing) -> bytes:
+        data = self._by_framing.get(framing.name)
+        if data is None:
+            data = self._by_framing[framing.name] = self._cache._encode(self, framing)
+        return data
+
+
+class EncodeCache:
+    """
+    Serialización compartida para el broadcast.
+    - prepare(): un Encoded por mensaje (un encode por enmarcado en uso).
+    - Mensajes con `key` (plantillas del sistema, p. ej. "X ha entrado a la
+      sala") se guardan además en una caché LRU acotada entre broadcasts.
+    Acumula el tiempo de serialización para compararlo con la latencia total
+    de cada mensaje de chat (ver record_message / stats).
+    """
+
+    def __init__(self, max_entries: int = ENCODE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._templates: OrderedDict = OrderedDict()
+        self.encodes = 0
+        self.encode_ns = 0
+        self.template_hits = 0
+        self.messages = 0
+        self.message_ns = 0
+        self.message_encode_ns = 0
+
+    def prepare(self, message: dict, key=None) -> Encoded:
+        return Encoded(message, key, self)
+
+    def _encode(self, encoded: Encoded, framing: Framing) -> bytes:
+        if encoded.key is not None:
+            cache_key = (framing.name, encoded.key)
+            data = self._templates.get(cache_key)
+            if data is not None:
+                self.template_hits += 1
+                self._templates.move_to_end(cache_key)
+                return data
+
+        start = time.perf_counter_ns()
+        data = framing.encode(encoded.message)
+        elapsed = time.perf_counter_ns() - start
+        encoded.encode_ns += elapsed
+        self.encodes += 1
+        self.encode_ns += elapsed
+
+        if encoded.key is not None:
+            self._templates[cache_key] = data
+            if len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+        return data
+
+    def record_message(self, total_ns: int, encode_ns: int):
+        """Registra la latencia de un mensaje de chat y cuánto fue serialización."""
+        self.messages += 1
+        self.message_ns += total_ns
+        self.message_encode_ns += encode_ns
+
+    def stats(self) -> dict:
+        return {
+            "encodes": self.encodes,
+            "encode_us_total": self.encode_ns // 1000,
+            "template_hits": self.template_hits,
+            "templates_cached": len(self._templates),
+            "messages": self.messages,
+            "avg_message_us": round(self.message_ns / self.messages / 1000, 2) if self.messages else 0.0,
+            "encode_share": round(self.message_encode_ns / self.message_ns, 4) if self.message_ns else 0.0,
+        }
+
+
+def best_codec() -> str:
+    """Códec más compacto disponible en este proceso."""
+    return 'msgpack' if 'msgpack' in CODECS else 'json'
+
+
+def negotiate(framing: str | None, codec: str | None) -> Framing:
+    """
+    Elige el enmarcado para una conexión a partir del pedido 'hello'.
+    Si el códec pedido no está disponible (o no es un nombre) se cae a JSON.
+    """
+    chosen = CODECS.get(codec, JSON_CODEC) if isinstance(codec, str) else JSON_CODEC
+    return Framing(chosen, binary=(framing == 'binary'))
+
 
 def create_message(action: str, **kwargs) -> bytes:
     """
     Crea un mensaje JSON serializado y listo para enviar por el socket.
     Añade un delimitador de nueva línea.
     """
-    message = {"action": action}
-    message.update(kwargs)
-    try:
-        json_message = json.dumps(message)
-        # Añadimos el delimitador para que el servidor sepa dónde termina el mensaje
-        return json_message.encode('utf-8') + MESSAGE_DELIMITER
-    except TypeError as e:
-        logging.error(f"Error al serializar el mensaje: {e} - Data: {message}")
-        return b''
+    return LINE_FRAMING.create_message(action, **kwargs)
 
 def parse_message(data_bytes: bytes) -> dict | None:
     """
     Parsea un mensaje JSON (bytes) recibido del socket.
     Espera que el delimitador ya haya sido manejado por el reader.
     """
-    try:
-        # Quitamos el delimitador y decodificamos
-        data_str = data_bytes.strip().decode('utf-8')
-        if not data_str:
-            return None
-        return json.loads(data_str)
-    except json.JSONDecodeError:
-        logging.warning(f"Mensaje JSON mal formado recibido: {data_bytes}")
-        return None
-    except UnicodeDecodeError:
-        logging.warning(f"Error de decodificación de mensaje: {data_bytes}")
-        return None
\ No newline at end of file
+    return LINE_FRAMING.parse_message(data_bytes)
+
+def create_history_request(before: int | None = None, after: int | None = None,
+                           limit: int | None = None, framing: Framing = LINE_FRAMING) -> bytes:
+    """
+    Crea un pedido 'get_history' para la sala actual.
+    Los cursores son ids de mensaje: 'before' pagina hacia atrás y 'after'
+    hacia adelante. Los campos en None no se envían.
+    El servidor responde con 'history_page':
+        {"messages": [...], "has_more": bool, "before": id | None, "after": id | None}
+    donde 'before'/'after' son los cursores para pedir la página siguiente.
+    """
+    cursors = {"before": before, "after": after, "limit": limit}
+    return framing.create_message("get_history", **{k: v for k, v in cursors.items() if v is not None})
@@ -0,0 +1,247 @@
+# src/pubsub.py
+"""
+Pub/sub de salas: el servidor publica cada evento de sala y recibe los que
+publican otros procesos o nodos para entregarlos a sus conexiones locales.
+
+Backends:
+- LocalPubSub: dentro del proceso (comportamiento de un servidor único).
+- UnixPubSub: bus local del supervisor por socket Unix (modo --workers).
+- RedisPubSub: canales de Redis (o cualquier servidor que hable el protocolo
+  RESP, como resp_standin.py) para compartir salas entre varios nodos.
+
+Un evento es un dict {"room", "msg", "key"} (broadcast) o {"room", "record"}
+(mensaje ya persistido, con su id, para las cachés de historial); el backend
+agrega "origin" para que un nodo no procese sus propios eventos.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from .config import PUBSUB_BACKEND, PUBSUB_REDIS_URL, PUBSUB_CHANNEL_PREFIX, PUBSUB_RETRY_DELAY, BUS_SOCKET_PATH
+from .bus import BusClient
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Dependencia opcional
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+
+class PubSub:
+    """
+    Interfaz común. `on_event(event)` se llama en el loop del servidor por
+    cada evento remoto de una sala suscripta. subscribe/unsubscribe/publish
+    no bloquean: el trabajo de red (si hay) lo hace el backend en segundo plano.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.on_event = None
+        self.rooms: set = set()
+        self.published = 0
+        self.received = 0
+
+    async def start(self, on_event):
+        self.on_event = on_event
+
+    def subscribe(self, room_id):
+        self.rooms.add(room_id)
+
+    def unsubscribe(self, room_id):
+        self.rooms.discard(room_id)
+
+    def publish(self, room_id, event: dict):
+        raise NotImplementedError
+
+    def _deliver(self, event: dict):
+        """Entrega un evento recibido si es de otro nodo y de una sala suscripta."""
+        if event.get("origin") == self.node_id or event.get("room") not in self.rooms:
+            return
+        self.received += 1
+        try:
+            self.on_event(event)
+        except Exception as e:
+            log.error("Error procesando evento de pub/sub: %s", e)
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "rooms": len(self.rooms),
+                "published": self.published, "received": self.received}
+
+
+# Suscriptores LocalPubSub del proceso (varios Server en un mismo loop, p. ej. en pruebas)
+_local_hub: set = set()
+
+
+class LocalPubSub(PubSub):
+    """Sin red: sólo reparte entre instancias del mismo proceso."""
+
+    async def start(self, on_event):
+        await super().start(on_event)
+        _local_hub.add(self)
+
+    def publish(self, room_id, event: dict):
+        self.published += 1
+        if len(_local_hub) < 2:
+            return  # Servidor único: la entrega local ya la hizo _fanout
+        event = {**event, "origin": self.node_id}
+        for peer in list(_local_hub):
+            if peer is not self:
+                peer._deliver(event)
+
+    async def close(self):
+        _local_hub.discard(self)
+
+
+class UnixPubSub(PubSub):
+    """Bus del supervisor: el broker reenvía todo y cada worker filtra por sala."""
+
+    def __init__(self, path: str = BUS_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self._client: BusClient | None = None
+
+    async def start(self, on_event, attempts=50):
+        await super().start(on_event)
+        self._client = BusClient(self._deliver, self.path)
+        for _ in range(attempts):
+            try:
+                await self._client.connect()
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                # El supervisor todavía no levantó el broker
+                await asyncio.sleep(0.1)
+        raise ConnectionError(f"No se pudo conectar al bus en {self.path}")
+
+    def publish(self, room_id, event: dict):
+        self.published += 1
+        self._client.publish({**event, "origin": self.node_id})
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+
+class RedisPubSub(PubSub):
+    """
+    Un canal por sala (PUBSUB_CHANNEL_PREFIX + id). Sólo se suscribe a las
+    salas con miembros locales. Los publish se encolan y una única tarea los
+    envía en pipeline, preservando el orden.
+
+    `rooms` es el estado deseado y `_subscribed` el confirmado por Redis: la
+    misma tarea los concilia, y si falla reintenta, así una sala no se queda
+    sin recibir los broadcasts remotos.
+    """
+
+    def __init__(self, url: str = PUBSUB_REDIS_URL, prefix: str = PUBSUB_CHANNEL_PREFIX):
+        if aioredis is None:
+            raise RuntimeError("El backend 'redis' requiere el paquete redis (pip install redis)")
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+        self._pubsub = None
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        self._subscribed: set = set()
+        self._tasks: list[asyncio.Task] = []
+
+    def _channel(self, room_id) -> str:
+        return f"{self.prefix}{room_id}"
+
+    async def start(self, on_event):
+        await super().start(on_event)
+        self._redis = aioredis.from_url(self.url)
+        await self._redis.ping()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._tasks = [asyncio.create_task(self._publisher()), asyncio.create_task(self._listener())]
+        log.info("Pub/sub Redis conectado a %s", self.url)
+
+    def subscribe(self, room_id):
+        if room_id not in self.rooms:
+            super().subscribe(room_id)
+            self._outgoing.put_nowait(("sync",))
+
+    def unsubscribe(self, room_id):
+        if room_id in self.rooms:
+            super().unsubscribe(room_id)
+            self._outgoing.put_nowait(("sync",))
+
+    def publish(self, room_id, event: dict):
+        self.published += 1
+        payload = json.dumps({**event, "origin": self.node_id})
+        self._outgoing.put_nowait(("publish", room_id, payload))
+
+    async def _publisher(self):
+        while True:
+            ops = [await self._outgoing.get()]
+            while not self._outgoing.empty():
+                ops.append(self._outgoing.get_nowait())
+            if any(op[0] == "sync" for op in ops):
+                await self._sync_subscriptions()
+            publishes = [op for op in ops if op[0] == "publish"]
+            if not publishes:
+                continue
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for _, room_id, payload in publishes:
+                    pipe.publish(self._channel(room_id), payload)
+                await pipe.execute()
+            except Exception as e:
+                log.error("Error publicando en Redis: %s", e)
+
+    async def _sync_subscriptions(self):
+        """Lleva las suscripciones de Redis a `rooms`; si algo falla, reintenta más tarde."""
+        try:
+            for room_id in self.rooms - self._subscribed:
+                await self._pubsub.subscribe(self._channel(room_id))
+                self._subscribed.add(room_id)
+            for room_id in self._subscribed - self.rooms:
+                await self._pubsub.unsubscribe(self._channel(room_id))
+                self._subscribed.discard(room_id)
+        except Exception as e:
+            log.error("Error actualizando suscripciones en Redis: %s", e)
+            asyncio.get_running_loop().call_later(PUBSUB_RETRY_DELAY, self._outgoing.put_nowait, ("sync",))
+
+    async def _listener(self):
+        while True:
+            if not self._pubsub.subscribed:
+                # Sin salas con miembros locales no hay conexión de suscripción
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                log.error("Error leyendo de Redis: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            try:
+                event = json.loads(message["data"])
+            except (ValueError, TypeError):
+                continue
+            self._deliver(event)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+
+def create(backend: str = PUBSUB_BACKEND, **kwargs) -> PubSub:
+    """Construye el backend configurado."""
+    if backend == 'local':
+        return LocalPubSub()
+    if backend == 'unix':
+        return UnixPubSub(**kwargs)
+    if backend == 'redis':
+        return RedisPubSub(**kwargs)
+    raise ValueError(f"Backend de pub/sub desconocido: {backend}")
@@ -0,0 +1,111 @@
+# src/ratelimit.py
+"""
+Límites de tasa por token bucket para el despacho de acciones (ver
+Server.handle_client).
+
+- Por usuario y acción, con límites según el rol ('profesor' / 'alumno').
+  Los buckets viven en el limitador, por id de usuario: todas las conexiones
+  del mismo usuario a este proceso comparten el presupuesto, y reconectarse
+  no lo renueva. Se descartan recién cuando se recargaron por completo (un
+  bucket lleno equivale a uno nuevo). Antes del login se usan los de la
+  conexión (rol None).
+- Por sala y acción (agregado de todos sus miembros locales): acota el
+  fan-out y las escrituras que puede generar una sala entera.
+
+Los buckets se crean con la primera acción limitada: una conexión ociosa no
+ocupa memoria de más. Todo es local al proceso; con --workers N cada worker
+aplica sus propios límites.
+"""
+
+from .config import RATE_LIMIT_ENABLED, RATE_LIMITS, ROOM_RATE_LIMITS
+
+
+class TokenBucket:
+    """`rate` tokens por segundo hasta un máximo de `burst`; cada acción consume uno."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> bool:
+        # Recarga perezosa: se calcula lo acumulado desde la última consulta
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.stamp = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return True
+        self.tokens = tokens
+        return False
+
+    def refilled(self, now: float) -> bool:
+        """True si ya recuperó la ráfaga completa (descartarlo no regala tokens)."""
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class RateLimiter:
+    def __init__(self, limits: dict = RATE_LIMITS, room_limits: dict = ROOM_RATE_LIMITS,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        # rol -> {acción: (tasa, ráfaga)}; deshabilitado equivale a tablas vacías
+        self.limits = limits if enabled else {}
+        self.room_limits = room_limits if enabled else {}
+        # user_id -> {acción: TokenBucket}
+        self.users: dict[int, dict] = {}
+        # room_id -> {acción: TokenBucket}
+        self.rooms: dict[int, dict] = {}
+
+    def allow(self, session, action: str, now: float) -> bool:
+        """
+        Sin login: consume un token de `action` en los buckets de la conexión.
+        True si la acción puede atenderse.
+        """
+        buckets = session.buckets
+        bucket = buckets.get(action) if buckets is not None else None
+        if bucket is None:
+            spec = self.limits.get(None, {}).get(action)
+            if spec is None:
+                return True
+            if buckets is None:
+                buckets = session.buckets = {}
+            bucket = buckets[action] = TokenBucket(*spec, now)
+        return bucket.take(now)
+
+    def allow_user(self, user_id: int, role: str, action: str, now: float) -> bool:
+        """Consume un token de `action` en los buckets del usuario."""
+        buckets = self.users.get(user_id)
+        bucket = buckets.get(action) if buckets is not None else None
+        if bucket is None:
+            spec = self.limits.get(role, {}).get(action)
+            if spec is None:
+                return True
+            if buckets is None:
+                buckets = self.users[user_id] = {}
+            bucket = buckets[action] = TokenBucket(*spec, now)
+        return bucket.take(now)
+
+    def expire(self, now: float):
+        """Descarta los buckets de usuarios que ya se recargaron por completo."""
+        for user_id, buckets in list(self.users.items()):
+            if all(bucket.refilled(now) for bucket in buckets.values()):
+                del self.users[user_id]
+
+    def allow_room(self, room_id: int, action: str, now: float) -> bool:
+        """Consume un token del límite agregado de la sala."""
+        spec = self.room_limits.get(action)
+        if spec is None:
+            return True
+        buckets = self.rooms.get(room_id)
+        if buckets is None:
+            buckets = self.rooms[room_id] = {}
+        bucket = buckets.get(action)
+        if bucket is None:
+            bucket = buckets[action] = TokenBucket(*spec, now)
+        return bucket.take(now)
+
+    def forget_room(self, room_id: int):
+        """La sala quedó sin miembros locales: se descartan sus buckets."""
+        self.rooms.pop(room_id, None)
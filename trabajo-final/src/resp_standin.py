@@ -0,0 +1,104 @@
+# src/resp_standin.py
+"""
+Sustituto local de Redis para desarrollo y pruebas del backend 'redis' de
+pub/sub. Implementa sólo lo necesario del protocolo RESP2:
+PING, SUBSCRIBE, UNSUBSCRIBE y PUBLISH (cualquier otro comando responde +OK).
+
+Uso (desde trabajo-final/):
+    python -m src.resp_standin [--port 6379]
+"""
+
+import argparse
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def _bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(*items: bytes) -> bytes:
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def _int(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+async def _read_command(reader: asyncio.StreamReader) -> list[bytes]:
+    line = await reader.readuntil(b"\r\n")
+    if not line.startswith(b"*"):
+        # Comando inline (p. ej. "PING\r\n" desde telnet)
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readuntil(b"\r\n")
+        size = int(header[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+class RespStandIn:
+    def __init__(self):
+        # channels[nombre] = {writer, ...}
+        self.channels: dict[bytes, set] = {}
+
+    async def handle(self, reader, writer):
+        subscribed: set[bytes] = set()
+        try:
+            while True:
+                args = await _read_command(reader)
+                if not args:
+                    continue
+                command = args[0].upper()
+
+                if command == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif command == b"SUBSCRIBE":
+                    for channel in args[1:]:
+                        subscribed.add(channel)
+                        self.channels.setdefault(channel, set()).add(writer)
+                        writer.write(_array(_bulk(b"subscribe"), _bulk(channel), _int(len(subscribed))))
+                elif command == b"UNSUBSCRIBE":
+                    for channel in args[1:] or list(subscribed):
+                        subscribed.discard(channel)
+                        self.channels.get(channel, set()).discard(writer)
+                        writer.write(_array(_bulk(b"unsubscribe"), _bulk(channel), _int(len(subscribed))))
+                elif command == b"PUBLISH":
+                    channel, payload = args[1], args[2]
+                    targets = self.channels.get(channel, ())
+                    frame = _array(_bulk(b"message"), _bulk(channel), _bulk(payload))
+                    for target in targets:
+                        target.write(frame)
+                    writer.write(_int(len(targets)))
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+
+async def serve(host: str, port: int):
+    standin = RespStandIn()
+    server = await asyncio.start_server(standin.handle, host, port)
+    log.info(f"Sustituto RESP escuchando en {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Sustituto local de Redis (pub/sub)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
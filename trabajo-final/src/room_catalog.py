@@ -0,0 +1,102 @@
+# src/room_catalog.py
+"""
+Catálogo de salas en memoria.
+Se carga de la BD al arrancar y se vuelve a cargar sólo cuando una sala se
+crea o se borra (en este proceso o, vía pub/sub, en otro worker/nodo).
+`get_rooms` se responde con bytes ya serializados por enmarcado y `join`
+valida el id y obtiene el nombre real sin tocar la BD.
+
+La respuesta incluye la cantidad de miembros conectados a cada sala en
+este proceso. Entrar o salir de una sala no descarta el payload: sólo lo
+marca desactualizado, y se re-serializa como mucho una vez cada
+ROOM_CATALOG_MEMBERS_REFRESH segundos (las cantidades pueden llegar con ese
+atraso).
+"""
+
+import asyncio
+import logging
+import time
+from .config import ROOM_CATALOG_MEMBERS_REFRESH
+from . import db_manager
+from .protocol import Framing
+
+log = logging.getLogger(__name__)
+
+# Canal de pub/sub por el que viajan los cambios del catálogo
+CATALOG_CHANNEL = "catalog"
+
+
+class RoomCatalog:
+    def __init__(self, member_count, members_refresh=ROOM_CATALOG_MEMBERS_REFRESH):
+        # member_count(room_id) -> int: miembros locales (índice de salas del servidor)
+        self.member_count = member_count
+        self.members_refresh = members_refresh
+        self._rooms: dict[int, str] | None = None
+        self._encoded: dict[str, bytes] = {}
+        # Momento en que se serializó el payload vigente y si cambiaron miembros desde entonces
+        self._encoded_at = 0.0
+        self._members_stale = False
+        self._lock = asyncio.Lock()
+        self._generation = 0
+        self.loads = 0
+        self.hits = 0
+
+    async def load(self):
+        generation = self._generation
+        rows = await db_manager.get_rooms()
+        self.loads += 1
+        # Si se invalidó durante la consulta, lo leído puede estar viejo
+        if generation == self._generation:
+            self._rooms = {row["id"]: row["nombre"] for row in rows}
+            self._encoded.clear()
+
+    async def _ensure(self) -> dict[int, str]:
+        while self._rooms is None:
+            async with self._lock:
+                # Otro pedido pudo haberlo cargado mientras esperábamos el lock
+                if self._rooms is None:
+                    await self.load()
+        return self._rooms
+
+    def invalidate(self):
+        """Una sala se creó o se borró: recargar en el próximo acceso."""
+        self._generation += 1
+        self._rooms = None
+        self._encoded.clear()
+
+    def membership_changed(self):
+        """Cambió la cantidad de miembros de alguna sala: re-serializar cuando toque."""
+        self._members_stale = True
+
+    async def name(self, room_id: int) -> str | None:
+        """Nombre de la sala, o None si no existe."""
+        return (await self._ensure()).get(room_id)
+
+    async def room_list(self) -> list[dict]:
+        """Contenido de 'room_list': salas con sus miembros locales."""
+        rooms = await self._ensure()
+        return [
+            {"id": room_id, "nombre": name, "miembros": self.member_count(room_id)}
+            for room_id, name in rooms.items()
+        ]
+
+    async def encoded_list(self, framing: Framing) -> bytes:
+        """Mensaje 'room_list' serializado para el enmarcado del cliente."""
+        await self._ensure()
+        now = time.monotonic()
+        if self._members_stale and now - self._encoded_at >= self.members_refresh:
+            self._encoded.clear()
+        data = self._encoded.get(framing.name)
+        if data is not None:
+            self.hits += 1
+            return data
+        if not self._encoded:
+            # Payload nuevo: toma las cantidades de miembros actuales
+            self._encoded_at = now
+            self._members_stale = False
+        data = framing.create_message("room_list", rooms=await self.room_list())
+        self._encoded[framing.name] = data
+        return data
+
+    def stats(self) -> dict:
+        return {"rooms": len(self._rooms or ()), "loads": self.loads, "hits": self.hits}
@@ -0,0 +1,92 @@
+# src/security.py
+"""
+Utilidades de seguridad: hash de contraseñas y tokens de sesión.
+- Contraseñas: scrypt (hashlib) con sal aleatoria, formato autodescriptivo
+  'scrypt$N$r$p$sal$hash' para poder cambiar los parámetros sin migrar.
+- Sesiones: tokens firmados con HMAC-SHA256; verificarlos es barato y no
+  requiere estado compartido ni pasar por el proceso de autenticación.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from .config import SCRYPT_N, SCRYPT_R, SCRYPT_P, SESSION_SECRET, SESSION_TTL
+
+HASH_PREFIX = 'scrypt$'
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+
+def hash_password(password: str) -> str:
+    """Calcula el hash scrypt de una contraseña (operación costosa)."""
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_PREFIX}{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(HASH_PREFIX)
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """Compara una contraseña contra su hash almacenado (tiempo constante)."""
+    try:
+        _, n, r, p, salt, digest = stored.split('$')
+        candidate = _scrypt(password, _unb64(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(candidate, _unb64(digest))
+
+
+# Hash de referencia para usuarios inexistentes: así un login con usuario
+# desconocido tarda lo mismo que uno con contraseña incorrecta.
+_DUMMY_HASH = None
+
+
+def dummy_verify(password: str):
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password('')
+    verify_password(password, _DUMMY_HASH)
+
+
+# --- TOKENS DE SESIÓN ---
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()
+
+
+def issue_session_token(user_data: dict, ttl: int = SESSION_TTL) -> str:
+    """Emite un token firmado con los datos del usuario y su vencimiento."""
+    payload = json.dumps({"user": user_data, "exp": int(time.time()) + ttl},
+                         separators=(',', ':')).encode('utf-8')
+    return f"{_b64(payload)}.{_b64(_sign(payload))}"
+
+
+def verify_session_token(token: str) -> dict | None:
+    """Devuelve los datos del usuario si el token es auténtico y vigente."""
+    try:
+        payload_b64, signature_b64 = token.split('.')
+        payload = _unb64(payload_b64)
+        if not hmac.compare_digest(_sign(payload), _unb64(signature_b64)):
+            return None
+        data = json.loads(payload)
+    except (ValueError, AttributeError, TypeError):
+        return None
+    if data.get("exp", 0) < time.time():
+        return None
+    return data.get("user")
@@ -5,218 +5,909 @@ Etapa 3.5: Soporte para Salas de Chat, Persistencia y Navegación (Salir de sala
 """
 
 import asyncio
+import base64
+import binascii
+import contextvars
 import logging
-import multiprocessing
-from .config import HOST, PORT, MESSAGE_DELIMITER
+import os
+import time
+from .config import (
+    HOST, PORT, HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX, AUTH_WORKERS, PUBSUB_BACKEND, NET_PROFILE,
+    METRICS_HOST, METRICS_PORT, METRICS_LOOP_LAG_INTERVAL,
+    STORAGE_DIR, UPLOAD_CHUNK_SIZE, LINE_UPLOAD_CHUNK_SIZE, UPLOAD_MAX_SIZE, FILE_LIST_LIMIT,
+    SEARCH_CONNECTIONS, SEARCH_PAGE_SIZE, SEARCH_PAGE_MAX, SEARCH_MAX_OFFSET, SEARCH_QUERY_MAX,
+    MAX_CONNECTIONS, MAX_CONNECTIONS_PER_IP, LOGIN_TIMEOUT, LOBBY_IDLE_TIMEOUT, ROOM_IDLE_TIMEOUT,
+    HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, REAPER_INTERVAL, RATE_LIMIT_REPLY, MSG_MAX_LENGTH
+)
 from . import protocol
 from . import db_manager
 from . import auth_process
+from . import security
+from .write_behind import MessageWriter
+from .outbound import OutboundQueue, FileTransfer
+from .storage_process import StorageClient, StorageError, is_sha256
+from .history_cache import HistoryCache
+from .session import Session, State, UserRegistry
+from .ratelimit import RateLimiter
+from .room_catalog import RoomCatalog, CATALOG_CHANNEL
+from . import pubsub
+from . import netprofile
+from . import metrics
+from .logsetup import setup_logging
 
-logging.basicConfig(level=logging.INFO, format='[SERVER] %(asctime)s - %(message)s')
 log = logging.getLogger(__name__)
 
+# Métricas del camino caliente (objetos nulos si METRICS_ENABLED es False)
+ACTION_SECONDS = metrics.histogram(
+    "scee_action_seconds", "Tiempo de atención de cada acción del protocolo", labelnames=("action",)
+)
+# Sólo acciones conocidas: un cliente no puede inflar la cardinalidad de etiquetas
+ACTION_TIMERS = {
+    action: ACTION_SECONDS.labels(action)
+    for action in ("hello", "login", "resume", "get_rooms", "join", "message", "leave_room", "get_history",
+                   "create_room", "delete_room", "upload_begin", "upload_chunk", "upload_end",
+                   "list_files", "download", "search")
+}
+# Largo máximo del nombre de una sala
+ROOM_NAME_MAX = 64
+FANOUT_SIZE = metrics.histogram(
+    "scee_broadcast_fanout_size", "Destinatarios locales por broadcast", buckets=metrics.SIZE_BUCKETS
+)
+FANOUT_SECONDS = metrics.histogram("scee_broadcast_fanout_seconds", "Tiempo de encolar un broadcast")
+CONNECTIONS_REJECTED = metrics.counter(
+    "scee_connections_rejected_total", "Conexiones rechazadas por los límites", labelnames=("reason",)
+)
+IDLE_REAPED = metrics.counter(
+    "scee_idle_reaped_total", "Conexiones cerradas (o devueltas al lobby) por plazos vencidos",
+    labelnames=("reason",)
+)
+RATE_LIMITED = metrics.counter(
+    "scee_rate_limited_total", "Acciones rechazadas por límite de tasa", labelnames=("action", "scope")
+)
+# Pedido en curso de la tarea de cada conexión: (session, req). Las respuestas
+# directas a ese pedido repiten su "req" (ver Server.reply); lo que se envía a
+# otras sesiones desde la misma tarea (p. ej. 'room_closed') no lo lleva.
+_REQUEST = contextvars.ContextVar("scee_request", default=None)
+# Rechazos serializados una sola vez: la conexión nueva todavía habla líneas JSON
+REJECT_FRAMES = {
+    "max_connections": protocol.create_message("error", message="Servidor lleno, intenta más tarde."),
+    "max_per_ip": protocol.create_message("error", message="Demasiadas conexiones desde tu dirección."),
+}
+
 class Server:
-    def __init__(self, host, port):
+    def __init__(self, host, port, reuse_port=False, pubsub_backend=PUBSUB_BACKEND, init_db=True,
+                 auth_workers=AUTH_WORKERS, net_profile=NET_PROFILE, metrics_port=METRICS_PORT):
         self.host = host
         self.port = port
-        # self.clients[writer] = {"addr":..., "state":..., "user":..., "room_id": None}
-        self.clients = {}
-        
-        # IPC Autenticación
-        log.info("Iniciando proceso de autenticación...")
-        self.auth_pipe_parent, auth_pipe_child = multiprocessing.Pipe()
-        self.auth_proc = multiprocessing.Process(
-            target=auth_process.auth_process_worker,
-            args=(auth_pipe_child,)
-        )
-        self.auth_proc.start()
-
-    async def authenticate(self, writer, login_message):
+        self.metrics_port = metrics_port
+        # Opciones de socket (backlog, TCP_NODELAY, buffers, keepalive)
+        self.net_profile = netprofile.get_profile(net_profile)
+        # Modo multiproceso: varios workers escuchan en el mismo puerto (ver supervisor.py)
+        self.reuse_port = reuse_port
+        # Pub/sub de salas: los eventos cruzan a otros workers/nodos con miembros en la sala
+        self.pubsub = pubsub.create(pubsub_backend)
+        self.init_db = init_db
+        # Una Session por conexión abierta (ver session.py)
+        self.sessions = set()
+        # Un User compartido por todas las sesiones del mismo usuario
+        self.users = UserRegistry()
+        # Conexiones abiertas por IP (límite MAX_CONNECTIONS_PER_IP)
+        self.ip_connections = {}
+        # Índice de membresía: self.rooms[room_id] = {session, ...}
+        # Lo mantienen join_room, leave_room y la limpieza de handle_client.
+        self.rooms = {}
+        # Persistencia write-behind de los mensajes de chat
+        self.message_writer = MessageWriter(on_flushed=self._publish_record)
+        # Historial reciente por sala en memoria; antes de precargar una sala
+        # se espera a que la cola write-behind esté en disco.
+        self.history = HistoryCache(before_load=self.message_writer.sync)
+        # Serialización compartida del broadcast (+ caché de mensajes del sistema)
+        self.encoder = protocol.EncodeCache()
+        # Catálogo de salas en memoria (get_rooms y validación de join sin BD)
+        self.catalog = RoomCatalog(self.room_member_count)
+
+        # IPC Autenticación (pool de procesos)
+        log.info("Iniciando procesos de autenticación...")
+        self.auth_pool = auth_process.AuthPool(workers=auth_workers)
+        # IPC Almacenamiento (subidas de archivos)
+        self.storage = StorageClient()
+
+        # Despacho de handle_client: (estado, acción) -> handler(session, message)
+        handlers = {
+            (State.CONNECTING, "login"): self.authenticate,
+            (State.CONNECTING, "resume"): self.resume_session,
+            (State.CONNECTING, "hello"): self.negotiate,
+
+            # Usuario logueado (en el lobby)
+            (State.AUTHENTICATED, "get_rooms"): self.send_room_list,
+            (State.AUTHENTICATED, "join"): self.join_room,
+            (State.AUTHENTICATED, "create_room"): self.create_room,
+            (State.AUTHENTICATED, "delete_room"): self.delete_room,
+            (State.AUTHENTICATED, "search"): self.search,
+            (State.AUTHENTICATED, "login"): self.ignore,
+
+            # Usuario chateando en sala
+            (State.IN_ROOM, "message"): self.handle_message,
+            (State.IN_ROOM, "leave_room"): self.leave_room,
+            (State.IN_ROOM, "join"): self.join_room,
+            (State.IN_ROOM, "get_rooms"): self.send_room_list,
+            (State.IN_ROOM, "get_history"): self.send_history_page,
+            (State.IN_ROOM, "upload_chunk"): self.upload_chunk,
+            (State.IN_ROOM, "upload_begin"): self.upload_begin,
+            (State.IN_ROOM, "upload_end"): self.upload_end,
+            (State.IN_ROOM, "list_files"): self.send_file_list,
+            (State.IN_ROOM, "download"): self.download,
+            (State.IN_ROOM, "search"): self.search,
+            (State.IN_ROOM, "create_room"): self.create_room,
+            (State.IN_ROOM, "delete_room"): self.delete_room,
+        }
+        # Una tabla por estado (lista indexada por State), con el timer de la
+        # acción ya resuelto: una sola búsqueda de dict por trama
+        self.dispatch = [{} for _ in State]
+        self.limiter = RateLimiter()
+        for (state, action), handler in handlers.items():
+            self.dispatch[state][action] = (handler, ACTION_TIMERS[action])
+
+    def _room_add(self, session, room_id):
+        members = self.rooms.get(room_id)
+        if members is None:
+            # Primer miembro local: empezamos a recibir los eventos remotos de la sala
+            members = self.rooms[room_id] = set()
+            self.pubsub.subscribe(room_id)
+        members.add(session)
+        self.catalog.membership_changed()
+
+    def _room_discard(self, session, room_id):
+        members = self.rooms.get(room_id)
+        if members is None:
+            return
+        members.discard(session)
+        self.catalog.membership_changed()
+        if not members:
+            del self.rooms[room_id]
+            self.pubsub.unsubscribe(room_id)
+            self.limiter.forget_room(room_id)
+
+    def room_member_count(self, room_id) -> int:
+        """Cantidad de conexiones presentes en una sala."""
+        return len(self.rooms.get(room_id, ()))
+
+    def send(self, session, data: bytes):
+        """Encola bytes en la cola de salida del cliente (no bloquea)."""
+        session.outbox.put(data)
+
+    def reply(self, session, action: str, **kwargs):
+        """
+        Serializa un mensaje con el enmarcado del cliente y lo encola.
+        Si es la respuesta a un pedido con "req", lo repite para que el
+        cliente la correlacione (puede tener varios pedidos en vuelo).
+        """
+        req = self._request_id(session)
+        if req is not None:
+            kwargs["req"] = req
+        session.outbox.put(session.framing.create_message(action, **kwargs))
+
+    @staticmethod
+    def _request_id(session):
+        """"req" del pedido que se está atendiendo, si esta respuesta es para su sesión."""
+        current = _REQUEST.get()
+        if current is not None and current[0] is session:
+            return current[1]
+        return None
+
+    async def ignore(self, session, message):
+        """Acción aceptada sin efecto (p. ej. un 'login' repetido en el lobby)."""
+
+    async def negotiate(self, session, message):
+        """
+        Acción 'hello': el cliente pide otro enmarcado/códec antes del login.
+        La respuesta sale todavía en líneas JSON; lo que sigue, en el elegido.
+        """
+        framing = protocol.negotiate(message.get("framing"), message.get("codec"))
+        self.reply(session, "hello_ok", framing="binary" if framing.binary else "line", codec=framing.codec.name)
+        session.framing = framing
+        log.info("Enmarcado %s para %s", framing.name, session.addr, extra={"event": "framing"})
+
+    async def authenticate(self, session, login_message):
         """Maneja el login vía IPC."""
         user = login_message.get("user")
         pwd = login_message.get("password")
         
-        loop = asyncio.get_running_loop()
-        request = {"command": "auth", "user": user, "password": pwd}
-        
         try:
-            await loop.run_in_executor(None, self.auth_pipe_parent.send, request)
-            response = await loop.run_in_executor(None, self.auth_pipe_parent.recv)
+            response = await self.auth_pool.authenticate(user, pwd)
 
             if response.get("status") == "ok":
-                user_data = response.get("user_data", {})
-                log.info(f"Login OK: {user}")
-                # Estado pasa a 'authenticated', pero aún no tiene sala ('room_id': None)
-                self.clients[writer] = {
-                    "addr": writer.get_extra_info('peername'),
-                    "state": "authenticated",
-                    "user": user_data,
-                    "room_id": None
-                }
-                writer.write(protocol.create_message("login_success", user=user_data))
+                log.info("Login OK: %s", user, extra={"event": "auth"})
+                self._login(session, response.get("user_data", {}))
             else:
-                writer.write(protocol.create_message("login_fail", message="Credenciales inválidas"))
-            await writer.drain()
+                self.reply(session, "login_fail", message="Credenciales inválidas")
 
         except Exception as e:
-            log.error(f"Error Auth IPC: {e}")
-            writer.close()
-
-    async def send_room_list(self, writer):
-        """Envía la lista de salas disponibles al cliente."""
-        rooms = await db_manager.get_rooms()
-        writer.write(protocol.create_message("room_list", rooms=rooms))
-        await writer.drain()
+            log.error("Error Auth IPC: %s", e)
+            session.writer.close()
+
+    async def resume_session(self, session, message):
+        """Reanuda una sesión con un token vigente, sin pasar por el KDF."""
+        user_data = security.verify_session_token(message.get("token") or "")
+        if user_data is None:
+            self.reply(session, "login_fail", message="Sesión vencida o inválida")
+            return
+        log.info("Sesión reanudada: %s", user_data.get('username'), extra={"event": "auth"})
+        self._login(session, user_data)
+
+    def _login(self, session, user_data):
+        # Estado pasa a 'authenticated', pero aún no tiene sala (room_id None)
+        session.user = self.users.get(user_data)
+        session.state = State.AUTHENTICATED
+        session.room_id = None
+        token = security.issue_session_token(user_data)
+        self.reply(session, "login_success", user=user_data, token=token)
+
+    async def send_room_list(self, session, message=None):
+        """Envía la lista de salas (ya serializada por el catálogo) al cliente."""
+        if self._request_id(session) is None:
+            self.send(session, await self.catalog.encoded_list(session.framing))
+        else:
+            # Con "req" los bytes compartidos no sirven: se serializa la lista ya armada
+            self.reply(session, "room_list", rooms=await self.catalog.room_list())
+
+    def _is_teacher(self, session) -> bool:
+        if session.user is None or not session.user.is_teacher:
+            self.reply(session, "error", message="Sólo un profesor puede administrar salas.")
+            return False
+        return True
+
+    async def create_room(self, session, message):
+        """Acción 'create_room' (profesores): crea una sala nueva."""
+        if not self._is_teacher(session):
+            return
+        name = str(message.get("name") or "").strip()
+        if not name or len(name) > ROOM_NAME_MAX:
+            self.reply(session, "error", message=f"Nombre de sala inválido (1 a {ROOM_NAME_MAX} caracteres).")
+            return
+        room_id = await db_manager.create_room(name)
+        if room_id is None:
+            self.reply(session, "error", message="Ya existe una sala con ese nombre.")
+            return
+        self._catalog_changed()
+        log.info("Sala %s creada: %s", room_id, name, extra={"event": "room"})
+        self.reply(session, "room_created", room_id=room_id, room_name=name)
 
-    async def join_room(self, writer, message):
+    async def delete_room(self, session, message):
+        """Acción 'delete_room' (profesores): borra la sala y saca a sus miembros."""
+        if not self._is_teacher(session):
+            return
+        try:
+            room_id = int(message.get("room_id"))
+        except (ValueError, TypeError):
+            self.reply(session, "error", message="ID de sala inválido")
+            return
+        if await self.catalog.name(room_id) is None:
+            self.reply(session, "error", message="La sala no existe.")
+            return
+        # Primero se sueltan las referencias a los blobs: si esto falla la sala
+        # sigue existiendo y se puede reintentar sin dejar blobs huérfanos
+        try:
+            await self.storage.purge_room(room_id)
+        except StorageError as e:
+            log.error("No se pudieron borrar los archivos de la sala %s: %s", room_id, e)
+            self.reply(session, "error", message="No se pudieron borrar los archivos de la sala.")
+            return
+        # Lo encolado para esa sala tiene que llegar al disco antes del DELETE
+        await self.message_writer.sync()
+        if not await db_manager.delete_room(room_id):
+            self.reply(session, "error", message="La sala no existe.")
+            return
+        # Una subida terminada entre el purge y el DELETE dejó blobs sin
+        # referencias (delete_room ya las descontó): se borran ahora
+        try:
+            await self.storage.purge_room(room_id)
+        except StorageError as e:
+            log.warning("Blobs de la sala %s quedan para el próximo purge: %s", room_id, e)
+        self._catalog_changed(deleted=room_id)
+        self._close_room(room_id)
+        log.info("Sala %s borrada", room_id, extra={"event": "room"})
+        self.reply(session, "room_deleted", room_id=room_id)
+
+    def _catalog_changed(self, deleted=None):
+        """Invalida el catálogo local y avisa a los demás workers/nodos."""
+        self.catalog.invalidate()
+        self.pubsub.publish(CATALOG_CHANNEL, {"room": CATALOG_CHANNEL, "deleted": deleted})
+
+    def _close_room(self, room_id):
+        """Devuelve al lobby a los miembros locales de una sala borrada."""
+        self.history.invalidate(room_id)
+        for member in list(self.rooms.get(room_id, ())):
+            member.state = State.AUTHENTICATED
+            member.room_id = None
+            self._room_discard(member, room_id)
+            # Aviso, no respuesta: sin "req" aunque el miembro sea quien borró la sala
+            self.send(member, member.framing.create_message("room_closed", room_id=room_id))
+
+    async def join_room(self, session, message):
         """Une al usuario a una sala y envía el historial."""
         room_id = message.get("room_id")
         try:
             room_id = int(room_id)
         except (ValueError, TypeError):
-            writer.write(protocol.create_message("error", message="ID de sala inválido"))
+            self.reply(session, "error", message="ID de sala inválido")
+            return
+
+        room_name = await self.catalog.name(room_id)
+        if room_name is None:
+            self.reply(session, "error", message="La sala no existe.")
             return
 
-        client_state = self.clients[writer]
-        
         # Si ya estaba en una sala, avisar que salió primero (opcional, pero limpio)
-        if client_state.get("room_id"):
-             await self.leave_room(writer, None, notify_client=False)
+        if session.room_id:
+             await self.leave_room(session, None, notify_client=False)
 
-        client_state["room_id"] = room_id
-        client_state["state"] = "in_room"
-        
-        room_name = f"Sala {room_id}" 
+        session.room_id = room_id
+        session.state = State.IN_ROOM
+        self._room_add(session, room_id)
 
-        log.info(f"Usuario {client_state['user']['username']} unido a Sala {room_id}")
+        log.info("Usuario %s unido a Sala %s", session.user.username, room_id, extra={"event": "room"})
         
-        # Obtener historial
-        history = await db_manager.get_chat_history(room_id)
+        # Obtener historial (desde la caché; la BD sólo en el primer acceso)
+        history = await self.history.get(room_id)
         
-        writer.write(protocol.create_message("join_success", room_id=room_id, room_name=room_name, history=history))
-        await writer.drain()
+        self.reply(session, "join_success", room_id=room_id, room_name=room_name, history=history)
 
         # Avisar a otros en la sala
+        username = session.user.username
         await self.broadcast({
             "action": "message", 
-            "content": f"--> {client_state['user']['username']} ha entrado a la sala."
-        }, sender_writer=writer, system_msg=True)
+            "content": f"--> {username} ha entrado a la sala."
+        }, sender=session, system_msg=True, cache_key=("join", username))
+
+    async def send_history_page(self, session, message):
+        """Pagina el historial de la sala actual por keyset (ids de mensaje)."""
+        room_id = session.room_id
+        try:
+            before = message.get("before")
+            after = message.get("after")
+            before = int(before) if before is not None else None
+            after = int(after) if after is not None else None
+            limit = int(message.get("limit") or HISTORY_PAGE_SIZE)
+        except (ValueError, TypeError):
+            self.reply(session, "error", message="Cursor de historial inválido")
+            return
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+
+        if before is None:
+            # Hacia adelante (o la última página) necesita ver lo que sigue en cola
+            await self.message_writer.sync()
+
+        # Pedimos uno de más para saber si quedan mensajes en esa dirección
+        page = await db_manager.get_history_page(room_id, before=before, after=after, limit=limit + 1)
+        has_more = len(page) > limit
+        if has_more:
+            page = page[1:] if after is None else page[:-1]
+
+        self.reply(
+            session, "history_page",
+            room_id=room_id,
+            messages=page,
+            has_more=has_more,
+            before=page[0]["id"] if page else before,
+            after=page[-1]["id"] if page else after,
+        )
+
+    async def search(self, session, message):
+        """
+        Acción 'search': búsqueda de texto completo en los mensajes guardados.
+        Por defecto busca en la sala actual; con "room_id": null busca en todas.
+        Se pagina con "offset" (hasta SEARCH_MAX_OFFSET).
+        """
+        query = message.get("query")
+        user = message.get("user")
+        try:
+            room_id = message.get("room_id", session.room_id)
+            room_id = int(room_id) if room_id is not None else None
+            limit = int(message.get("limit") or SEARCH_PAGE_SIZE)
+            offset = int(message.get("offset") or 0)
+        except (ValueError, TypeError):
+            self.reply(session, "error", message="Parámetros de búsqueda inválidos")
+            return
+        if not isinstance(query, str) or not query.strip() or len(query) > SEARCH_QUERY_MAX or \
+                (user is not None and not isinstance(user, str)):
+            self.reply(session, "error", message=f"Búsqueda inválida (hasta {SEARCH_QUERY_MAX} caracteres).")
+            return
+        limit = max(1, min(limit, SEARCH_PAGE_MAX))
+        offset = max(0, min(offset, SEARCH_MAX_OFFSET))
+
+        # Lo recién enviado todavía puede estar en la cola write-behind
+        await self.message_writer.sync()
+        try:
+            # Uno de más para saber si hay otra página
+            results = await db_manager.search_messages(query, room_id, user, limit=limit + 1, offset=offset)
+        except TimeoutError as e:
+            self.reply(session, "error", message=f"{e}: probá con palabras más específicas.")
+            return
+        has_more = len(results) > limit and offset + limit <= SEARCH_MAX_OFFSET
+        self.reply(
+            session, "search_results",
+            query=query, room_id=room_id, user=user,
+            results=results[:limit],
+            offset=offset,
+            next_offset=offset + limit if has_more else None,
+        )
 
-    async def leave_room(self, writer, message, notify_client=True):
+    async def upload_begin(self, session, message):
+        """Acción 'upload_begin': abre una subida en el proceso de almacenamiento."""
+        name = os.path.basename(str(message.get("name") or "")).strip()
+        try:
+            size = int(message.get("size"))
+        except (ValueError, TypeError):
+            size = -1
+        # Hash opcional del contenido: si ya está guardado no hace falta transferirlo
+        sha256 = message.get("sha256")
+        if not name or len(name) > 255 or not 0 <= size <= UPLOAD_MAX_SIZE or \
+                (sha256 is not None and not is_sha256(sha256)):
+            self.reply(session, "error", message=f"Archivo inválido (hasta {UPLOAD_MAX_SIZE} bytes).")
+            return
+        try:
+            upload_id, record = await self.storage.begin(
+                session.room_id, session.user.id, name, size, sha256
+            )
+        except StorageError as e:
+            self.reply(session, "error", message=str(e))
+            return
+        if record is not None:
+            await self._file_shared(session, None, record, skipped=True)
+            return
+        if session.uploads is None:
+            session.uploads = set()
+        session.uploads.add(upload_id)
+        chunk_size = UPLOAD_CHUNK_SIZE if session.framing.binary else LINE_UPLOAD_CHUNK_SIZE
+        self.reply(session, "upload_ready", upload_id=upload_id, chunk_size=chunk_size)
+
+    def _owned_upload(self, session, message):
+        upload_id = message.get("upload_id")
+        if not session.uploads or upload_id not in session.uploads:
+            self.reply(session, "error", message="Subida desconocida.")
+            return None
+        return upload_id
+
+    async def upload_chunk(self, session, message):
+        """
+        Acción 'upload_chunk': reenvía el trozo al almacenamiento sin respuesta.
+        Si la ventana de la subida está llena se espera acá, y mientras tanto
+        no se lee más de este socket.
+        """
+        upload_id = self._owned_upload(session, message)
+        if upload_id is None:
+            return
+        data = message.get("data")
+        try:
+            if isinstance(data, str):
+                data = base64.b64decode(data, validate=True)  # Líneas JSON
+            if not isinstance(data, bytes) or len(data) > UPLOAD_CHUNK_SIZE:
+                raise ValueError
+        except (ValueError, binascii.Error):
+            self.reply(session, "error", message="Trozo de archivo inválido.")
+            return
+        try:
+            await self.storage.write_chunk(upload_id, data)
+        except StorageError as e:
+            session.uploads.discard(upload_id)
+            await self.storage.abort(upload_id)
+            self.reply(session, "upload_failed", upload_id=upload_id, message=str(e))
+
+    async def upload_end(self, session, message):
+        """Acción 'upload_end': confirma la subida y avisa a la sala."""
+        upload_id = self._owned_upload(session, message)
+        if upload_id is None:
+            return
+        session.uploads.discard(upload_id)
+        try:
+            record = await self.storage.finish(upload_id)
+        except StorageError as e:
+            self.reply(session, "upload_failed", upload_id=upload_id, message=str(e))
+            return
+        await self._file_shared(session, upload_id, record)
+
+    async def _file_shared(self, session, upload_id, record, skipped=False):
+        """Confirma la subida al cliente y la anuncia en la sala."""
+        file_info = {"id": record["id"], "nombre": record["nombre"], "tamano": record["tamano"]}
+        # El mismo contenido ya estaba en la sala: se devuelve ese archivo sin anunciarlo otra vez
+        duplicate = record.get("duplicate", False)
+        self.reply(session, "upload_done", upload_id=upload_id, file=file_info, skipped=skipped or duplicate)
+        if duplicate:
+            return
+        username = session.user.username
+        await self.broadcast({
+            "action": "message",
+            "content": f"--> {username} compartió '{record['nombre']}' (archivo {record['id']})."
+        }, sender=session, system_msg=True)
+
+    async def send_file_list(self, session, message=None):
+        """Acción 'list_files': archivos compartidos en la sala actual."""
+        room_id = session.room_id
+        files = await db_manager.get_room_files(room_id, FILE_LIST_LIMIT)
+        self.reply(session, "file_list", room_id=room_id, files=files)
+
+    async def download(self, session, message):
+        """
+        Acción 'download': trama 'download_begin' seguida de `size` bytes crudos,
+        enviados por la cola de salida (sendfile cuando el loop lo permite).
+        """
+        try:
+            file_id = int(message.get("file_id"))
+        except (ValueError, TypeError):
+            self.reply(session, "error", message="ID de archivo inválido")
+            return
+        record = await db_manager.get_file(file_id)
+        path = os.path.join(STORAGE_DIR, record["ruta"]) if record else None
+        if record is None or record["sala_id"] != session.room_id or not os.path.isfile(path):
+            self.reply(session, "error", message="El archivo no existe en esta sala.")
+            return
+        extra = {} if (req := self._request_id(session)) is None else {"req": req}
+        header = session.framing.create_message(
+            "download_begin", file_id=file_id, name=record["nombre"], size=record["tamano"], **extra
+        )
+        missing = session.framing.create_message("error", message="El archivo no existe en esta sala.", **extra)
+        session.outbox.send_file(FileTransfer(header, path, record["tamano"], missing))
+
+    async def leave_room(self, session, message, notify_client=True):
         """Saca al usuario de la sala actual y lo devuelve al estado 'authenticated'."""
-        client_state = self.clients.get(writer)
-        if not client_state or not client_state.get("room_id"):
+        if not session.room_id:
             return
 
-        old_room_id = client_state["room_id"]
-        username = client_state['user']['username']
+        old_room_id = session.room_id
+        username = session.user.username
         
         # 1. Broadcast de despedida a la sala vieja
         await self.broadcast({
             "action": "message",
             "content": f"<-- {username} ha salido de la sala."
-        }, sender_writer=writer, system_msg=True)
+        }, sender=session, system_msg=True, cache_key=("leave", username))
 
-        log.info(f"Usuario {username} salió de Sala {old_room_id}")
+        log.info("Usuario %s salió de Sala %s", username, old_room_id, extra={"event": "room"})
 
         # 2. Resetear estado
-        client_state["room_id"] = None
-        client_state["state"] = "authenticated"
+        self._room_discard(session, old_room_id)
+        session.room_id = None
+        session.state = State.AUTHENTICATED
 
         # 3. Confirmar al cliente (solo si fue solicitado explícitamente)
         if notify_client:
-            writer.write(protocol.create_message("leave_success"))
-            await writer.drain()
+            self.reply(session, "leave_success")
 
-    async def handle_message(self, writer, message):
+    async def handle_message(self, session, message):
         """Maneja el envío de mensajes de chat."""
-        client_state = self.clients[writer]
-        room_id = client_state.get("room_id")
-        user_id = client_state["user"]["id"]
+        start = time.perf_counter_ns()
+        room_id = session.room_id
+        user_id = session.user.id
         content = message.get("content")
 
         if not room_id:
             return
+        # Se valida antes de encolar: una fila inválida haría fallar el lote de todos
+        if not isinstance(content, str) or not content.strip() or len(content) > MSG_MAX_LENGTH:
+            self.reply(session, "error", message=f"Mensaje inválido (1 a {MSG_MAX_LENGTH} caracteres).")
+            return
 
-        # 1. Guardar en BD (Persistencia)
-        await db_manager.save_message(user_id, room_id, content)
-
-        # 2. Broadcast a la sala
-        await self.broadcast(message, sender_writer=writer)
+        # 1. Encolar para persistir en lote (no espera al disco)
+        record = await self.message_writer.put(user_id, session.user.username, room_id, content)
+        self.history.append(room_id, record)
+
+        # 2. Broadcast a la sala (el registro va a los demás workers al persistirse)
+        encoded = await self.broadcast(message, sender=session)
+        self.encoder.record_message(time.perf_counter_ns() - start, encoded.encode_ns if encoded else 0)
+
+    def _over_limit(self, ip) -> str | None:
+        """Motivo para rechazar una conexión nueva, o None si entra en los límites."""
+        if len(self.sessions) >= MAX_CONNECTIONS:
+            return "max_connections"
+        if self.ip_connections.get(ip, 0) >= MAX_CONNECTIONS_PER_IP:
+            return "max_per_ip"
+        return None
+
+    def _within_rate(self, session, action, now) -> bool:
+        """Límites de tasa del usuario (o de la conexión, sin login) y de su sala."""
+        user = session.user
+        if user is None:
+            allowed = self.limiter.allow(session, action, now)
+            scope = "connection"
+        else:
+            allowed = self.limiter.allow_user(user.id, user.rol, action, now)
+            scope = "user"
+            if allowed and session.room_id is not None:
+                allowed = self.limiter.allow_room(session.room_id, action, now)
+                scope = "room"
+        if allowed:
+            return True
+        RATE_LIMITED.labels(action, scope).inc()
+        log.info("Límite de tasa (%s, %s): %s", action, scope, session.addr, extra={"event": "ratelimit"})
+        if RATE_LIMIT_REPLY == 'error' and self._request_id(session) is not None:
+            # El cliente espera la respuesta a ese "req": se la rechaza explícitamente
+            self.reply(session, "error", message="Demasiadas solicitudes, espera un momento.", rate_limited=action)
+        elif RATE_LIMIT_REPLY == 'error':
+            # Rechazo ya serializado por (acción, enmarcado): no cuesta un encode por trama
+            rejected = self.encoder.prepare(
+                {"action": "error", "message": "Demasiadas solicitudes, espera un momento.", "rate_limited": action},
+                ("rate_limited", action),
+            )
+            session.outbox.put(rejected.for_framing(session.framing))
+        return False
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
-        self.clients[writer] = {"addr": addr, "state": "connecting", "user": None, "room_id": None}
-        log.info(f"Conexión: {addr}")
+        ip = addr[0] if addr else None
+        # Rechazo rápido: ni cola de salida ni Session
+        rejected = self._over_limit(ip)
+        if rejected:
+            CONNECTIONS_REJECTED.labels(rejected).inc()
+            log.info("Conexión rechazada (%s): %s", rejected, addr, extra={"event": "reject"})
+            writer.write(REJECT_FRAMES[rejected])
+            writer.close()
+            return
+        self.ip_connections[ip] = self.ip_connections.get(ip, 0) + 1
+
+        netprofile.tune_socket(writer.get_extra_info('socket'), self.net_profile)
+        outbox = OutboundQueue(writer)
+        session = Session(writer, addr, outbox, protocol.LINE_FRAMING, time.perf_counter())
+        self.sessions.add(session)
+        log.info("Conexión: %s", addr, extra={"event": "conn"})
 
+        dispatch = self.dispatch
+        tagged = False
         try:
             while True:
-                data = await reader.readuntil(MESSAGE_DELIMITER)
-                msg = protocol.parse_message(data)
+                msg = await session.framing.read(reader)
+                start = time.perf_counter()
+                # Cualquier trama prueba que el par sigue vivo
+                session.last_seen = start
+                session.ping_sent = None
                 if not msg: continue
 
+                # Id de pedido opcional (ver reply); sólo se toca el contextvar si cambia algo
+                req = msg.get("req")
+                if req is not None or tagged:
+                    _REQUEST.set((session, req) if req is not None else None)
+                    tagged = req is not None
+
                 action = msg.get("action")
-                state = self.clients[writer]["state"]
-
-                if state == "connecting":
-                    if action == "login": await self.authenticate(writer, msg)
-                    else: pass 
-                
-                elif state == "authenticated":
-                    # Usuario logueado (en el lobby)
-                    if action == "get_rooms": await self.send_room_list(writer)
-                    elif action == "join": await self.join_room(writer, msg)
-                    elif action == "login": pass 
-                    else: writer.write(protocol.create_message("error", message="Debes unirte a una sala."))
-                
-                elif state == "in_room":
-                    # Usuario chateando en sala
-                    if action == "message": await self.handle_message(writer, msg)
-                    elif action == "leave_room": await self.leave_room(writer, msg) # NUEVA ACCIÓN
-                    elif action == "join": await self.join_room(writer, msg) 
-                    elif action == "get_rooms": await self.send_room_list(writer)
+                if not isinstance(action, str):
+                    # Una lista o un dict no sirven de clave para el despacho
+                    self.reply(session, "error", message="Acción desconocida.")
+                    continue
+                # El latido no cuenta como actividad para los plazos por estado
+                if action == "pong": continue
+                if action == "ping":
+                    self.reply(session, "pong")
+                    continue
+                state = session.state
+                # El plazo de login corre desde la conexión: mandar otras tramas no lo extiende
+                if state is not State.CONNECTING:
+                    session.last_active = start
+
+                entry = dispatch[state].get(action)
+                if entry is None:
+                    # Acción que no corresponde al estado: en el lobby se avisa, si no se ignora
+                    if state is State.AUTHENTICATED:
+                        self.reply(session, "error", message="Debes unirte a una sala.")
+                    continue
+                if not self._within_rate(session, action, start):
+                    continue
+                handler, timer = entry
+                await handler(session, msg)
+                timer.observe(time.perf_counter() - start)
 
         except Exception as e:
-            log.warning(f"Error con cliente {addr}: {e}")
+            log.warning("Error con cliente %s: %s", addr, e)
         finally:
-            if writer in self.clients:
-                del self.clients[writer]
+            if session.room_id is not None:
+                self._room_discard(session, session.room_id)
+            # Subidas a medio terminar: el almacenamiento borra el temporal
+            for upload_id in session.uploads or ():
+                await self.storage.abort(upload_id)
+            self.sessions.discard(session)
+            remaining = self.ip_connections.get(ip, 1) - 1
+            if remaining:
+                self.ip_connections[ip] = remaining
+            else:
+                self.ip_connections.pop(ip, None)
+            # Contadores de la cola de salida de la conexión (pendientes, enviados, descartados)
+            log.info("Desconexión: %s %s", addr, outbox.stats(), extra={"event": "conn"})
+            await outbox.close()
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def _drop(self, session, reason, message=None):
+        """Cierra una conexión por un plazo vencido; handle_client limpia al ver el EOF."""
+        if session.outbox.closed:
+            return
+        IDLE_REAPED.labels(reason).inc()
+        log.info("Cerrando %s (%s)", session.addr, reason, extra={"event": "reap"})
+        data = session.framing.create_message("error", message=message) if message else None
+        session.outbox.finish(data)
+
+    async def _check_deadlines(self, session, now):
+        state = session.state
+        idle = now - session.last_active
+        if state is State.CONNECTING:
+            if idle > LOGIN_TIMEOUT:
+                self._drop(session, "login_timeout", "Tiempo de login agotado.")
+            return
 
-    async def broadcast(self, message, sender_writer, system_msg=False):
-        """Envía mensaje solo a usuarios en la MISMA sala."""
-        sender_state = self.clients.get(sender_writer)
-        if not sender_state: return
+        ping_sent = session.ping_sent
+        if ping_sent is not None:
+            # Nada llegó desde el ping: conexión medio abierta o cliente colgado
+            if now - ping_sent > HEARTBEAT_TIMEOUT:
+                self._drop(session, "heartbeat")
+            return
 
-        room_id = sender_state.get("room_id")
+        if state is State.AUTHENTICATED and idle > LOBBY_IDLE_TIMEOUT:
+            self._drop(session, "lobby_idle", "Desconectado por inactividad.")
+        elif state is State.IN_ROOM and idle > ROOM_IDLE_TIMEOUT:
+            # Sigue conectado, pero deja de costar en cada broadcast de la sala
+            IDLE_REAPED.labels("room_idle").inc()
+            self.reply(session, "idle_timeout", message="Saliste de la sala por inactividad.")
+            await self.leave_room(session, None)
+            session.last_active = now
+        elif now - session.last_seen > HEARTBEAT_INTERVAL and not session.outbox.depth():
+            # Con tramas o una descarga todavía en cola el ping llegaría tarde: se espera
+            session.ping_sent = now
+            self.reply(session, "ping")
+
+    async def reap_idle(self):
+        """
+        Aplica los plazos por estado y el latido recorriendo las conexiones cada
+        REAPER_INTERVAL segundos. Un solo recorrido periódico en lugar de un
+        timeout por lectura: el camino caliente sólo actualiza marcas de tiempo.
+        """
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            now = time.perf_counter()
+            self.limiter.expire(now)
+            for session in list(self.sessions):
+                # Puede haberse ido mientras se atendía a otro (leave_room espera)
+                if session not in self.sessions:
+                    continue
+                try:
+                    await self._check_deadlines(session, now)
+                except Exception as e:
+                    log.warning("Error revisando plazos de %s: %s", session.addr, e)
+
+    async def broadcast(self, message, sender, system_msg=False, cache_key=None):
+        """
+        Envía mensaje solo a usuarios en la MISMA sala que la sesión `sender`.
+        `cache_key` identifica mensajes del sistema repetibles cuya serialización
+        se reutiliza entre broadcasts. Devuelve el protocol.Encoded usado.
+        También se publica en el pub/sub para los demás workers/nodos.
+        """
+        room_id = sender.room_id
         # Si el usuario ya salió (room_id es None), no podemos hacer broadcast basado en él.
         # Pero en leave_room guardamos old_room antes de borrarlo, así que el broadcast
         # se hace antes de borrar el room_id.
+        if room_id is None: return
         
-        username = sender_state["user"]["username"] if not system_msg else "Sistema"
+        username = sender.user.username if not system_msg else "Sistema"
         
-        out_msg = protocol.create_message("broadcast", sender=username, content=message.get("content"))
-
-        for target_writer, state in self.clients.items():
-            if state.get("room_id") == room_id:
-                try:
-                    target_writer.write(out_msg)
-                    await target_writer.drain()
-                except: pass
+        out_msg = {"action": "broadcast", "sender": username, "content": message.get("content")}
+        self.pubsub.publish(room_id, {"room": room_id, "msg": out_msg, "key": cache_key})
+        return self._fanout(room_id, out_msg, cache_key)
+
+    def _fanout(self, room_id, out_msg, cache_key=None):
+        """Entrega un mensaje a las conexiones locales de la sala."""
+        members = self.rooms.get(room_id)
+        if not members: return
+        start = time.perf_counter()
+        encoded = self.encoder.prepare(out_msg, cache_key)
+
+        # Se serializa una vez por enmarcado y todos comparten los mismos bytes;
+        # nadie espera drain(). Copia: la política 'disconnect' puede alterar
+        # la sala durante el recorrido.
+        for member in list(members):
+            member.outbox.put(encoded.for_framing(member.framing))
+        FANOUT_SECONDS.observe(time.perf_counter() - start)
+        FANOUT_SIZE.observe(len(members))
+        return encoded
+
+    def _on_room_event(self, event):
+        """Evento de sala publicado por otro worker o nodo."""
+        room_id = event.get("room")
+        if room_id == CATALOG_CHANNEL:
+            self.catalog.invalidate()
+            if event.get("deleted") is not None:
+                self._close_room(event["deleted"])
+            return
+        if event.get("record"):
+            self.history.insert(room_id, event["record"])
+        if event.get("msg"):
+            key = event.get("key")
+            self._fanout(room_id, event["msg"], tuple(key) if key else None)
+
+    def _publish_record(self, room_id, record):
+        """
+        Mensaje ya persistido (callback del MessageWriter): su registro, con
+        el 'id' asignado, va a las cachés de historial de los demás workers.
+        """
+        self.pubsub.publish(room_id, {"room": room_id, "record": record})
+
+    def _register_gauges(self):
+        """Gauges calculados al scrapear, a partir del estado del servidor."""
+        depths = lambda: [session.outbox.depth() for session in self.sessions]
+        metrics.gauge("scee_connections", "Conexiones abiertas", lambda: len(self.sessions))
+        metrics.gauge("scee_rooms_active", "Salas con al menos un miembro local", lambda: len(self.rooms))
+        metrics.gauge("scee_outbound_queued_messages", "Mensajes en colas de salida",
+                      lambda: sum(depths()))
+        metrics.gauge("scee_outbound_queue_depth_max", "Cola de salida más larga",
+                      lambda: max(depths(), default=0))
+        metrics.gauge("scee_transport_write_buffer_bytes", "Bytes pendientes en los transportes",
+                      lambda: sum(s.writer.transport.get_write_buffer_size() for s in self.sessions
+                                  if s.writer.transport is not None))
+        metrics.gauge("scee_write_behind_pending", "Mensajes de chat sin persistir",
+                      lambda: self.message_writer.stats()["queue_depth"])
+
+    async def _start_metrics(self):
+        """Endpoint de métricas y monitor de lag; None si están deshabilitadas."""
+        if not metrics.ENABLED or not self.metrics_port:
+            return None, None
+        self._register_gauges()
+        server = await metrics.start_server(METRICS_HOST, self.metrics_port)
+        lag_task = asyncio.create_task(metrics.monitor_loop_lag(METRICS_LOOP_LAG_INTERVAL))
+        return server, lag_task
 
     async def start(self):
-        await db_manager.init_db()
-        server = await asyncio.start_server(self.handle_client, self.host, self.port)
-        log.info(f"Servidor SCEE Etapa 3.5 en {self.host}:{self.port}")
-        async with server: await server.serve_forever()
+        if self.init_db:
+            await db_manager.init_db()
+        self.auth_pool.attach()
+        await self.storage.attach()
+        # Pool de conexiones persistente: se cierra dentro del mismo loop al apagar
+        await db_manager.open_pool(search_size=SEARCH_CONNECTIONS)
+        self.message_writer.start()
+        await self.catalog.load()
+        metrics_server, lag_task = await self._start_metrics()
+        reaper = asyncio.create_task(self.reap_idle())
+        try:
+            await self.pubsub.start(self._on_room_event)
+            self.pubsub.subscribe(CATALOG_CHANNEL)
+            sock = netprofile.listen_socket(self.host, self.port, self.net_profile, self.reuse_port)
+            server = await asyncio.start_server(
+                self.handle_client, sock=sock, backlog=self.net_profile["backlog"]
+            )
+            log.info("Servidor SCEE Etapa 3.5 en %s:%s", self.host, self.port)
+            async with server: await server.serve_forever()
+        finally:
+            reaper.cancel()
+            if metrics_server is not None:
+                lag_task.cancel()
+                metrics_server.close()
+            await self.pubsub.close()
+            await self.storage.close()
+            # Vaciar los mensajes pendientes antes de cerrar el pool
+            await self.message_writer.stop()
+            log.info("Serialización del broadcast: %s", self.encoder.stats())
+            log.info("Catálogo de salas: %s", self.catalog.stats())
+            await db_manager.close_pool()
 
     def stop(self):
-        self.auth_pipe_parent.send({"command": "shutdown"})
-        self.auth_proc.join()
+        self.auth_pool.stop()
+        self.storage.stop()
 
 if __name__ == "__main__":
-    srv = Server(HOST, PORT)
-    try: asyncio.run(srv.start())
-    except KeyboardInterrupt: pass
-    finally: srv.stop()
\ No newline at end of file
+    import argparse
+    from .config import WORKERS, NET_PROFILES
+    parser = argparse.ArgumentParser(description="Servidor SCEE")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="procesos que aceptan conexiones en el mismo puerto (SO_REUSEPORT)")
+    parser.add_argument("--net-profile", choices=sorted(NET_PROFILES), default=NET_PROFILE,
+                        help="opciones de socket (backlog, TCP_NODELAY, buffers, keepalive)")
+    args = parser.parse_args()
+
+    setup_logging("SERVER")
+    if args.workers > 1:
+        from .supervisor import run_supervisor
+        run_supervisor(HOST, PORT, args.workers, args.net_profile)
+    else:
+        log.info("Event loop: %s", netprofile.install_event_loop())
+        srv = Server(HOST, PORT, net_profile=args.net_profile)
+        try: asyncio.run(srv.start())
+        except KeyboardInterrupt: pass
+        finally: srv.stop()
\ No newline at end of file
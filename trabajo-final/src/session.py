@@ -0,0 +1,76 @@
+# src/session.py
+"""
+Estado de cada conexión del servidor.
+
+Una Session por conexión, con __slots__ (sin __dict__ por objeto) y el estado
+del protocolo como entero (State). Los datos del usuario viven en un User
+compartido por todas las sesiones del mismo usuario (UserRegistry), en lugar
+de un dict copiado en cada login.
+"""
+
+import enum
+import sys
+import weakref
+
+
+class State(enum.IntEnum):
+    CONNECTING = 0     # Sin login: sólo 'hello', 'login' y 'resume'
+    AUTHENTICATED = 1  # En el lobby
+    IN_ROOM = 2
+
+
+class User:
+    """Datos de un usuario logueado; no se modifican (se comparten entre sesiones)."""
+    __slots__ = ("id", "username", "rol", "__weakref__")
+
+    def __init__(self, user_id: int, username: str, rol: str):
+        self.id = user_id
+        self.username = sys.intern(username)
+        self.rol = sys.intern(rol)
+
+    @property
+    def is_teacher(self) -> bool:
+        return self.rol == "profesor"
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "username": self.username, "rol": self.rol}
+
+
+class UserRegistry:
+    """Un único User por id mientras alguna sesión lo tenga (referencias débiles)."""
+
+    def __init__(self):
+        self._users: weakref.WeakValueDictionary[int, User] = weakref.WeakValueDictionary()
+
+    def get(self, user_data: dict) -> User:
+        user = self._users.get(user_data["id"])
+        if user is None or user.username != user_data["username"] or user.rol != user_data["rol"]:
+            # Primera sesión del usuario, o cambiaron sus datos (las sesiones viejas conservan los suyos)
+            user = User(user_data["id"], user_data["username"], user_data["rol"])
+            self._users[user.id] = user
+        return user
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+class Session:
+    """Una conexión: transporte, estado del protocolo y marcas para los plazos (ver Server.reap_idle)."""
+    __slots__ = ("writer", "addr", "outbox", "framing", "state", "user", "room_id", "uploads",
+                 "buckets", "last_seen", "last_active", "ping_sent")
+
+    def __init__(self, writer, addr, outbox, framing, now: float):
+        self.writer = writer
+        self.addr = addr
+        self.outbox = outbox
+        self.framing = framing
+        self.state = State.CONNECTING
+        self.user: User | None = None
+        self.room_id: int | None = None
+        # Subidas abiertas (upload_id); el set se crea con la primera
+        self.uploads: set | None = None
+        # Límites de tasa antes del login (después, los del usuario en el RateLimiter)
+        self.buckets: dict | None = None
+        self.last_seen = now
+        self.last_active = now
+        self.ping_sent: float | None = None
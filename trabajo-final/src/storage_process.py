@@ -1,40 +1,469 @@
 # src/storage_process.py
 """
 Proceso de almacenamiento de recursos (IPC).
-(Stub para Etapa 4)
+Recibe las subidas de archivos desde el servidor por un socketpair y las
+escribe en STORAGE_DIR; al terminar registra los metadatos en la BD.
+
+El contenido se direcciona por SHA-256 (calculado mientras llegan los
+trozos): cada blob se guarda una sola vez en STORAGE_DIR/blobs/ y los
+archivos de las salas son referencias contadas. Si el cliente anuncia el
+hash en 'upload_begin' y el blob ya existe, la subida se resuelve sin
+transferir ni un byte.
+
+Cada subida llega en trozos: el servidor reenvía cada 'upload_chunk' del
+cliente tal cual (sin base64 ni archivo completo en memoria) y mantiene a lo
+sumo STORAGE_WINDOW trozos en vuelo por subida. Como el socketpair se usa
+con streams de asyncio, el servidor nunca se bloquea escribiendo: espera
+drain() y la ventana, y mientras tanto deja de leer el socket del cliente.
+
+Las descargas no pasan por acá: el servidor abre el archivo y lo envía con
+sendfile directamente al socket del cliente (ver outbound.FileTransfer).
 """
 
+import asyncio
+import hashlib
+import itertools
 import logging
-from multiprocessing import Pipe
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import socket
+from .config import STORAGE_DIR, STORAGE_WINDOW, STORAGE_TIMEOUT, STORAGE_RESTART_DELAY
+from . import db_manager
+from .logsetup import setup_logging, shutdown_logging
+
+log = logging.getLogger(__name__)
+
+TMP_DIR = "tmp"
+BLOB_DIR = "blobs"
+
+
+class StorageError(Exception):
+    """Pedido rechazado por el proceso de almacenamiento."""
+
+
+# --- Tramas del socketpair: 4 bytes de longitud + pickle (canal local y confiable) ---
+
+def _write_frame(writer: asyncio.StreamWriter, message: dict):
+    body = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.writelines((len(body).to_bytes(4, 'big'), body))
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> dict:
+    size = int.from_bytes(await reader.readexactly(4), 'big')
+    return pickle.loads(await reader.readexactly(size))
+
+
+def blob_path(digest: str) -> str:
+    """Ruta relativa (a STORAGE_DIR) de un blob; se reparte en 256 subdirectorios."""
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
 
-def storage_process_worker(pipe_conn: Pipe):
+def is_sha256(value) -> bool:
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+# --- Lado del proceso de almacenamiento ---
+
+def storage_process_worker(sock: socket.socket, root: str = STORAGE_DIR):
     """
     Función que se ejecuta en un proceso separado para manejar archivos.
     """
-    logging.info("Proceso de almacenamiento iniciado (STUB).")
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging("STORAGE")
+    log.info("Proceso de almacenamiento iniciado.")
+    try:
+        asyncio.run(_serve(sock, root))
+    except Exception as e:
+        log.error("Error inesperado en storage_process_worker: %s", e)
+    finally:
+        log.info("Proceso de almacenamiento terminado.")
+        sock.close()
+        shutdown_logging()
+
+
+class _Store:
+    """
+    Subidas en curso: se escriben en TMP_DIR y, al terminar, se mueven al
+    blob de su hash (o se descartan si ese contenido ya estaba guardado).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # Un directorio temporal por proceso: en modo --workers hay uno por worker
+        self.tmp = os.path.join(root, TMP_DIR, str(os.getpid()))
+        os.makedirs(self.tmp, exist_ok=True)
+        self.uploads = {}
+        # Serializa altas y bajas de blobs de este proceso: un purge no debe borrar un blob recién escrito
+        self._blobs = asyncio.Lock()
+        # Métricas de deduplicación
+        self.dedup_hits = 0
+        self.bytes_saved = 0
+
+    async def _existing(self, request: dict, digest: str) -> dict | None:
+        """Resuelve una subida con un blob ya guardado; None si hay que transferir."""
+        room_id = request["room_id"]
+        # El mismo contenido ya está en esta sala: no se duplica la entrada ni se vuelve a anunciar
+        record = await db_manager.get_room_file_by_hash(room_id, digest)
+        if record is not None:
+            record["duplicate"] = True
+        else:
+            blob = await db_manager.find_blob(digest)
+            if blob is None or blob["tamano"] != request["size"]:
+                return None
+            record = await db_manager.add_file_ref(
+                room_id, request["user_id"], request["name"], digest, blob["tamano"], blob["ruta"]
+            )
+            if record is None:
+                return None
+        self.dedup_hits += 1
+        self.bytes_saved += record["tamano"]
+        return record
+
+    async def begin(self, request: dict) -> dict:
+        digest = request.get("sha256")
+        if digest:
+            record = await self._existing(request, digest)
+            if record is not None:
+                return {"status": "ok", "file": record, "dedup": True}
+
+        # El id lo asigna StorageClient: sigue contando aunque este proceso se relance
+        upload_id = request["upload_id"]
+        path = os.path.join(self.tmp, f"{upload_id}.part")
+        self.uploads[upload_id] = {
+            "file": open(path, 'wb'), "path": path, "written": 0, "hasher": hashlib.sha256(),
+            "size": request["size"], "room_id": request["room_id"], "sha256": digest,
+            "user_id": request["user_id"], "name": request["name"],
+        }
+        return {"status": "ok", "upload_id": upload_id}
+
+    def chunk(self, request: dict) -> dict:
+        upload = self.uploads.get(request["upload_id"])
+        if upload is None:
+            return {"status": "error", "message": "Subida desconocida"}
+        data = request["data"]
+        if upload["written"] + len(data) > upload["size"]:
+            self.abort(request["upload_id"])
+            return {"status": "error", "message": "El archivo supera el tamaño anunciado"}
+        upload["file"].write(data)
+        upload["hasher"].update(data)
+        upload["written"] += len(data)
+        return {"status": "ok"}
+
+    async def end(self, request: dict) -> dict:
+        upload_id = request["upload_id"]
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return {"status": "error", "message": "Subida desconocida"}
+        if upload["written"] != upload["size"]:
+            self.abort(upload_id)
+            return {"status": "error", "message": "Subida incompleta"}
+        digest = upload["hasher"].hexdigest()
+        if upload["sha256"] and upload["sha256"] != digest:
+            self.abort(upload_id)
+            return {"status": "error", "message": "El contenido no coincide con el hash anunciado"}
+        upload["file"].close()
+        del self.uploads[upload_id]
+
+        try:
+            async with self._blobs:
+                # Llegó sin hash anunciado (o se subió en paralelo): igual se deduplica
+                record = await self._existing(upload, digest)
+                if record is not None:
+                    return {"status": "ok", "file": record}
+
+                path = blob_path(digest)
+                full_path = os.path.join(self.root, path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(upload["path"], full_path)
+                try:
+                    record = await db_manager.add_file_ref(
+                        upload["room_id"], upload["user_id"], upload["name"], digest, upload["size"], path, create=True
+                    )
+                except Exception:
+                    # Sin fila en la BD el blob no lo referencia nadie (p. ej. la sala se borró durante la subida)
+                    os.unlink(full_path)
+                    raise
+        finally:
+            # Si no pasó a ser el blob (ya existía o falló la BD) el temporal sobra
+            try:
+                os.unlink(upload["path"])
+            except FileNotFoundError:
+                pass
+        log.info("Blob %s guardado para la sala %s (%s bytes)", digest[:12], upload["room_id"], upload["size"])
+        return {"status": "ok", "file": record}
+
+    def abort(self, upload_id) -> dict:
+        upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            upload["file"].close()
+            try:
+                os.unlink(upload["path"])
+            except OSError:
+                pass
+        return {"status": "ok"}
+
+    async def purge_room(self, request: dict) -> dict:
+        """Suelta las referencias de una sala eliminada y borra los blobs que quedan sin uso."""
+        room_id = int(request["room_id"])
+        async with self._blobs:
+            for path in await db_manager.release_room_files(room_id):
+                try:
+                    os.unlink(os.path.join(self.root, path))
+                except FileNotFoundError:
+                    pass
+        # Directorio de la sala con archivos previos al almacenamiento por contenido
+        shutil.rmtree(os.path.join(self.root, str(room_id)), ignore_errors=True)
+        return {"status": "ok"}
+
+    def close(self):
+        for upload_id in list(self.uploads):
+            self.abort(upload_id)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        log.info("Deduplicación: %s subidas evitadas, %s bytes ahorrados", self.dedup_hits, self.bytes_saved)
+
+
+async def _serve(sock: socket.socket, root: str):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    store = _Store(root)
+    await db_manager.open_pool(size=1)
     try:
         while True:
-            request = pipe_conn.recv()
-            if request.get("command") == "shutdown":
+            try:
+                request = await _read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                log.info("Proceso de almacenamiento: canal cerrado (normal al apagar).")
+                break
+            command = request.get("command")
+            if command == "shutdown":
+                log.info("Comando 'shutdown' recibido.")
                 break
 
-            if request.get("command") == "upload":
-                filename = request.get("filename")
-                filedata_b64 = request.get("data")
-                sala = request.get("sala")
-                
-                logging.info(f"Storage_Process: Recibido archivo '{filename}' para la sala '{sala}'...")
-                # Aquí iría la lógica para:
-                # 1. Decodificar base64
-                # 2. Guardar el archivo en el filesystem (ej: 'uploads/sala/filename')
-                # 3. Registrar los metadatos en la BD (usando db_manager)
-                
-                # Simulación
-                response = {"status": "ok", "message": f"Archivo '{filename}' guardado."}
-                pipe_conn.send(response)
-
-    except EOFError:
-        logging.info("Proceso de almacenamiento: Pipe cerrado.")
+            try:
+                if command == "chunk":
+                    response = store.chunk(request)
+                elif command == "begin":
+                    response = await store.begin(request)
+                elif command == "end":
+                    response = await store.end(request)
+                elif command == "abort":
+                    response = store.abort(request["upload_id"])
+                elif command == "purge_room":
+                    response = await store.purge_room(request)
+                else:
+                    response = {"status": "error", "message": f"Comando desconocido: {command}"}
+            except Exception as e:
+                # E/S o BD (bloqueada, FK de una sala borrada durante la subida...):
+                # falla el pedido, no el proceso. db_manager ya deshizo la transacción.
+                log.error("Error en almacenamiento (%s): %s", command, e)
+                if "upload_id" in request:
+                    store.abort(request["upload_id"])
+                response = {"status": "error", "message": "Error de almacenamiento"}
+
+            response["id"] = request.get("id")
+            _write_frame(writer, response)
+            await writer.drain()
     finally:
-        logging.info("Proceso de almacenamiento terminado.")
-        pipe_conn.close()
\ No newline at end of file
+        store.close()
+        writer.close()
+        await db_manager.close_pool()
+
+
+# --- Lado del servidor ---
+
+class StorageClient:
+    """
+    Proxy del servidor hacia el proceso de almacenamiento.
+    El proceso se lanza al construir (antes de que exista el loop, como el
+    AuthPool); `attach()` abre el stream sobre el socketpair. Si el proceso
+    muere se relanza: las subidas en curso fallan, las siguientes funcionan.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR, window: int = STORAGE_WINDOW):
+        self.root = root
+        self.window = window
+        self._ids = itertools.count(1)
+        # Ids de subida únicos durante toda la vida del cliente, no por proceso
+        self._upload_ids = itertools.count(1)
+        # Los ids menores a éste eran de un proceso ya perdido
+        self._lost_below = 0
+        self._pending = {}
+        # uploads[upload_id] = {"window": Semaphore, "inflight": set, "error": str | None}
+        self._uploads = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+        self._closing = False
+        self.restarts = 0
+        self._spawn(multiprocessing)
+
+    def _spawn(self, context):
+        parent_sock, child_sock = socket.socketpair()
+        self.proc = context.Process(
+            target=storage_process_worker, args=(child_sock, self.root), daemon=True
+        )
+        self.proc.start()
+        child_sock.close()
+        self._sock = parent_sock
+
+    async def attach(self):
+        reader, self._writer = await asyncio.open_connection(sock=self._sock)
+        self._reader_task = asyncio.create_task(self._read_responses(reader))
+
+    async def _read_responses(self, reader):
+        try:
+            while True:
+                response = await _read_frame(reader)
+                future = self._pending.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if not self._closing:
+                log.error("Proceso de almacenamiento perdido.")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(StorageError("Proceso de almacenamiento no disponible"))
+            self._pending.clear()
+            # Las subidas abiertas vivían en el proceso perdido: se olvidan y
+            # sus ids no se reusan, así un id viejo nunca apunta a una subida ajena
+            self._lost_below = next(self._upload_ids)
+            self._uploads.clear()
+        if not self._closing:
+            await self._restart()
+
+    async def _restart(self):
+        """Relanza el proceso de almacenamiento tras perder el canal."""
+        self._writer.close()
+        old = self.proc
+        await asyncio.sleep(STORAGE_RESTART_DELAY)
+        await asyncio.to_thread(old.join, 5)
+        if old.is_alive():
+            old.terminate()
+        self._sock.close()
+        # Temporales de las subidas que murieron con el proceso
+        shutil.rmtree(os.path.join(self.root, TMP_DIR, str(old.pid)), ignore_errors=True)
+        if self._closing:
+            return
+        # Con el servidor ya corriendo, un fork heredaría los sockets de los
+        # clientes (y un close del servidor no los cerraría): se usa spawn
+        self._spawn(multiprocessing.get_context("spawn"))
+        self.restarts += 1
+        log.warning("Proceso de almacenamiento relanzado (pid %s).", self.proc.pid)
+        await self.attach()
+
+    async def _send(self, payload: dict) -> asyncio.Future:
+        """Envía un pedido y devuelve el Future de su respuesta."""
+        if self._writer is None or self._writer.is_closing():
+            raise StorageError("Proceso de almacenamiento no disponible")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        _write_frame(self._writer, {**payload, "id": request_id})
+        await self._writer.drain()
+        return future
+
+    async def request(self, payload: dict) -> dict:
+        future = await self._send(payload)
+        try:
+            response = await asyncio.wait_for(future, STORAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise StorageError("El almacenamiento no respondió a tiempo") from None
+        if response.get("status") != "ok":
+            raise StorageError(response.get("message", "Error de almacenamiento"))
+        return response
+
+    async def begin(self, room_id: int, user_id: int, name: str, size: int, sha256: str | None = None):
+        """
+        Abre una subida. Devuelve (upload_id, None), o (None, metadatos) si el
+        contenido anunciado por `sha256` ya estaba guardado y no hay que transferirlo.
+        """
+        upload_id = next(self._upload_ids)
+        response = await self.request({
+            "command": "begin", "upload_id": upload_id, "room_id": room_id, "user_id": user_id,
+            "name": name, "size": size, "sha256": sha256,
+        })
+        if response.get("dedup"):
+            return None, response["file"]
+        self._uploads[upload_id] = {"window": asyncio.Semaphore(self.window), "inflight": set(), "error": None}
+        return upload_id, None
+
+    def _upload(self, upload_id: int) -> dict:
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            if isinstance(upload_id, int) and upload_id < self._lost_below:
+                raise StorageError("Proceso de almacenamiento no disponible")
+            raise StorageError("Subida desconocida")
+        return upload
+
+    async def write_chunk(self, upload_id: int, data: bytes):
+        """
+        Reenvía un trozo sin esperar su confirmación, salvo que la ventana de
+        la subida esté llena. Un error de un trozo anterior se informa acá.
+        """
+        upload = self._upload(upload_id)
+        if upload["error"]:
+            raise StorageError(upload["error"])
+        await upload["window"].acquire()
+        try:
+            future = await self._send({"command": "chunk", "upload_id": upload_id, "data": data})
+        except BaseException:
+            upload["window"].release()
+            raise
+        upload["inflight"].add(future)
+
+        def _acked(f):
+            upload["window"].release()
+            upload["inflight"].discard(f)
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                upload["error"] = str(f.exception())
+            elif f.result().get("status") != "ok":
+                upload["error"] = f.result().get("message", "Error de almacenamiento")
+        future.add_done_callback(_acked)
+
+    async def finish(self, upload_id: int) -> dict:
+        """Espera los trozos en vuelo, cierra la subida y devuelve los metadatos."""
+        upload = self._upload(upload_id)
+        if upload["inflight"]:
+            await asyncio.wait(set(upload["inflight"]), timeout=STORAGE_TIMEOUT)
+        if self._uploads.pop(upload_id, None) is None:
+            # El proceso se perdió mientras se esperaban los trozos
+            self._upload(upload_id)
+        if upload["error"]:
+            raise StorageError(upload["error"])
+        return (await self.request({"command": "end", "upload_id": upload_id}))["file"]
+
+    async def abort(self, upload_id: int):
+        """Descarta una subida (por ejemplo, si el cliente se desconecta)."""
+        if self._uploads.pop(upload_id, None) is None:
+            return
+        try:
+            await self._send({"command": "abort", "upload_id": upload_id})
+        except (StorageError, ConnectionError):
+            pass
+
+    async def purge_room(self, room_id: int):
+        await self.request({"command": "purge_room", "room_id": room_id})
+
+    async def close(self):
+        """Pide al proceso que termine (dentro del loop, antes de cerrarlo)."""
+        self._closing = True
+        if self._writer is not None and not self._writer.is_closing():
+            try:
+                _write_frame(self._writer, {"command": "shutdown"})
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+
+    def stop(self):
+        """Espera a que el proceso salga (fuera del loop)."""
+        self.proc.join(timeout=5)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self._sock.close()
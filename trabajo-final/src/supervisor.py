@@ -0,0 +1,147 @@
+# src/supervisor.py
+"""
+Supervisor del modo multiproceso (python -m src.server --workers N).
+- Inicializa la base de datos una sola vez.
+- Lanza N workers; cada uno corre un Server con SO_REUSEPORT sobre el mismo
+  puerto, así el kernel reparte las conexiones entre núcleos.
+- Mantiene el bus local (BusBroker) por el que cruzan los broadcasts de sala,
+  salvo que PUBSUB_BACKEND sea 'redis' (los workers usan Redis directamente).
+- Si un worker muere lo relanza en su mismo lugar (índice, puerto de
+  métricas) con una pausa que crece ante caídas seguidas.
+- Ante SIGINT/SIGTERM ordena a todos los workers un apagado ordenado
+  (cada uno vacía su cola write-behind y cierra sus procesos de auth).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+from .config import (AUTH_WORKERS, BUS_SOCKET_PATH, PUBSUB_BACKEND, NET_PROFILE, METRICS_PORT,
+                     WORKER_RESTART_DELAY, WORKER_RESTART_MAX_DELAY)
+from . import db_manager
+from . import netprofile
+from .bus import BusBroker
+from .logsetup import setup_logging, shutdown_logging
+
+log = logging.getLogger(__name__)
+
+WORKER_STOP_TIMEOUT = 10  # segundos
+
+
+def _worker_backend() -> str:
+    # 'local' no cruza procesos: en modo multiproceso se reemplaza por el bus
+    return 'unix' if PUBSUB_BACKEND == 'local' else PUBSUB_BACKEND
+
+
+def _worker_main(index: int, host: str, port: int, auth_workers: int, net_profile: str):
+    """Punto de entrada de cada proceso worker."""
+    # Ctrl+C llega a todo el grupo de procesos: el apagado lo coordina el supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(f"WORKER-{index}")
+    from .server import Server
+
+    netprofile.install_event_loop()
+    srv = Server(host, port, reuse_port=True, pubsub_backend=_worker_backend(), init_db=False,
+                 auth_workers=auth_workers, net_profile=net_profile, metrics_port=METRICS_PORT + index)
+    try:
+        asyncio.run(_run_worker(srv, index))
+    finally:
+        srv.stop()
+        log.info("Worker %s terminado.", index)
+        shutdown_logging()
+
+
+def _start_worker(context, index: int, host: str, port: int, auth_workers: int, net_profile: str):
+    proc = context.Process(target=_worker_main, args=(index, host, port, auth_workers, net_profile),
+                           name=f"scee-worker-{index}")
+    proc.start()
+    return proc
+
+
+async def _run_worker(srv, index: int):
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    log.info("Worker %s iniciado.", index)
+    try:
+        await srv.start()
+    except asyncio.CancelledError:
+        pass
+
+
+def run_supervisor(host: str, port: int, workers: int, net_profile: str = NET_PROFILE):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("Esta plataforma no soporta SO_REUSEPORT; use --workers 1.")
+
+    asyncio.run(db_manager.init_db())
+
+    # Los núcleos se reparten entre los pools de autenticación de cada worker
+    auth_workers = max(1, AUTH_WORKERS // workers)
+    worker_args = (host, port, auth_workers, net_profile)
+    # Se lanzan antes de crear el loop del supervisor (fork sin loop activo);
+    # los workers reintentan la conexión hasta que el bus esté escuchando.
+    procs = [_start_worker(multiprocessing, i, *worker_args) for i in range(workers)]
+    log.info("Supervisor: %s workers en %s:%s", workers, host, port)
+
+    # Con el loop y el bus ya abiertos, un fork heredaría sus sockets: los
+    # workers relanzados usan spawn
+    spawn = multiprocessing.get_context("spawn")
+    try:
+        asyncio.run(_supervise(procs, lambda index: _start_worker(spawn, index, *worker_args)))
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.kill()
+
+
+async def _supervise(procs: list[multiprocessing.Process], respawn):
+    """
+    Espera la señal de apagado vigilando los workers. `procs` se actualiza
+    en el lugar: `respawn(índice)` lanza el reemplazo de un worker caído.
+    """
+    loop = asyncio.get_running_loop()
+    broker = BusBroker(BUS_SOCKET_PATH) if _worker_backend() == 'unix' else None
+    if broker is not None:
+        await broker.start()
+
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    started = [loop.time()] * len(procs)
+    failures = [0] * len(procs)
+    # Workers caídos (ya informados) -> momento en que se relanzan
+    due: dict[int, float] = {}
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                now = loop.time()
+                for index, proc in enumerate(procs):
+                    if index in due:
+                        if now >= due[index]:
+                            del due[index]
+                            procs[index] = respawn(index)
+                            started[index] = now
+                            log.warning("%s relanzado (pid %s).", proc.name, procs[index].pid)
+                    elif not proc.is_alive():
+                        # Caídas seguidas (el worker no llegó a durar la pausa máxima)
+                        # duplican la pausa; si había durado, se vuelve a la inicial
+                        if now - started[index] > WORKER_RESTART_MAX_DELAY:
+                            failures[index] = 0
+                        delay = min(WORKER_RESTART_DELAY * 2 ** min(failures[index], 16), WORKER_RESTART_MAX_DELAY)
+                        failures[index] += 1
+                        due[index] = now + delay
+                        log.error("%s terminó con código %s; se relanza en %.0f s.",
+                                  proc.name, proc.exitcode, delay)
+    finally:
+        log.info("Supervisor: apagando workers...")
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM -> apagado ordenado del worker
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join, WORKER_STOP_TIMEOUT)
+        if broker is not None:
+            await broker.close()
+        log.info("Supervisor: grupo detenido.")
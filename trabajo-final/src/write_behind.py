@@ -0,0 +1,196 @@
+# src/write_behind.py
+"""
+Persistencia write-behind de mensajes de chat.
+El servidor encola cada mensaje y hace el broadcast sin esperar al disco;
+una tarea en segundo plano los escribe en lote (executemany + un solo commit).
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from .config import MSG_FLUSH_INTERVAL_MS, MSG_FLUSH_MAX_BATCH, MSG_QUEUE_MAX
+from . import db_manager
+
+log = logging.getLogger(__name__)
+
+# Marca de fin que se encola al detener el writer
+_STOP = object()
+
+
+def _timestamp() -> str:
+    """Mismo formato que CURRENT_TIMESTAMP de SQLite (UTC)."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MessageWriter:
+    """
+    Cola acotada de mensajes pendientes + tarea que los vuelca a la BD.
+
+    Durabilidad: un mensaje queda en disco como mucho `flush_interval_ms`
+    después de encolarse (o antes, si se completa un lote de `max_batch`).
+    Al detenerse se vacía la cola antes de terminar.
+
+    `on_flushed(room_id, record)` (opcional) se llama por cada mensaje ya
+    escrito, con su 'id' asignado.
+    """
+
+    def __init__(self, flush_interval_ms=MSG_FLUSH_INTERVAL_MS,
+                 max_batch=MSG_FLUSH_MAX_BATCH, max_queue=MSG_QUEUE_MAX, on_flushed=None):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.on_flushed = on_flushed
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_ready = asyncio.Event()
+        self._flushed_cond = asyncio.Condition()
+        self._task: asyncio.Task | None = None
+        self._stopped = False
+
+        # Contadores
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="message-writer")
+
+    async def put(self, user_id: int, username: str, room_id: int, content: str) -> dict:
+        """
+        Encola un mensaje. Sólo espera si la cola está llena.
+        Devuelve el registro del mensaje (mismo formato que el historial);
+        su 'id' queda en None hasta que el lote se escribe en la BD.
+        """
+        timestamp = _timestamp()
+        row = (user_id, room_id, content, timestamp)
+        record = {"id": None, "contenido": content, "timestamp": timestamp, "username": username}
+        if self._stopped:
+            # Ya no hay tarea de fondo: se escribe directamente
+            await self._flush([(row, record)])
+            return record
+
+        await self._queue.put((row, record))
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if depth >= self.max_batch:
+            self._batch_ready.set()
+        return record
+
+    async def sync(self):
+        """Espera a que todo lo encolado hasta ahora esté escrito (read-your-writes)."""
+        if self._task is None:
+            return
+        target = self.enqueued
+        # Adelantamos el próximo flush en lugar de esperar el intervalo completo
+        self._batch_ready.set()
+        async with self._flushed_cond:
+            await self._flushed_cond.wait_for(lambda: self.flushed + self.failed >= target)
+
+    async def stop(self):
+        """Deja de aceptar mensajes en cola y vacía lo pendiente en la BD."""
+        if self._task is None or self._stopped:
+            return
+        self._stopped = True
+        await self._queue.put(_STOP)
+        self._batch_ready.set()
+        await self._task
+        self._task = None
+        log.info("MessageWriter detenido. %s", self.stats())
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is not _STOP and self._queue.qsize() < self.max_batch - 1:
+                # Esperamos a que se junte un lote o venza el intervalo
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [] if first is _STOP else [first]
+            stopping = first is _STOP
+            while not self._queue.empty() and (stopping or len(batch) < self.max_batch):
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            # Al detener se escriben lotes de a max_batch hasta vaciar todo
+            for i in range(0, len(batch), self.max_batch):
+                await self._flush(batch[i:i + self.max_batch])
+            if stopping:
+                return
+
+    async def _flush(self, batch: list[tuple]):
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            ids = await db_manager.save_messages([row for row, _ in batch])
+        except Exception as e:
+            # save_messages ya deshizo la transacción: se reintenta fila por
+            # fila para que una fila inválida no se lleve al resto del lote
+            log.error("Error al persistir lote de %s mensajes (%s); reintentando de a uno.", len(batch), e)
+            saved = await self._flush_rows(batch)
+            self._notify([(row, record) for row, record in batch if record["id"] is not None])
+        else:
+            # Los registros compartidos (p. ej. con la caché de historial) reciben su id
+            for (_, record), message_id in zip(batch, ids):
+                record["id"] = message_id
+            saved = len(batch)
+            self._notify(batch)
+        if saved:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.flushed += saved
+            self.batches += 1
+            self.last_flush_ms = elapsed_ms
+            self._total_flush_ms += elapsed_ms
+            if elapsed_ms > self.max_flush_ms:
+                self.max_flush_ms = elapsed_ms
+        async with self._flushed_cond:
+            self._flushed_cond.notify_all()
+
+    async def _flush_rows(self, batch: list[tuple]) -> int:
+        """Escribe el lote de a una fila; devuelve cuántas se guardaron."""
+        saved = 0
+        for row, record in batch:
+            try:
+                (record["id"],) = await db_manager.save_messages([row])
+            except Exception as e:
+                self.failed += 1
+                log.error("Mensaje descartado (usuario %s, sala %s): %s", row[0], row[1], e)
+            else:
+                saved += 1
+        return saved
+
+    def _notify(self, batch: list[tuple]):
+        if self.on_flushed is None:
+            return
+        for row, record in batch:
+            try:
+                self.on_flushed(row[1], record)
+            except Exception as e:
+                log.error("Error notificando mensaje persistido: %s", e)
+
+    def stats(self) -> dict:
+        """Contadores de profundidad de cola y latencia de escritura."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 3) if self.batches else 0.0,
+        }